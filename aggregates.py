@@ -0,0 +1,301 @@
+import threading
+import time
+from datetime import date, datetime
+
+import numpy as np
+
+from storage import get_store
+from schema import INVALID_EARNINGS, SchemaError, coerce_earnings, event_lat_lon, parse_timestamp
+from metrics import EVENTS_INGESTED
+from profiling import span
+from clustering import ClusterIndex
+from columnar import ColumnarEvents, NO_DAY
+from event_index import DEFAULT_PAGE_SIZE, EventIndex
+from spatial import GridIndex
+from rollups import RollupIndex
+
+FOLLOW_POLL_INTERVAL = 1.0   # seconds between checks of a shared store when no notification arrives
+FOLLOW_BULK_SIZE = 256       # followed batches at least this large go through the vectorized load()
+
+def entry_datetime(entry):
+    """Returns the naive local datetime of an entry, or None if it has no valid timestamp."""
+    try:
+        return parse_timestamp(entry.get('timestamp'))
+    except SchemaError:
+        return None
+
+
+class AggregateState:
+    """Dashboard aggregates, built from one pass over the store and kept up to date on ingest.
+
+    Every read is a dictionary lookup, so the cost of a dashboard request does
+    not depend on how many events have been stored. The events themselves are
+    kept in a ColumnarEvents store for vectorized filters and point extraction.
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.changed = threading.Condition(self.lock)
+        self.version = 0
+        # Versions restart with the process; the epoch tells one run's from another's
+        self.epoch = format(time.time_ns() // 1000, 'x')
+        self.seq = 0  # last change sequence number folded in from a shared store
+        self._catch_up_lock = threading.Lock()
+        self.total_interactions = 0
+        self.total_earnings = 0.0
+        self.by_ad = {}    # ad_id -> [interactions, earnings]
+        self.rollups = RollupIndex()  # per-hour and per-day buckets
+        self.latest_timestamp = None
+        self.latest_coordinates = None  # (lat, lon) of the newest event
+        self.clusters = ClusterIndex()   # all-time map clusters
+        self.day_clusters = {}           # date -> ClusterIndex
+        self.columns = ColumnarEvents()
+        self.spatial = GridIndex(self.columns)  # coordinate grid and extent
+        self.index = EventIndex(self.columns, self.spatial)  # ad_id / interaction_type / day postings
+
+    def load(self, events, version=None):
+        """Bulk-loads stored events: one parsing pass, then vectorized aggregation."""
+        with self.lock:
+            start = len(self.columns)
+            with span('parse'):
+                for entry in events:
+                    self._append_row(entry)
+            with span('aggregate'):
+                self._aggregate_rows(start)
+                self.spatial.add_rows(start)
+                self.index.add_rows(start)
+            self._advance(version)
+
+    def load_summaries(self, summaries, version=None):
+        """Adds (date, summary) pairs of days whose raw events are no longer stored.
+
+        They count towards the totals, per-ad table and rollups; they have
+        no points, so they do not appear on the maps or in event queries.
+        """
+        with self.lock:
+            for day, summary in summaries:
+                self.total_interactions += summary['count']
+                self.total_earnings += summary['earnings']
+                for ad_id, (count, earnings) in summary['by_ad'].items():
+                    ad_totals = self.by_ad.setdefault(ad_id, [0, 0.0])
+                    ad_totals[0] += count
+                    ad_totals[1] += earnings
+                self.rollups.add_summary(day, summary)
+            self._advance(version)
+
+    def _aggregate_rows(self, start):
+        columns = self.columns
+        earnings = columns.column('earnings')[start:]
+        self.total_interactions += len(earnings)
+        self.total_earnings += float(earnings.sum())
+
+        rows = np.zeros(len(columns), dtype=bool)
+        rows[start:] = True
+        for ad_id, (count, total) in columns.group_by_ad(rows).items():
+            ad_totals = self.by_ad.setdefault(ad_id, [0, 0.0])
+            ad_totals[0] += count
+            ad_totals[1] += total
+
+        self.rollups.add_columns(columns, start)
+
+        lats, lons = columns.column('lat')[start:], columns.column('lon')[start:]
+        self.clusters.add_many(lats, lons, earnings)
+
+        # Per-day clusters: sort the new rows by day once and slice each day out
+        days = columns.column('day')[start:]
+        order = np.argsort(days, kind='stable')
+        unique_days, first_rows = np.unique(days[order], return_index=True)
+        bounds = list(first_rows) + [len(order)]
+        for i, day in enumerate(unique_days):
+            if day == NO_DAY:
+                continue
+            day_rows = order[bounds[i]:bounds[i + 1]]
+            day_index = self.day_clusters.setdefault(date.fromordinal(int(day)), ClusterIndex())
+            day_index.add_many(lats[day_rows], lons[day_rows], earnings[day_rows])
+
+    def apply(self, entries, version=None):
+        with self.lock:
+            for entry in entries:
+                self._apply(entry)
+            self.spatial.add_rows()
+            self.index.add_rows()
+            self._advance(version)
+
+    def _advance(self, version):
+        """Moves to `version` (by default the next one) and wakes everything waiting for a change.
+
+        Followers of a shared store pass its seq, so every process numbers
+        the same data the same way: SSE event ids, Last-Event-ID resumes and
+        the versions embedded in map pages then hold across workers.
+        """
+        self.version = self.version + 1 if version is None else version
+        self.changed.notify_all()
+
+    def wait_for_change(self, version, timeout=None):
+        """Blocks until the state moves past `version` or `timeout` expires; returns the current version."""
+        with self.lock:
+            self.changed.wait_for(lambda: self.version != version, timeout)
+            return self.version
+
+    def commit(self, store, entries):
+        """Writes entries to the store and folds them in, as one step for readers."""
+        if store.shared:
+            # Other processes write to it too: everything comes in through
+            # catch_up, in commit order, including what was just written
+            store.append_many(entries)
+            self.catch_up(store)
+        else:
+            with self.lock:
+                store.append_many(entries)
+                self.apply(entries)
+        EVENTS_INGESTED.inc(len(entries))
+
+    def follow(self, store):
+        """Loads a shared store and keeps folding in what any process commits to it."""
+        store.watch()  # before catching up, so no commit after it goes unnoticed
+        self.catch_up(store)
+        threading.Thread(target=self._follow_loop, args=(store,), name='shared-store-follower',
+                         daemon=True).start()
+
+    def _follow_loop(self, store):
+        while True:
+            try:
+                store.wait_for_change(FOLLOW_POLL_INTERVAL)
+                self.catch_up(store)
+            except Exception as e:
+                print(f"Error following shared store: {e}")
+                time.sleep(FOLLOW_POLL_INTERVAL)
+
+    def catch_up(self, store):
+        """Folds in the events committed to a shared store since the last call."""
+        with self._catch_up_lock:  # one reader at a time keeps rows in seq order
+            while True:
+                entries, seq = store.read_since(self.seq)
+                if not entries:
+                    return
+                with self.lock:
+                    if len(entries) >= FOLLOW_BULK_SIZE:
+                        self.load(entries, version=seq)
+                    else:
+                        self.apply(entries, version=seq)
+                    self.seq = seq
+
+    def _append_row(self, entry):
+        """Parses one entry into the columnar store; returns (timestamp, coords, earnings)."""
+        earnings = coerce_earnings(entry.get('earnings', INVALID_EARNINGS))
+        timestamp = entry_datetime(entry)
+        coords = event_lat_lon(entry)
+        lat, lon = coords if coords else (None, None)
+        self.columns.append(timestamp, lat, lon, entry.get('ad_id'), entry.get('interaction_type'), earnings)
+
+        timestamp_str = entry.get('timestamp') or ''
+        if self.latest_timestamp is None or timestamp_str >= self.latest_timestamp:
+            self.latest_timestamp = timestamp_str
+            self.latest_coordinates = coords
+        return timestamp, coords, earnings
+
+    def _apply(self, entry):
+        timestamp, coords, earnings = self._append_row(entry)
+        self.total_interactions += 1
+        self.total_earnings += earnings
+
+        ad_id = entry.get('ad_id')
+        if ad_id is not None:
+            ad_totals = self.by_ad.setdefault(ad_id, [0, 0.0])
+            ad_totals[0] += 1
+            ad_totals[1] += earnings
+
+        day = timestamp.date() if timestamp else None
+        if day is not None:
+            self.rollups.add(timestamp, ad_id, entry.get('interaction_type'), earnings)
+
+        if coords:
+            self.clusters.add(coords[0], coords[1], earnings)
+            if day is not None:
+                day_index = self.day_clusters.get(day)
+                if day_index is None:
+                    day_index = self.day_clusters[day] = ClusterIndex()
+                day_index.add(coords[0], coords[1], earnings)
+
+    # --- reads ---
+
+    def table(self):
+        with self.lock:
+            return [
+                {'ad_id': ad_id, 'Interactions': counts[0], 'Earnings': counts[1]}
+                for ad_id, counts in sorted(self.by_ad.items(), key=lambda item: str(item[0]))
+            ]
+
+    def today(self):
+        """Returns (interactions, earnings) for the current local date."""
+        with self.lock:
+            bucket = self.rollups.day(datetime.now().date())
+            return bucket.count, bucket.earnings
+
+    def rollup_range(self, start, end):
+        with self.lock:
+            return self.rollups.range(start, end)
+
+    def rollup_series(self, start, end, granularity):
+        with self.lock:
+            return self.rollups.series(start, end, granularity)
+
+    def point_array(self, day=None, bbox=None):
+        """(n, 2) array of event [lat, lon] rows, optionally of one local date and/or inside a bbox."""
+        with self.lock:
+            if bbox is None:
+                mask = self.columns.day_mask(day) if day is not None else None
+                return self.columns.points(mask)
+            rows = self.spatial.rows_in_bbox(bbox)
+            if day is not None:
+                rows = rows[self.columns.column('day')[rows] == day.toordinal()]
+            return np.column_stack((self.columns.column('lat')[rows], self.columns.column('lon')[rows]))
+
+    def extent(self):
+        """[[south, west], [north, east]] of every event with coordinates, or None."""
+        with self.lock:
+            return self.spatial.extent()
+
+    def query_events(self, start=None, end=None, ad_id=None, interaction_type=None, bbox=None,
+                     after=-1, limit=DEFAULT_PAGE_SIZE, near=None):
+        """One page of matching events: (iterator of event dicts, last row id, more pages remain)."""
+        with self.lock:
+            rows, more = self.index.query(start, end, ad_id, interaction_type, bbox, after, limit, near)
+            last_row = int(rows[-1]) if len(rows) else None
+            return self.index.events(rows), last_row, more
+
+    def events_since(self, row, limit):
+        """Events stored at row `row` and after, read together with the version they bring the state to.
+
+        Returns (event dicts, or None when there are more than `limit`; next row; version).
+        """
+        with self.lock:
+            end = len(self.columns)
+            if end - row > limit:
+                return None, end, self.version
+            return list(self.index.events(np.arange(row, end, dtype=np.int64))), end, self.version
+
+
+_aggregates = None
+_aggregates_lock = threading.Lock()
+
+
+def get_aggregates(data_file='data.json'):
+    """Returns the process-wide aggregate state, loading it from the store on first use."""
+    global _aggregates
+    if _aggregates is None:
+        with _aggregates_lock:
+            if _aggregates is None:
+                state = AggregateState()
+                store = get_store(data_file)
+                if store.shared:
+                    # Versions follow the store's seq, the same in every worker and across
+                    # restarts, so the epoch is the store's and the summaries must not move it
+                    state.epoch = store.epoch
+                    state.load_summaries(store.expired_summaries(), version=0)
+                    state.follow(store)
+                else:
+                    state.load_summaries(store.expired_summaries())
+                    state.load(store.iter_events())
+                _aggregates = state
+    return _aggregates
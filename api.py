@@ -1,13 +1,33 @@
 from flask import jsonify, request, abort, Response
+from werkzeug.exceptions import HTTPException
 import json
 import os
 import requests
 from datetime import datetime
-import pandas as pd
-from flask import stream_with_context
+from storage import get_store
+from aggregates import get_aggregates
+from broadcast import Broadcaster
+from ingest import ACK_DURABLE, ACK_ENQUEUED, ACK_MODES, IngestBusy, IngestFailed, IngestQueue
+from clustering import MAX_ZOOM, MIN_ZOOM, SeedPoints, merge_clusters
+from event_index import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE
+from export import EXPORT_FORMATS, csv_chunks, encode_chunks, export_rows, filter_events, ndjson_chunks
+from dedup import DedupIndex
+from metrics import PARSE_FAILURES, QR_REDEMPTIONS
+from profiling import span
+from readers import iter_ndjson
+from schema import SchemaError, normalize_event
+from qr_codes import LEGACY_AD_ID, LEGACY_PLACEMENT, InvalidCode, RedemptionCode, load_secret, verify_code
 
 DATA_FILE = 'data.json'
-connected_clients = set()
+COORDS_FILE = 'coords.csv'
+COORDS_NORMALIZED_FILE = 'coords.jsonl'  # written by migrate.py
+seed_points = SeedPoints(COORDS_FILE, COORDS_NORMALIZED_FILE)
+connected_clients = set()  # live SSE subscribers of /api/events
+_broadcaster = None
+_ingest_queue = None
+_qr_secret = None
+qr_dedup = DedupIndex()  # (code, device) pairs redeemed within the TTL
+REDEEM_CLIENT_COOKIE = 'adwalk_client'  # set by /qr-redeem, identifies a scanning device
 
 EARNINGS_BY_TYPE = {
     'SWIPE_UP': 0.05,
@@ -16,116 +36,294 @@ EARNINGS_BY_TYPE = {
     'qr': 1.00
 }
 DEFAULT_EARNINGS = 0.20  # fallback if type not found
+DEFAULT_LAT_LON = (37.8760, -122.2588)  # Updated Berkeley coordinates
+MAX_BATCH_SIZE = 50000  # events accepted by one /api/data/batch request
+
+def iter_events():
+    """Streams every stored event through the storage layer behind DATA_FILE, one at a time."""
+    return get_store(DATA_FILE).iter_events()
 
 def get_latest_coordinates():
-    """Gets the coordinates of the most recent entry in data.json."""
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list) and data:
-                    # Sort by timestamp (assuming ISO format allows string comparison)
-                    # Or parse to datetime if needed for robustness
-                    latest_entry = max(data, key=lambda x: x.get('timestamp', ''))
-                    return latest_entry.get('coordinates')
-        except (json.JSONDecodeError, IOError, ValueError) as e:
-            print(f"Error getting latest coordinates: {e}")
-    return None
+    """Gets the (lat, lon) of the most recent stored entry."""
+    return get_aggregates(DATA_FILE).latest_coordinates
+
+def latest_coords_payload():
+    coords = get_latest_coordinates()
+    return {'lat': coords[0], 'lng': coords[1]} if coords else None
+
+def build_dashboard_payload(data_updated, points=None, since=None):
+    """One SSE message: dashboard totals plus, for an update, the events added since version `since`.
+
+    points is None when there is no delta to apply (a fresh connection, or
+    too many new events); map pages then reload instead of patching.
+    """
+    return {
+        'table': get_data_as_table(),
+        'total_earnings': get_total_earnings(),
+        'earnings_today': get_earnings_today(),
+        'interactions_today': get_interactions_today(),
+        'total_interactions': get_total_interactions(),
+        'data_updated': data_updated,
+        'latest_coords': latest_coords_payload() if data_updated else None,
+        'points': points,
+        'since': since,
+        'timestamp': datetime.now().isoformat()
+    }
+
+def get_clusters(zoom, scope='all', bbox=None):
+    """Server-side clusters for one zoom level; 'all' includes the coords.csv points."""
+    state = get_aggregates(DATA_FILE)
+    with span('aggregate'), state.lock:
+        if scope == 'today':
+            today_index = state.day_clusters.get(datetime.now().date())
+            indexes = [today_index] if today_index else []
+        else:
+            indexes = [state.clusters, seed_points.refresh().index]
+        return merge_clusters(indexes, zoom, bbox)
+
+def parse_bbox(bbox_str):
+    """Parses 'south,west,north,east' into [[south, west], [north, east]]."""
+    if not bbox_str:
+        return None
+    try:
+        south, west, north, east = (float(part) for part in bbox_str.split(','))
+    except ValueError:
+        abort(400, description="bbox must be south,west,north,east")
+    return [[south, west], [north, east]]
+
+def parse_near(near_str, radius_str):
+    """Parses near='lat,lon' and radius (meters) into (lat, lon, radius_m)."""
+    if not near_str:
+        return None
+    try:
+        lat, lon = (float(part) for part in near_str.split(','))
+        radius_m = float(radius_str)
+    except (TypeError, ValueError):
+        abort(400, description="near must be lat,lon and radius a distance in meters")
+    if radius_m <= 0:
+        abort(400, description="radius must be positive")
+    return lat, lon, radius_m
+
+def parse_time_range(start_str, end_str):
+    """Parses ISO start/end query values; defaults to today from local midnight to now."""
+    now = datetime.now()
+    try:
+        start = datetime.fromisoformat(start_str) if start_str else datetime.combine(now.date(), datetime.min.time())
+        end = datetime.fromisoformat(end_str) if end_str else now
+    except ValueError:
+        abort(400, description="start and end must be ISO 8601 timestamps")
+    if start.tzinfo or end.tzinfo:
+        abort(400, description="start and end are local times and must not carry a UTC offset")
+    if end < start:
+        abort(400, description="end must not be before start")
+    return start, end
+
+def parse_optional_time(value, name):
+    """Parses an optional ISO local time query value."""
+    if not value:
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except ValueError:
+        abort(400, description=f"{name} must be an ISO 8601 timestamp")
+    if timestamp.tzinfo:
+        abort(400, description=f"{name} is a local time and must not carry a UTC offset")
+    return timestamp
+
+def stream_query_page(events, next_cursor):
+    """Writes one page of query results as JSON, one event at a time."""
+    yield '{"next_cursor": %s, "events": [' % json.dumps(next_cursor)
+    count = 0
+    for event in events:
+        yield (',\n' if count else '\n') + json.dumps(event)
+        count += 1
+    yield '\n], "count": %d}\n' % count
+
+def get_broadcaster():
+    global _broadcaster
+    if _broadcaster is None:
+        _broadcaster = Broadcaster(get_aggregates(DATA_FILE), build_dashboard_payload, connected_clients)
+    return _broadcaster
+
+def get_ingest_queue():
+    global _ingest_queue
+    if _ingest_queue is None:
+        _ingest_queue = IngestQueue(get_aggregates(DATA_FILE), get_store(DATA_FILE))
+    return _ingest_queue
+
+def ingest_queue_depth():
+    # Read without creating the queue, which would load the store
+    return _ingest_queue.pending() if _ingest_queue is not None else 0
+
+def get_qr_secret():
+    global _qr_secret
+    if _qr_secret is None:
+        _qr_secret = load_secret()
+    return _qr_secret
+
+def redemption_client():
+    """Which device is scanning: the /qr-redeem cookie, else its address and user agent."""
+    return request.cookies.get(REDEEM_CLIENT_COOKIE) or f"{request.remote_addr}|{request.user_agent.string}"
+
+def parse_ack():
+    """Ack mode from ?ack= or the X-Ack header; defaults to a durable ack."""
+    ack = request.args.get('ack') or request.headers.get('X-Ack') or ACK_DURABLE
+    if ack not in ACK_MODES:
+        abort(400, description=f"ack must be one of: {', '.join(ACK_MODES)}")
+    return ack
+
+def ingest(entries, ack):
+    """Hands entries to the single writer; returns the HTTP status for the ack mode."""
+    try:
+        with span('write'):  # with a durable ack, this waits for the group commit
+            get_ingest_queue().submit(entries, ack)
+    except IngestBusy as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        abort(response)
+    except IngestFailed as e:
+        abort(500, description=f"Events were not stored: {e}")
+    return 202 if ack == ACK_ENQUEUED else 200
 
 def init_api_routes(app):
     @app.route('/api/events')
     def events():
-        def generate():
-            last_data_count = 0
-            
-            while True:
-                try:
-                    # Get current data
-                    table = get_data_as_table()
-                    total = get_total_earnings()
-                    today = get_earnings_today()
-                    interactions_today = get_interactions_today()
-                    total_interactions = get_total_interactions()
-                    
-                    # Check if data count has changed (new data added)
-                    data_updated = total_interactions != last_data_count
-                    last_data_count = total_interactions
-                    
-                    latest_coords = None
-                    if data_updated:
-                        latest_coords_str = get_latest_coordinates()
-                        if latest_coords_str:
-                            try:
-                                # Basic parsing assuming format '(lat, lng)'
-                                lat_str, lng_str = latest_coords_str.strip('()').split(',')
-                                latest_coords = {'lat': float(lat_str), 'lng': float(lng_str)}
-                            except ValueError:
-                                print(f"Could not parse latest coords: {latest_coords_str}")
-
-                    data = {
-                        'table': table,
-                        'total_earnings': total,
-                        'earnings_today': today,
-                        'interactions_today': interactions_today,
-                        'total_interactions': total_interactions,
-                        'data_updated': data_updated,
-                        'latest_coords': latest_coords,
-                        'timestamp': datetime.now().isoformat()
-                    }
-                    
-                    yield f"data: {json.dumps(data)}\n\n"
-                except Exception as e:
-                    print(f"Error in event stream: {e}")
-                    break
-                
-        return Response(stream_with_context(generate()), mimetype='text/event-stream')
+        # EventSource sends Last-Event-ID on reconnect so the client can resume
+        last_event_id = request.headers.get('Last-Event-ID')
+        broadcaster = get_broadcaster()
+        subscriber = broadcaster.subscribe(last_event_id)
+        response = Response(broadcaster.stream(subscriber), mimetype='text/event-stream')
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/api/events/query')
+    def query_events():
+        """Pages through stored events, oldest first, filtered by time range, ad, type and location.
+
+        Location is a bbox=south,west,north,east and/or near=lat,lon with a
+        radius in meters.
+
+        Pass the returned next_cursor as ?cursor= to fetch the following page;
+        it is null on the last page. Pages stay stable while new events arrive.
+        """
+        start = parse_optional_time(request.args.get('start'), 'start')
+        end = parse_optional_time(request.args.get('end'), 'end')
+        bbox = parse_bbox(request.args.get('bbox'))
+        near = parse_near(request.args.get('near'), request.args.get('radius'))
+        limit = request.args.get('limit')
+        try:
+            limit = int(limit) if limit else DEFAULT_PAGE_SIZE
+        except ValueError:
+            limit = None
+        if limit is None or not 1 <= limit <= MAX_PAGE_SIZE:
+            abort(400, description=f"limit must be between 1 and {MAX_PAGE_SIZE}")
+        cursor = request.args.get('cursor')
+        try:
+            after = int(cursor) if cursor else -1
+        except ValueError:
+            after = None
+        if after is None or after < -1:
+            abort(400, description="cursor must be a value returned as next_cursor")
+        events, last_row, more = get_aggregates(DATA_FILE).query_events(
+            start, end, request.args.get('ad_id'), request.args.get('interaction_type'), bbox, after, limit, near)
+        next_cursor = str(last_row) if more else None
+        return Response(stream_query_page(events, next_cursor), mimetype='application/json')
+
+    @app.route('/api/export')
+    def export_events():
+        """Streams stored events as CSV (default) or NDJSON, optionally gzip-compressed.
+
+        Takes the same start/end, ad_id and interaction_type filters as the
+        query API. Events are read straight from storage a chunk at a time,
+        so a large export neither holds the aggregate lock nor grows memory.
+        """
+        export_format = request.args.get('format', 'csv')
+        if export_format not in EXPORT_FORMATS:
+            abort(400, description=f"format must be one of: {', '.join(EXPORT_FORMATS)}")
+        compress = request.args.get('compress')
+        if compress not in (None, '', 'gzip'):
+            abort(400, description="compress must be 'gzip' or omitted")
+        start = parse_optional_time(request.args.get('start'), 'start')
+        end = parse_optional_time(request.args.get('end'), 'end')
+
+        events = get_store(DATA_FILE).iter_events(start.date() if start else None, end.date() if end else None)
+        rows = export_rows(filter_events(events, start, end, request.args.get('ad_id'),
+                                         request.args.get('interaction_type')), price_for)
+        chunks = csv_chunks(rows) if export_format == 'csv' else ndjson_chunks(rows)
+        filename = f"adwalk-events.{export_format}"
+        mimetype = EXPORT_FORMATS[export_format]
+        if compress:
+            filename += '.gz'
+            mimetype = 'application/gzip'
+        response = Response(encode_chunks(chunks, bool(compress)), mimetype=mimetype)
+        response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+        response.headers['X-Accel-Buffering'] = 'no'
+        return response
+
+    @app.route('/api/clusters')
+    def clusters():
+        scope = request.args.get('scope', 'all')
+        if scope not in ('all', 'today'):
+            abort(400, description="scope must be 'all' or 'today'")
+        try:
+            zoom = int(request.args.get('zoom', 14))
+        except ValueError:
+            zoom = None
+        if zoom is None or not MIN_ZOOM <= zoom <= MAX_ZOOM:
+            abort(400, description=f"zoom must be an integer from {MIN_ZOOM} to {MAX_ZOOM}")
+        bbox = parse_bbox(request.args.get('bbox'))
+        return jsonify({
+            'scope': scope,
+            'zoom': zoom,
+            'clusters': get_clusters(zoom, scope, bbox)
+        })
+
+    @app.route('/api/rollups')
+    def rollups():
+        """Totals and per-hour or per-day series for a local time range, served from the rollup index."""
+        start, end = parse_time_range(request.args.get('start'), request.args.get('end'))
+        granularity = request.args.get('granularity', 'hour')
+        if granularity not in ('hour', 'day'):
+            abort(400, description="granularity must be 'hour' or 'day'")
+        state = get_aggregates(DATA_FILE)
+        return jsonify({
+            'start': start.isoformat(),
+            'end': end.isoformat(),
+            'granularity': granularity,
+            'totals': state.rollup_range(start, end).to_dict(),
+            'series': [
+                dict(bucket.to_dict(), start=bucket_start.isoformat())
+                for bucket_start, bucket in state.rollup_series(start, end, granularity)
+            ]
+        })
 
     @app.route('/api/data', methods=['POST'])
     def handle_data():
         if not request.is_json:
             abort(400, description="Invalid JSON")
         
-        data = request.get_json()
-        interaction_type = data.get('interaction_type', '')
-        ad_id = data.get('ad_id', '')
-        timestamp = datetime.now().isoformat()
+        ack = parse_ack()
+        with span('parse'):
+            data = request.get_json()
+        new_entry = build_entry(data.get('interaction_type', ''), data.get('ad_id', ''), datetime.now().isoformat())
 
-        # Determine earnings based on interaction_type
-        earnings = EARNINGS_BY_TYPE.get(interaction_type, DEFAULT_EARNINGS)
-
-        new_entry = {
-            'coordinates': '(37.8760, -122.2588)',  # Updated Berkeley coordinates
-            'interaction_type': interaction_type,
-            'ad_id': ad_id,
-            'timestamp': timestamp,
-            'earnings': earnings
-        }
-
-        if os.path.exists(DATA_FILE):
-            with open(DATA_FILE, 'r+') as f:
-                try:
-                    existing_data = json.load(f)
-                    if not isinstance(existing_data, list):
-                        existing_data = [existing_data]
-                except json.JSONDecodeError:
-                    existing_data = []
-                existing_data.append(new_entry)
-                f.seek(0)
-                json.dump(existing_data, f, indent=2)
-                f.truncate()
-        else:
-            with open(DATA_FILE, 'w') as f:
-                json.dump([new_entry], f, indent=2)
+        # The writer thread appends it to the event log and updates the aggregates
+        # in place; with ack=enqueued we answer as soon as it has been queued
+        status = ingest([new_entry], ack)
 
         # Get updated data
-        updated_table = get_data_as_table()
-        updated_total = get_total_earnings()
-        updated_today = get_earnings_today()
-        interactions_today = get_interactions_today()
-        total_interactions = get_total_interactions()
+        with span('aggregate'):
+            updated_table = get_data_as_table()
+            updated_total = get_total_earnings()
+            updated_today = get_earnings_today()
+            interactions_today = get_interactions_today()
+            total_interactions = get_total_interactions()
 
         return jsonify({
-            'message': 'Data received and saved successfully',
+            'message': 'Data received and saved successfully' if status == 200 else 'Data received and queued',
+            'ack': ack,
             'received_data': new_entry,
             'method_used': request.method,
             'updated_data': {
@@ -135,15 +333,162 @@ def init_api_routes(app):
                 'interactions_today': interactions_today,
                 'total_interactions': total_interactions
             }
-        }), 200
+        }), status
+
+    @app.route('/api/qr/redeem', methods=['POST'])
+    def redeem_qr():
+        """Books one QR scan, at most once per code and device within the dedup TTL.
+
+        The code is checked by its signature alone and repeats are caught by
+        the in-memory dedup index, so a scan costs no storage reads. A
+        request without a code is a scan of the original unsigned QR code.
+        """
+        ack = parse_ack()
+        data = request.get_json(silent=True) or {}
+        if not isinstance(data, dict):
+            abort(400, description="Invalid JSON")
+        token = data.get('code')
+        if token:
+            try:
+                code = verify_code(get_qr_secret(), token)
+            except InvalidCode as e:
+                QR_REDEMPTIONS.inc(1, 'invalid')
+                abort(400, description=str(e))
+        else:
+            token = LEGACY_PLACEMENT
+            code = RedemptionCode(LEGACY_AD_ID, LEGACY_PLACEMENT, 0)
+
+        key = f"{token}|{redemption_client()}"
+        if qr_dedup.seen_or_add(key):
+            QR_REDEMPTIONS.inc(1, 'duplicate')
+            return jsonify({'redeemed': False, 'reason': 'duplicate', 'ad_id': code.ad_id}), 409
+
+        entry = build_entry('qr', code.ad_id, datetime.now().isoformat())
+        entry['placement'] = code.placement
+        try:
+            status = ingest([entry], ack)
+        except HTTPException:
+            # Not stored, so a retry must not count as a repeat
+            qr_dedup.forget(key)
+            QR_REDEMPTIONS.inc(1, 'failed')
+            raise
+        QR_REDEMPTIONS.inc(1, 'redeemed')
+        return jsonify({'redeemed': True, 'ad_id': code.ad_id, 'placement': code.placement,
+                        'earnings': entry['earnings']}), status
+
+    @app.route('/api/data/batch', methods=['POST'])
+    def handle_data_batch():
+        """Ingests many events in one request and one durable write.
+
+        Accepts a JSON array of events, or NDJSON (one event per line) when the
+        body is sent as application/x-ndjson, which is read as a stream.
+        """
+        ack = parse_ack()
+        # Reading and validating the body; NDJSON is parsed as it streams in
+        with span('parse'):
+            if request.mimetype == 'application/x-ndjson':
+                items = iter_batch_items(request.stream)
+            elif request.is_json:
+                items = request.get_json(silent=True)
+                if not isinstance(items, list):
+                    abort(400, description="Expected a JSON array of events")
+            else:
+                abort(400, description="Send a JSON array or application/x-ndjson")
+
+            now = datetime.now().isoformat()
+            entries = []
+            results = []
+            for index, item in enumerate(items):
+                if index >= MAX_BATCH_SIZE:
+                    abort(413, description=f"Batches are limited to {MAX_BATCH_SIZE} events")
+                entry, error = validate_batch_item(item, now)
+                if error:
+                    results.append({'index': index, 'status': 'error', 'error': error})
+                else:
+                    entries.append(entry)
+                    results.append({'index': index, 'status': 'ok', 'earnings': entry['earnings']})
+
+        # One submission, so the whole batch lands in a single group commit
+        status = ingest(entries, ack) if entries else 200
+
+        return jsonify({
+            'message': f"Accepted {len(entries)} of {len(results)} events",
+            'ack': ack,
+            'accepted': len(entries),
+            'rejected': len(results) - len(entries),
+            'results': results,
+            'updated_data': {
+                'total_earnings': get_total_earnings(),
+                'earnings_today': get_earnings_today(),
+                'interactions_today': get_interactions_today(),
+                'total_interactions': get_total_interactions()
+            }
+        }), status
+
+def price_for(interaction_type):
+    """Earnings for one interaction of the given type."""
+    return EARNINGS_BY_TYPE.get(interaction_type, DEFAULT_EARNINGS)
+
+def build_entry(interaction_type, ad_id, timestamp):
+    """Builds a stored event in the normalized schema, pricing it by interaction_type."""
+    return {
+        'timestamp': timestamp,
+        'lat': DEFAULT_LAT_LON[0],
+        'lon': DEFAULT_LAT_LON[1],
+        'ad_id': ad_id,
+        'interaction_type': interaction_type,
+        # Determine earnings based on interaction_type
+        'earnings': price_for(interaction_type)
+    }
+
+def iter_batch_items(stream):
+    """Items of an NDJSON batch body; a malformed line yields a ValueError in its place."""
+    errors = []
+
+    def on_error(position, message):
+        errors.append(ValueError(f"Invalid JSON: {message}"))
+
+    for item in iter_ndjson(stream, 'batch', on_error):
+        # The reader reports bad lines as it passes them, so they come before the next good one
+        yield from errors
+        errors.clear()
+        yield item
+    yield from errors
+
+def validate_batch_item(item, default_timestamp):
+    """Returns (entry, None) for a valid batch item or (None, error message)."""
+    if isinstance(item, ValueError):
+        return None, str(item)
+    if not isinstance(item, dict):
+        return None, "Event must be a JSON object"
+    interaction_type = item.get('interaction_type', '')
+    ad_id = item.get('ad_id', '')
+    if not isinstance(interaction_type, str) or not isinstance(ad_id, str):
+        return None, "interaction_type and ad_id must be strings"
+    # Buffered clients may send the time the interaction actually happened
+    timestamp = item.get('timestamp') or default_timestamp
+    try:
+        parsed = datetime.fromisoformat(timestamp)
+    except (TypeError, ValueError):
+        PARSE_FAILURES.inc(1, 'timestamp')
+        return None, "timestamp must be an ISO 8601 string"
+    if parsed.tzinfo is not None:
+        # Stored times are naive local time; convert instead of storing an offset no reader accepts
+        timestamp = parsed.astimezone().replace(tzinfo=None).isoformat()
+    entry = build_entry(interaction_type, ad_id, timestamp)
+    try:
+        normalize_event(entry)  # the same checks the store readers apply
+    except SchemaError as e:
+        PARSE_FAILURES.inc(1, e.field)
+        return None, str(e)
+    return entry, None
 
 def make_post_request(
-    url='http://localhost:5000/api/data',
+    url='http://localhost:3000/api/data',
     interaction_type='swipe',
     ad_id='default_ad'
 ):
     payload = {
-        'coordinates': '(37.8760, -122.2588)',  # Updated Berkeley coordinates
         'interaction_type': interaction_type,
         'ad_id': ad_id
     }
@@ -152,104 +497,16 @@ def make_post_request(
     return response.json(), response.status_code
 
 def get_data_as_table():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            try:
-                data = json.load(f)
-                if not isinstance(data, list):
-                    data = [data]
-                df = pd.DataFrame(data)
-                if not df.empty:
-                    # Ensure earnings column is numeric, default to 0.20 if missing/invalid
-                    df['earnings'] = pd.to_numeric(df['earnings'], errors='coerce').fillna(0.20)
-                    summary = (
-                        df.groupby('ad_id')
-                        .agg(Interactions=('ad_id', 'size'), Earnings=('earnings', 'sum'))
-                        .reset_index()
-                    )
-                    return summary.to_dict(orient='records')
-                else:
-                    return []
-            except (json.JSONDecodeError, IOError): # Added IOError
-                print(f"Error reading/parsing {DATA_FILE} for table")
-                return [] # Return empty on error
-    else:
-        return []
+    return get_aggregates(DATA_FILE).table()
 
 def get_total_earnings():
-    total_earnings = 0.0
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            try:
-                data = json.load(f)
-                if isinstance(data, list):
-                    # Sum 'earnings', defaulting to 0.20 if missing or invalid
-                    total_earnings = sum(float(entry.get('earnings', 0.20)) for entry in data if isinstance(entry.get('earnings', 0.20), (int, float, str)) and str(entry.get('earnings', 0.20)).replace('.', '', 1).isdigit())
-            except (json.JSONDecodeError, IOError):
-                print(f"Error reading/parsing {DATA_FILE} for total earnings")
-                pass # Return 0.0 on error
-    return total_earnings
+    return get_aggregates(DATA_FILE).total_earnings
 
 def get_earnings_today():
-    today_date = datetime.now().date()
-    earnings_today = 0.0
-
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    for entry in data:
-                        try:
-                            entry_ts = datetime.fromisoformat(entry.get('timestamp', '')).date()
-                            if entry_ts == today_date:
-                                # Add earnings, defaulting to 0.20 if missing or invalid
-                                earnings_val = entry.get('earnings', 0.20)
-                                if isinstance(earnings_val, (int, float, str)) and str(earnings_val).replace('.', '', 1).isdigit():
-                                    earnings_today += float(earnings_val)
-                                else:
-                                     earnings_today += 0.20 # Default if invalid format
-                        except (ValueError, TypeError):
-                            continue # Ignore invalid timestamps or earnings format errors within the loop
-        except (json.JSONDecodeError, IOError):
-            print(f"Error reading/parsing {DATA_FILE} for today's earnings")
-            # Return 0.0 on error reading the file
-
-    return earnings_today
+    return get_aggregates(DATA_FILE).today()[1]
 
 def get_interactions_today():
-    today_date = datetime.now().date()
-    data_today_count = 0
-
-    # Count today's entries in data.json
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    for entry in data:
-                        try:
-                            entry_ts = datetime.fromisoformat(entry.get('timestamp', '')).date()
-                            if entry_ts == today_date:
-                                data_today_count += 1
-                        except (ValueError, TypeError):
-                            continue # Ignore invalid timestamps
-        except (json.JSONDecodeError, IOError):
-            print(f"Error reading/parsing {DATA_FILE} for today's count")
-            
-    return data_today_count
+    return get_aggregates(DATA_FILE).today()[0]
 
 def get_total_interactions():
-    data_count = 0
-
-    # Count total entries in data.json
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    data_count = len(data)
-        except (json.JSONDecodeError, IOError):
-             print(f"Error reading/parsing {DATA_FILE} for total count")
-             
-    return data_count
+    return get_aggregates(DATA_FILE).total_interactions
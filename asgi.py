@@ -0,0 +1,192 @@
+"""Asyncio (ASGI) serving mode.
+
+    uvicorn asgi:application --host 0.0.0.0 --port 3000
+
+or simply `python asgi.py`. /api/events is served natively: each SSE stream
+is a coroutine waiting on its own small queue, and one hub wakes the event
+loop once per published update whatever the number of clients. Every other
+route is the regular Flask app, run on a bounded thread pool through
+asgiref's WSGI adapter, so blocking file and folium work never stalls the
+loop and slow requests do not queue behind each other.
+Requires `pip install asgiref uvicorn`.
+"""
+import asyncio
+import collections
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from asgiref.sync import sync_to_async
+    from asgiref.wsgi import WsgiToAsgiInstance
+except ImportError:  # pragma: no cover - optional dependency
+    WsgiToAsgiInstance = None
+
+from broadcast import HEARTBEAT, RETRY_MS, SUBSCRIBER_QUEUE_SIZE
+from main import app
+from api import get_broadcaster, get_ingest_queue
+
+MAX_SSE_CLIENTS = 10000      # streams refused beyond this, keeping memory bounded
+SHUTDOWN_DRAIN_TIMEOUT = 10.0  # seconds to wait for queued events to be written on shutdown
+SSE_IDLE_TIMEOUT = 30.0      # send a heartbeat if a client's queue stays empty this long
+WSGI_THREADS = 32            # Flask requests served at once; more wait for a free thread
+
+
+class AsyncHub:
+    """Moves messages from the broadcaster thread onto the event loop in batches."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._pending = []
+        self._lock = threading.Lock()
+        self._scheduled = False
+
+    def deliver(self, subscriber, message, coalesce):
+        with self._lock:
+            self._pending.append((subscriber, message, coalesce))
+            if self._scheduled:
+                return
+            self._scheduled = True
+        self.loop.call_soon_threadsafe(self._flush)
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, []
+            self._scheduled = False
+        for subscriber, message, coalesce in pending:
+            subscriber.offer_local(message, coalesce)
+
+
+class AsyncSubscriber:
+    """An SSE client living on the event loop; same coalescing rules as broadcast.Subscriber."""
+
+    def __init__(self, hub, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.hub = hub
+        self.maxsize = maxsize
+        self.messages = collections.deque()
+        self.ready = asyncio.Event()
+        self.dropped = 0
+
+    def offer(self, message, coalesce=True):
+        # Called from the broadcaster thread
+        self.hub.deliver(self, message, coalesce)
+
+    def offer_local(self, message, coalesce):
+        if len(self.messages) >= self.maxsize:
+            if not coalesce:
+                return
+            self.messages.popleft()
+            self.dropped += 1
+        self.messages.append(message)
+        self.ready.set()
+
+    async def get(self, timeout):
+        if not self.messages:
+            self.ready.clear()
+            await asyncio.wait_for(self.ready.wait(), timeout)
+        return self.messages.popleft()
+
+
+if WsgiToAsgiInstance is not None:
+    class PooledWsgiInstance(WsgiToAsgiInstance):
+        """asgiref's per-request WSGI adapter, calling the app on our pool.
+
+        asgiref runs every request on its one thread-sensitive thread, so a
+        slow render, a durable POST waiting on fsync or a long export would
+        hold up every other request.
+        """
+
+        def __init__(self, wsgi_application, executor):
+            super().__init__(wsgi_application)
+            self.executor = executor
+
+        async def run_wsgi_app(self, body):
+            run = WsgiToAsgiInstance.__dict__['run_wsgi_app'].func  # the undecorated method
+            await sync_to_async(run, thread_sensitive=False, executor=self.executor)(self, body)
+
+
+class Application:
+    def __init__(self, flask_app, threads=WSGI_THREADS):
+        if WsgiToAsgiInstance is None:
+            raise RuntimeError("The ASGI serving mode needs asgiref: pip install asgiref uvicorn")
+        self.flask_app = flask_app
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.hub = None
+        self.streams = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and scope['path'] == '/api/events' and scope['method'] == 'GET':
+            await self.events(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+        else:
+            await PooledWsgiInstance(self.flask_app, self.executor)(scope, receive, send)
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # Events acknowledged with ack=enqueued must still reach the disk
+                loop = asyncio.get_running_loop()
+                await loop.run_in_executor(None, get_ingest_queue().drain, SHUTDOWN_DRAIN_TIMEOUT)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def events(self, scope, receive, send):
+        if self.streams >= MAX_SSE_CLIENTS:
+            await send({'type': 'http.response.start', 'status': 503,
+                        'headers': [(b'retry-after', b'5'), (b'content-type', b'text/plain')]})
+            await send({'type': 'http.response.body', 'body': b'Too many event streams'})
+            return
+
+        loop = asyncio.get_running_loop()
+        if self.hub is None:
+            self.hub = AsyncHub(loop)
+        last_event_id = None
+        for name, value in scope.get('headers', []):
+            if name == b'last-event-id':
+                last_event_id = value.decode('latin-1')
+
+        broadcaster = get_broadcaster()
+        subscriber = AsyncSubscriber(self.hub)
+        # Subscribing builds the first snapshot, which may load the store
+        await loop.run_in_executor(None, broadcaster.subscribe, last_event_id, subscriber)
+        self.streams += 1
+        disconnected = asyncio.Event()
+
+        async def watch_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            disconnected.set()
+            subscriber.ready.set()
+
+        watcher = asyncio.ensure_future(watch_disconnect())
+        try:
+            await send({'type': 'http.response.start', 'status': 200, 'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ]})
+            await send({'type': 'http.response.body', 'body': f"retry: {RETRY_MS}\n\n".encode(), 'more_body': True})
+            while not disconnected.is_set():
+                try:
+                    message = await subscriber.get(SSE_IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    message = HEARTBEAT
+                except IndexError:
+                    continue  # woken by the disconnect watcher
+                await send({'type': 'http.response.body', 'body': message.encode(), 'more_body': True})
+        except OSError:
+            pass  # client went away mid-send
+        finally:
+            watcher.cancel()
+            broadcaster.unsubscribe(subscriber)
+            self.streams -= 1
+
+
+application = Application(app)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(application, host='0.0.0.0', port=3000)
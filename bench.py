@@ -0,0 +1,428 @@
+"""Reproducible benchmarks for ingest, SSE fan-out and map/page rendering.
+
+    python bench.py generate --sizes 10000 100000 1000000
+    python bench.py run --dataset bench_data/100000 --spawn
+    python bench.py run --dataset bench_data/100000 --spawn --server asgi
+    python bench.py run --url http://localhost:3000
+    python bench.py compare bench_results/old.json bench_results/new.json
+
+`generate` writes seeded synthetic data.json / coords.csv datasets around the
+Berkeley campus box, ending at a fixed --anchor time so the same seed gives
+the same dataset on any day; `--anchor now` puts the last day on today
+instead (so /map_today has data) at the cost of that reproducibility. The
+anchor is recorded in the dataset's bench_dataset.json and in reports. `run` drives a local instance, either one already
+listening on --url or, with --spawn, a fresh server started inside the
+dataset directory, and writes a JSON report to bench_results/. Everything
+uses the standard library and talks only to localhost.
+"""
+import argparse
+import http.client
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import urlparse
+
+# UC Berkeley campus box, as forced by /map_today
+BERKELEY_BOX = ((37.8651, -122.2689), (37.8766, -122.2489))
+AD_IDS = ('google_lens', 'openai_bci', 'ozempic', 'qr_default')
+INTERACTION_TYPES = {'SWIPE_UP': 0.05, 'SWIPE_DOWN': 0.05, 'SWIPE_RIGHT': 0.20, 'qr': 1.00}
+DEFAULT_SIZES = (10000, 100000, 1000000)
+DEFAULT_ANCHOR = '2025-01-31T18:00:00'  # datasets end here unless --anchor says otherwise
+DATASET_META = 'bench_dataset.json'
+RESULTS_DIR = 'bench_results'
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+# --- dataset generation ---
+
+def generate_dataset(out_dir, size, days=30, seed=0, anchor=DEFAULT_ANCHOR):
+    """Writes data.json (legacy array) and coords.csv with `size` events spread over the `days` days before `anchor`."""
+    rng = random.Random(seed)
+    os.makedirs(out_dir, exist_ok=True)
+    (south, west), (north, east) = BERKELEY_BOX
+    end = datetime.now() if anchor == 'now' else datetime.fromisoformat(anchor)
+    end = end.replace(microsecond=0)
+    start = end - timedelta(days=days)
+    span = (end - start).total_seconds()
+    offsets = sorted(rng.random() * span for _ in range(size))
+    types = list(INTERACTION_TYPES)
+
+    with open(os.path.join(out_dir, 'data.json'), 'w') as f:
+        f.write('[')
+        for i, offset in enumerate(offsets):
+            interaction_type = rng.choice(types)
+            entry = {
+                'coordinates': f"({rng.uniform(south, north):.6f}, {rng.uniform(west, east):.6f})",
+                'interaction_type': interaction_type,
+                'ad_id': rng.choice(AD_IDS),
+                'timestamp': (start + timedelta(seconds=offset)).isoformat(),
+                'earnings': INTERACTION_TYPES[interaction_type],
+            }
+            f.write((',\n  ' if i else '\n  ') + json.dumps(entry))
+        f.write('\n]\n')
+
+    with open(os.path.join(out_dir, 'coords.csv'), 'w') as f:
+        f.write('date,lat,lon\n')
+        for _ in range(max(1, size // 100)):
+            day = (start + timedelta(seconds=rng.random() * span)).date().isoformat()
+            f.write(f"{day},{rng.uniform(south, north)},{rng.uniform(west, east)}\n")
+    with open(os.path.join(out_dir, DATASET_META), 'w') as f:
+        json.dump({'size': size, 'days': days, 'seed': seed, 'anchor': end.isoformat()}, f, indent=2)
+    print(f"Wrote {size} events to {out_dir}")
+
+
+def dataset_meta(dataset):
+    """What a dataset was generated with, or None for one not written by `generate`."""
+    try:
+        with open(os.path.join(dataset, DATASET_META)) as f:
+            return json.load(f)
+    except (OSError, TypeError, ValueError):
+        return None
+
+
+# --- HTTP helpers ---
+
+class Client:
+    """One persistent HTTP connection to the instance under test."""
+
+    def __init__(self, base_url, timeout=60):
+        url = urlparse(base_url)
+        self.host, self.port = url.hostname, url.port or 80
+        self.timeout = timeout
+        self.conn = http.client.HTTPConnection(self.host, self.port, timeout=timeout)
+
+    def request(self, method, path, body=None, headers=None):
+        """Returns (status, body bytes, seconds)."""
+        start = time.perf_counter()
+        try:
+            self.conn.request(method, path, body=body, headers=headers or {})
+            response = self.conn.getresponse()
+            data = response.read()
+        except (http.client.HTTPException, OSError):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            raise
+        return response.status, data, time.perf_counter() - start
+
+    def post_json(self, path, payload):
+        return self.request('POST', path, json.dumps(payload), {'Content-Type': 'application/json'})
+
+
+def summarize(latencies):
+    if not latencies:
+        return {'count': 0}
+    ordered = sorted(latencies)
+
+    def percentile(p):
+        return round(ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))] * 1000, 3)
+
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': percentile(50),
+        'p90_ms': percentile(90),
+        'p99_ms': percentile(99),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def random_event(rng):
+    return {'interaction_type': rng.choice(list(INTERACTION_TYPES)), 'ad_id': rng.choice(AD_IDS)}
+
+
+# --- benchmarks ---
+
+def bench_ingest(base_url, requests_total, concurrency, batch_size, seed=1):
+    """Concurrent POSTs to /api/data (or /api/data/batch when batch_size > 1)."""
+    per_worker = requests_total // concurrency
+    latencies, errors = [], []
+    lock = threading.Lock()
+
+    def worker(worker_id):
+        rng = random.Random(seed + worker_id)
+        client = Client(base_url)
+        mine, failed = [], 0
+        for _ in range(per_worker):
+            try:
+                if batch_size > 1:
+                    status, _, seconds = client.post_json('/api/data/batch', [random_event(rng) for _ in range(batch_size)])
+                else:
+                    status, _, seconds = client.post_json('/api/data', random_event(rng))
+            except (http.client.HTTPException, OSError):
+                failed += 1
+                continue
+            if status != 200:
+                failed += 1
+            mine.append(seconds)
+        with lock:
+            latencies.extend(mine)
+            errors.append(failed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - start
+    events = len(latencies) * max(1, batch_size)
+    return dict(summarize(latencies), errors=sum(errors), concurrency=concurrency, batch_size=batch_size,
+                seconds=round(elapsed, 3), events_per_second=round(events / elapsed, 1))
+
+
+def bench_sse(base_url, subscribers, events, interval):
+    """Event-to-dashboard latency: time from a POST to its update arriving on every open stream."""
+    url = urlparse(base_url)
+    posted_at = {}       # total_interactions after the POST -> perf_counter at the POST
+    received = []        # (total_interactions, perf_counter) across all subscribers
+    lock = threading.Lock()
+    ready = threading.Barrier(subscribers + 1)
+    stop = threading.Event()
+
+    def subscriber():
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=interval * events + 30)
+        conn.request('GET', '/api/events')
+        response = conn.getresponse()
+        waiting = True
+        try:
+            while not stop.is_set():
+                chunk = response.fp.readline()
+                if not chunk:
+                    break
+                if waiting and chunk.startswith(b'data:'):
+                    ready.wait()
+                    waiting = False
+                    continue
+                if chunk.startswith(b'data:'):
+                    payload = json.loads(chunk[5:])
+                    if payload.get('data_updated'):
+                        with lock:
+                            received.append((payload['total_interactions'], time.perf_counter()))
+        except (OSError, ValueError, threading.BrokenBarrierError):
+            pass
+        finally:
+            conn.close()
+
+    threads = [threading.Thread(target=subscriber, daemon=True) for _ in range(subscribers)]
+    for thread in threads:
+        thread.start()
+    ready.wait(timeout=60)
+
+    client, rng = Client(base_url), random.Random(2)
+    for _ in range(events):
+        sent = time.perf_counter()
+        status, body, _ = client.post_json('/api/data', random_event(rng))
+        if status == 200:
+            posted_at[json.loads(body)['updated_data']['total_interactions']] = sent
+        time.sleep(interval)
+    time.sleep(2)
+    stop.set()
+
+    latencies = [at - posted_at[total] for total, at in received if total in posted_at]
+    expected = subscribers * events
+    return dict(summarize(latencies), subscribers=subscribers, events=events,
+                delivered=len(latencies), delivery_ratio=round(len(latencies) / expected, 4) if expected else None)
+
+
+def bench_pages(base_url, repeats, paths=('/', '/map', '/map_today')):
+    """Cold (right after a data change) and warm timings for the dashboard pages."""
+    client, rng = Client(base_url), random.Random(3)
+    results = {}
+    for path in paths:
+        cold, warm, size = [], [], 0
+        for _ in range(repeats):
+            client.post_json('/api/data', random_event(rng))  # new data version: caches are cold
+            _, body, seconds = client.request('GET', path)
+            cold.append(seconds)
+            size = len(body)
+            _, _, seconds = client.request('GET', path)
+            warm.append(seconds)
+        results[path] = {'cold': summarize(cold), 'warm': summarize(warm), 'bytes': size}
+    return results
+
+
+def bench_concurrency(base_url, concurrency, seed=4):
+    """Whether slow requests overlap: the same requests sent one after another, then all at once.
+
+    Durable POSTs mostly wait on fsync and cold map renders on folium; a
+    server that runs requests on one thread takes as long for the burst as
+    for the sequence (overlap near 1), a pooled one shares the commits.
+    """
+    rng = random.Random(seed)
+    kinds = {
+        'durable_post': lambda client, i: client.post_json('/api/data', random_event(rng)),
+        # A font colour per request misses the map cache every time
+        'cold_map': lambda client, i: client.request('GET', f'/map?font_color=%23{rng.randrange(1 << 24):06x}'),
+    }
+    results = {}
+    for name, send in kinds.items():
+        client = Client(base_url)
+        start = time.perf_counter()
+        for i in range(concurrency):
+            send(client, i)
+        sequential = time.perf_counter() - start
+
+        clients = [Client(base_url) for _ in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(concurrency) as pool:
+            latencies = [seconds for _, _, seconds in pool.map(send, clients, range(concurrency))]
+        burst = time.perf_counter() - start
+        results[name] = dict(summarize(latencies), requests=concurrency, sequential_seconds=round(sequential, 3),
+                             burst_seconds=round(burst, 3), overlap=round(sequential / burst, 2))
+    return results
+
+
+# --- orchestration ---
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def spawn_server(dataset, port, server='flask'):
+    """Starts the app inside the dataset directory and waits until it answers."""
+    if server == 'asgi':
+        code = (f"import sys; sys.path.insert(0, {REPO_DIR!r}); import asgi, uvicorn; "
+                f"uvicorn.run(asgi.application, port={port}, log_level='warning')")
+    else:
+        code = f"import sys; sys.path.insert(0, {REPO_DIR!r}); import main; main.app.run(port={port}, threaded=True)"
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=dataset,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.time() + 600  # loading 1M events takes a while
+    while time.time() < deadline:
+        try:
+            status, _, _ = Client(base_url, timeout=5).request('GET', '/api/rollups')
+            if status == 200:
+                return process, base_url
+        except OSError:
+            time.sleep(0.5)
+    process.kill()
+    raise RuntimeError("Server did not start")
+
+
+def run(args):
+    process = None
+    base_url = args.url
+    started = time.perf_counter()
+    if args.spawn:
+        process, base_url = spawn_server(args.dataset, args.port, args.server)
+    report = {
+        'meta': {
+            'git_revision': git_revision(),
+            'started_at': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'base_url': base_url,
+            'dataset': args.dataset,
+            'dataset_meta': dataset_meta(args.dataset),
+            'server': args.server if args.spawn else None,
+            'startup_seconds': round(time.perf_counter() - started, 3) if args.spawn else None,
+        }
+    }
+    try:
+        if 'ingest' in args.only:
+            report['ingest'] = bench_ingest(base_url, args.requests, args.concurrency, 1)
+            report['ingest_batch'] = bench_ingest(base_url, max(args.concurrency, args.requests // 100),
+                                                  args.concurrency, 100)
+        if 'sse' in args.only:
+            report['sse'] = bench_sse(base_url, args.subscribers, args.sse_events, args.sse_interval)
+        if 'pages' in args.only:
+            report['pages'] = bench_pages(base_url, args.repeats)
+        if 'concurrency' in args.only:
+            report['concurrency'] = bench_concurrency(base_url, args.concurrency)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    revision = (report['meta']['git_revision'] or 'unknown')[:10]
+    path = args.output or os.path.join(
+        RESULTS_DIR, f"{datetime.now().strftime('%Y%m%d-%H%M%S')}-{revision}.json")
+    with open(path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Report written to {path}")
+
+
+def flatten(report, prefix=''):
+    for key, value in report.items():
+        if isinstance(value, dict):
+            yield from flatten(value, f"{prefix}{key}.")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield f"{prefix}{key}", value
+
+
+def compare(args):
+    with open(args.before) as f:
+        before_report = json.load(f)
+    with open(args.after) as f:
+        after_report = json.load(f)
+    datasets = [report.get('meta', {}).get('dataset_meta') for report in (before_report, after_report)]
+    if datasets[0] != datasets[1]:
+        print(f"Warning: the reports ran on different datasets: {datasets[0]} vs {datasets[1]}")
+    before, after = dict(flatten(before_report)), dict(flatten(after_report))
+    for key in sorted(before.keys() & after.keys()):
+        if key.startswith('meta.'):
+            continue
+        old, new = before[key], after[key]
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{key:45} {old:>14} {new:>14} {change:>9}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    generate = commands.add_parser('generate', help="write synthetic datasets")
+    generate.add_argument('--sizes', type=int, nargs='+', default=list(DEFAULT_SIZES))
+    generate.add_argument('--days', type=int, default=30)
+    generate.add_argument('--seed', type=int, default=0)
+    generate.add_argument('--anchor', default=DEFAULT_ANCHOR,
+                          help="ISO local time the data ends at, or 'now' (not reproducible)")
+    generate.add_argument('--out', default='bench_data')
+
+    run_parser = commands.add_parser('run', help="benchmark a local instance")
+    run_parser.add_argument('--url', default='http://127.0.0.1:3000')
+    run_parser.add_argument('--spawn', action='store_true', help="start a server inside --dataset")
+    run_parser.add_argument('--dataset', default=None)
+    run_parser.add_argument('--port', type=int, default=3100)
+    run_parser.add_argument('--server', default='flask', choices=['flask', 'asgi'],
+                            help="how --spawn serves the app: Flask's threaded server or asgi.py under uvicorn")
+    run_parser.add_argument('--only', nargs='+', default=['ingest', 'sse', 'pages', 'concurrency'],
+                            choices=['ingest', 'sse', 'pages', 'concurrency'])
+    run_parser.add_argument('--requests', type=int, default=2000)
+    run_parser.add_argument('--concurrency', type=int, default=16)
+    run_parser.add_argument('--subscribers', type=int, default=50)
+    run_parser.add_argument('--sse-events', type=int, default=20)
+    run_parser.add_argument('--sse-interval', type=float, default=0.25)
+    run_parser.add_argument('--repeats', type=int, default=5)
+    run_parser.add_argument('--output', default=None)
+
+    compare_parser = commands.add_parser('compare', help="diff two reports")
+    compare_parser.add_argument('before')
+    compare_parser.add_argument('after')
+
+    args = parser.parse_args()
+    if args.command == 'generate':
+        for size in args.sizes:
+            generate_dataset(os.path.join(args.out, str(size)), size, args.days, args.seed, args.anchor)
+    elif args.command == 'run':
+        if args.spawn and not args.dataset:
+            parser.error("--spawn needs --dataset")
+        run(args)
+    else:
+        compare(args)
+
+
+if __name__ == '__main__':
+    main()
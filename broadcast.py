@@ -0,0 +1,180 @@
+import json
+import queue
+import threading
+from collections import deque
+from datetime import date
+
+HEARTBEAT_INTERVAL = 15.0    # seconds of silence before a keep-alive comment is sent
+SUBSCRIBER_QUEUE_SIZE = 16   # messages buffered per client before coalescing kicks in
+REPLAY_BUFFER_SIZE = 256     # recent messages kept for Last-Event-ID resume
+RETRY_MS = 3000              # reconnect delay suggested to EventSource clients
+MAX_DELTA_POINTS = 500       # new events sent inline with an update; beyond this maps reload
+
+HEARTBEAT = ': heartbeat\n\n'
+
+
+def format_event(event_id, payload):
+    return f"id: {event_id}\ndata: {json.dumps(payload)}\n\n"
+
+
+def event_id(epoch, version):
+    """SSE id of an update: versions restart with the process, so they are qualified by its epoch."""
+    return f"{epoch}-{version}"
+
+
+def parse_event_id(value):
+    """(epoch, version) from an event_id() string; None for anything else."""
+    epoch, sep, version = (value or '').rpartition('-')
+    if not sep or not version.isdigit():
+        return None
+    return epoch, int(version)
+
+
+class Subscriber:
+    """One connected SSE client: a bounded queue of pre-formatted messages."""
+
+    def __init__(self, maxsize=SUBSCRIBER_QUEUE_SIZE):
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.dropped = 0
+
+    def offer(self, message, coalesce=True):
+        """Queues a message without ever blocking the producer.
+
+        The totals in a data message are a full snapshot, so when a slow
+        client's queue is full the oldest pending message is discarded in
+        favour of the new one. Its point delta is lost with it, but every
+        delta names the version it follows, so the map pages notice the gap
+        and reload. Heartbeats are simply dropped.
+        """
+        try:
+            self.queue.put_nowait(message)
+            return
+        except queue.Full:
+            if not coalesce:
+                return
+        try:
+            self.queue.get_nowait()
+            self.dropped += 1
+        except queue.Empty:
+            pass
+        try:
+            self.queue.put_nowait(message)
+        except queue.Full:
+            self.dropped += 1
+
+    def get(self, timeout):
+        return self.queue.get(timeout=timeout)
+
+
+class Broadcaster:
+    """Single producer that fans dashboard updates out to every SSE subscriber.
+
+    The producer sleeps on the aggregate state's change notification and only
+    builds a payload when the data version moves, so the work per update is
+    the same no matter how many dashboards are open. Each update carries the
+    events stored since the previous one, so open maps can draw them in place.
+    """
+
+    def __init__(self, state, build_payload, clients, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.state = state
+        self.build_payload = build_payload
+        self.clients = clients
+        self.heartbeat_interval = heartbeat_interval
+        self._lock = threading.Lock()
+        self._recent = deque(maxlen=REPLAY_BUFFER_SIZE)  # (version, message)
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sse-broadcaster', daemon=True)
+                self._thread.start()
+
+    def subscribe(self, last_event_id=None, subscriber=None):
+        """Registers a client and queues what it needs to catch up.
+
+        Any object with an offer(message, coalesce=True) method can be passed
+        as the subscriber; the ASGI server uses that for asyncio clients.
+        """
+        self.start()
+        if subscriber is None:
+            subscriber = Subscriber()
+        with self._lock:
+            self.clients.add(subscriber)
+            backlog = self._backlog(last_event_id)
+        for message in backlog:
+            subscriber.offer(message)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self.clients.discard(subscriber)
+
+    def _backlog(self, last_event_id):
+        version = self.state.version
+        if last_event_id is None:
+            # Fresh connection: current state, without triggering map reloads
+            return [self._format(version, self.build_payload(data_updated=False))]
+        last = parse_event_id(last_event_id)
+        if last is not None and last[0] == self.state.epoch and last[1] <= version:
+            last_version = last[1]
+            missed = [message for v, message in self._recent if v > last_version]
+            if missed and self._recent[0][0] <= last_version:
+                return missed
+            if last_version == version:
+                return []
+        # Too far behind for the replay buffer, or an id this run never issued
+        # (another epoch, or a version it has not reached): send the latest
+        # snapshot with since=None, which makes the maps reload
+        return [self._format(version, self.build_payload(data_updated=True))]
+
+    def _format(self, version, payload):
+        return format_event(event_id(self.state.epoch, version), payload)
+
+    def publish(self, version, payload):
+        message = self._format(version, payload)
+        with self._lock:
+            self._recent.append((version, message))
+            subscribers = list(self.clients)
+        for subscriber in subscribers:
+            subscriber.offer(message)
+
+    def _heartbeat(self):
+        with self._lock:
+            subscribers = list(self.clients)
+        for subscriber in subscribers:
+            subscriber.offer(HEARTBEAT, coalesce=False)
+
+    def _run(self):
+        with self.state.lock:
+            version, rows = self.state.version, len(self.state.columns)
+        today = date.today()
+        while True:
+            try:
+                new_version = self.state.wait_for_change(version, timeout=self.heartbeat_interval)
+                if new_version == version:
+                    if date.today() != today:
+                        # Local midnight: "today" counters reset without any new data
+                        today = date.today()
+                        self.publish(version, self.build_payload(data_updated=False))
+                    else:
+                        self._heartbeat()
+                    continue
+                since = version
+                points, rows, version = self.state.events_since(rows, MAX_DELTA_POINTS)
+                today = date.today()
+                self.publish(version, self.build_payload(data_updated=True, points=points, since=since))
+            except Exception as e:
+                print(f"Error in event broadcaster: {e}")
+
+    def stream(self, subscriber):
+        """Yields SSE text for one subscriber until the client goes away."""
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            while True:
+                try:
+                    yield subscriber.get(timeout=self.heartbeat_interval * 2)
+                except queue.Empty:
+                    yield HEARTBEAT
+        finally:
+            self.unsubscribe(subscriber)
@@ -0,0 +1,167 @@
+import csv
+import json
+import os
+import threading
+
+import numpy as np
+
+from geo import lat_lon_to_pixel, lat_lon_to_pixel_array
+
+MIN_ZOOM = 0
+MAX_ZOOM = 18
+CLUSTER_CELL_PX = 80     # grid cell size in screen pixels, matching Leaflet.markercluster's radius
+SEED_EARNINGS = 0.20     # coords.csv points carry no earnings; they keep the old per-marker value
+
+
+class ClusterIndex:
+    """Points pre-binned into a screen-pixel grid at every zoom level.
+
+    Each cell keeps [count, earnings, lat_sum, lon_sum], so adding a point
+    touches one cell per zoom level and reading a zoom level is proportional
+    to the number of clusters, not the number of points.
+    """
+
+    def __init__(self, min_zoom=MIN_ZOOM, max_zoom=MAX_ZOOM, cell_px=CLUSTER_CELL_PX):
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.cell_px = cell_px
+        self.levels = {zoom: {} for zoom in range(min_zoom, max_zoom + 1)}
+        self.count = 0
+
+    def add(self, lat, lon, earnings):
+        for zoom, cells in self.levels.items():
+            x, y = lat_lon_to_pixel(lat, lon, zoom)
+            cell_key = (int(x // self.cell_px), int(y // self.cell_px))
+            cell = cells.get(cell_key)
+            if cell is None:
+                cells[cell_key] = [1, earnings, lat, lon]
+            else:
+                cell[0] += 1
+                cell[1] += earnings
+                cell[2] += lat
+                cell[3] += lon
+        self.count += 1
+
+    def add_many(self, lats, lons, earnings):
+        """Vectorized add for NumPy arrays; rows with NaN coordinates are skipped."""
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        lats, lons, earnings = lats[valid], lons[valid], earnings[valid]
+        if not len(lats):
+            return
+        for zoom, cells in self.levels.items():
+            x, y = lat_lon_to_pixel_array(lats, lons, zoom)
+            cell_keys = np.column_stack(((x // self.cell_px).astype(np.int64), (y // self.cell_px).astype(np.int64)))
+            unique_keys, inverse = np.unique(cell_keys, axis=0, return_inverse=True)
+            inverse = inverse.ravel()
+            counts = np.bincount(inverse)
+            sums = [np.bincount(inverse, weights=values) for values in (earnings, lats, lons)]
+            for i, (cx, cy) in enumerate(unique_keys.tolist()):
+                cell = cells.get((cx, cy))
+                if cell is None:
+                    cells[(cx, cy)] = [int(counts[i]), float(sums[0][i]), float(sums[1][i]), float(sums[2][i])]
+                else:
+                    cell[0] += int(counts[i])
+                    cell[1] += float(sums[0][i])
+                    cell[2] += float(sums[1][i])
+                    cell[3] += float(sums[2][i])
+        self.count += len(lats)
+
+    def clamp_zoom(self, zoom):
+        return max(self.min_zoom, min(self.max_zoom, int(zoom)))
+
+
+def merge_clusters(indexes, zoom, bbox=None):
+    """Combines the cells of several indexes at one zoom level into cluster dicts.
+
+    bbox is [[south, west], [north, east]]; clusters whose centroid falls
+    outside it are left out.
+    """
+    merged = {}
+    for index in indexes:
+        for cell_key, cell in index.levels[index.clamp_zoom(zoom)].items():
+            total = merged.get(cell_key)
+            if total is None:
+                merged[cell_key] = list(cell)
+            else:
+                for i in range(4):
+                    total[i] += cell[i]
+
+    clusters = []
+    for (cx, cy), (count, earnings, lat_sum, lon_sum) in merged.items():
+        lat, lon = lat_sum / count, lon_sum / count
+        if bbox is not None:
+            (south, west), (north, east) = bbox
+            if not (south <= lat <= north and west <= lon <= east):
+                continue
+        # The grid cell lets a live page fold new points into the right cluster
+        clusters.append({'lat': lat, 'lon': lon, 'count': count, 'earnings': round(earnings, 2), 'cell': [cx, cy]})
+    return clusters
+
+
+class SeedPoints:
+    """The static coords.csv points, reloaded only when the file changes.
+
+    When migrate.py has written the normalized coords.jsonl, that file is
+    read instead and needs no validation.
+    """
+
+    def __init__(self, path, normalized_path=None):
+        self.path = path
+        self.normalized_path = normalized_path
+        self._lock = threading.Lock()
+        self.signature = None
+        self.array = np.empty((0, 2))
+        self.extent = None
+        self.index = ClusterIndex()
+
+    def _source(self):
+        if self.normalized_path and os.path.exists(self.normalized_path):
+            return self.normalized_path
+        return self.path
+
+    def refresh(self):
+        path = self._source()
+        signature = (path, os.path.getmtime(path)) if os.path.exists(path) else None
+        with self._lock:
+            if signature == self.signature:
+                return self
+            points = []
+            index = ClusterIndex()
+            if signature is not None:
+                try:
+                    rows = self._read_normalized(path) if path == self.normalized_path else self._read_csv(path)
+                    for lat, lon in rows:
+                        points.append([lat, lon])
+                        index.add(lat, lon, SEED_EARNINGS)
+                except (IOError, csv.Error, ValueError) as e:
+                    print(f"Error processing {path}: {e}")
+            array = np.array(points, dtype=np.float64).reshape(-1, 2)
+            extent = None
+            if len(array):
+                extent = [[float(array[:, 0].min()), float(array[:, 1].min())],
+                          [float(array[:, 0].max()), float(array[:, 1].max())]]
+            self.array, self.extent, self.index, self.signature = array, extent, index, signature
+        return self
+
+    def array_in(self, bbox):
+        """(n, 2) array of the [lat, lon] points inside [[south, west], [north, east]]."""
+        (south, west), (north, east) = bbox
+        lats, lons = self.array[:, 0], self.array[:, 1]
+        return self.array[(lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)]
+
+    @staticmethod
+    def _read_normalized(path):
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    row = json.loads(line)
+                    yield row['lat'], row['lon']
+
+    @staticmethod
+    def _read_csv(path):
+        with open(path, newline='') as f:
+            for row in csv.DictReader(f):
+                try:
+                    yield float(row['lat']), float(row['lon'])
+                except (KeyError, TypeError, ValueError):
+                    continue
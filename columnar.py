@@ -0,0 +1,130 @@
+import numpy as np
+
+INITIAL_CAPACITY = 1024
+NO_TIMESTAMP = np.iinfo(np.int64).min  # ts value for entries without a valid timestamp
+NO_DAY = -1                            # day value for entries without a valid timestamp
+NO_CATEGORY = -1                       # code for a missing ad_id / interaction_type
+
+
+def timestamp_micros(timestamp):
+    """Naive local datetime -> the int64 microseconds since the epoch stored in 'ts'."""
+    return round(timestamp.timestamp() * 1_000_000)
+
+
+class Categories:
+    """Maps string values to small integer codes and back."""
+
+    def __init__(self):
+        self.codes = {}
+        self.values = []
+
+    def code(self, value):
+        if value is None:
+            return NO_CATEGORY
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class ColumnarEvents:
+    """Events stored column by column in NumPy arrays.
+
+    ts is int64 microseconds since the epoch, day and hour are the local date
+    ordinal and hour, lat/lon are float64 (NaN when the entry has no usable coordinates) and
+    ad_id / interaction_type are categorical codes. That is 45 bytes per
+    event, against roughly a kilobyte for the equivalent dict. Arrays grow by
+    doubling, so appends are amortized O(1).
+    """
+
+    COLUMNS = (
+        ('ts', np.int64),
+        ('day', np.int32),
+        ('hour', np.int8),
+        ('lat', np.float64),
+        ('lon', np.float64),
+        ('ad', np.int32),
+        ('type', np.int32),
+        ('earnings', np.float64),
+    )
+
+    def __init__(self, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.capacity = capacity
+        self._arrays = {name: np.empty(capacity, dtype=dtype) for name, dtype in self.COLUMNS}
+        self.ad_ids = Categories()
+        self.interaction_types = Categories()
+
+    def __len__(self):
+        return self.size
+
+    def _grow(self, needed):
+        capacity = self.capacity
+        while capacity < needed:
+            capacity *= 2
+        for name, array in self._arrays.items():
+            grown = np.empty(capacity, dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            self._arrays[name] = grown
+        self.capacity = capacity
+
+    def append(self, timestamp, lat, lon, ad_id, interaction_type, earnings):
+        """Appends one row; timestamp is a naive local datetime or None."""
+        if self.size >= self.capacity:
+            self._grow(self.size + 1)
+        i = self.size
+        arrays = self._arrays
+        if timestamp is None:
+            arrays['ts'][i] = NO_TIMESTAMP
+            arrays['day'][i] = NO_DAY
+            arrays['hour'][i] = 0
+        else:
+            arrays['ts'][i] = timestamp_micros(timestamp)
+            arrays['day'][i] = timestamp.toordinal()
+            arrays['hour'][i] = timestamp.hour
+        arrays['lat'][i] = np.nan if lat is None else lat
+        arrays['lon'][i] = np.nan if lon is None else lon
+        arrays['ad'][i] = self.ad_ids.code(ad_id)
+        arrays['type'][i] = self.interaction_types.code(interaction_type)
+        arrays['earnings'][i] = earnings
+        self.size += 1
+
+    def column(self, name):
+        """A read-only view of the filled part of one column."""
+        view = self._arrays[name][:self.size]
+        view.flags.writeable = False
+        return view
+
+    # --- vectorized queries ---
+
+    def day_mask(self, day):
+        return self.column('day') == day.toordinal()
+
+    def points(self, mask=None):
+        """Returns an (n, 2) array of [lat, lon] rows, skipping rows without coordinates."""
+        lat, lon = self.column('lat'), self.column('lon')
+        valid = ~(np.isnan(lat) | np.isnan(lon))
+        if mask is not None:
+            valid &= mask
+        return np.column_stack((lat[valid], lon[valid]))
+
+    def group_by_ad(self, mask=None):
+        """Returns {ad_id: (interactions, earnings)} using bincount over the codes."""
+        return self._group_by(self.column('ad'), self.ad_ids, mask)
+
+    def _group_by(self, codes, categories, mask):
+        earnings = self.column('earnings')
+        if mask is not None:
+            codes, earnings = codes[mask], earnings[mask]
+        present = codes != NO_CATEGORY
+        codes, earnings = codes[present], earnings[present]
+        counts = np.bincount(codes, minlength=len(categories))
+        sums = np.bincount(codes, weights=earnings, minlength=len(categories))
+        return {
+            categories.values[code]: (int(counts[code]), float(sums[code]))
+            for code in np.flatnonzero(counts)
+        }
@@ -0,0 +1,126 @@
+import gzip
+import json
+import os
+from datetime import date
+
+import numpy as np
+
+from clustering import MAX_ZOOM, MIN_ZOOM, merge_clusters
+from map_cache import MapRenderCache
+from profiling import span
+
+# Per-day map layers for the historical map: a sample of the day's points,
+# its clusters at every zoom level and a heat grid. A closed day's layer is
+# built once and kept on disk as <day>.<count>.json.gz; the event count in
+# the name means a late, back-dated event makes the next request rebuild it.
+# Today's layer changes all the time and is only cached in memory.
+
+DAY_LAYER_DIR = os.environ.get('ADWALK_DAY_LAYER_DIR', 'day_layers')
+LAYER_CACHE_SIZE = 128       # gzipped layers kept in memory: a semester of days
+LAYER_MAX_POINTS = 2000      # points sent per day; busier days are sampled evenly
+HEAT_GRID_DEGREES = 0.0005   # heat grid cell, about 50 m; each cell is one weighted heat point
+LAYER_SUFFIX = '.json.gz'
+
+
+def build_layer(state, day):
+    """The layer dict for one local date, read from the in-memory indexes without scanning other days."""
+    with state.lock:
+        bucket = state.rollups.day(day)
+        posting = state.index.by_day.get(day.toordinal())
+        rows = posting.view() if posting else np.empty(0, dtype=np.int64)
+        lats, lons = state.columns.column('lat')[rows], state.columns.column('lon')[rows]  # copies
+        cluster_index = state.day_clusters.get(day)
+        clusters = {}
+        if cluster_index is not None:
+            for zoom in range(MIN_ZOOM, MAX_ZOOM + 1):
+                clusters[zoom] = [[round(c['lat'], 6), round(c['lon'], 6), c['count'], c['earnings']]
+                                  for c in merge_clusters([cluster_index], zoom)]
+        count, earnings = bucket.count, bucket.earnings
+
+    valid = ~(np.isnan(lats) | np.isnan(lons))
+    lats, lons = lats[valid], lons[valid]
+    extent = None
+    heat = []
+    if len(lats):
+        extent = [[float(lats.min()), float(lons.min())], [float(lats.max()), float(lons.max())]]
+        cells = np.column_stack((np.floor(lats / HEAT_GRID_DEGREES), np.floor(lons / HEAT_GRID_DEGREES)))
+        unique_cells, weights = np.unique(cells, axis=0, return_counts=True)
+        centers = (unique_cells + 0.5) * HEAT_GRID_DEGREES
+        heat = [[round(lat, 6), round(lon, 6), int(weight)]
+                for (lat, lon), weight in zip(centers.tolist(), weights.tolist())]
+    if len(lats) > LAYER_MAX_POINTS:
+        sample = np.linspace(0, len(lats) - 1, LAYER_MAX_POINTS).astype(np.int64)
+        lats, lons = lats[sample], lons[sample]
+    return {
+        'day': day.isoformat(),
+        'count': count,
+        'earnings': round(earnings, 2),
+        # Days cut down to a summary by retention keep their totals but no points
+        'summary_only': bool(count) and not len(rows),
+        'extent': extent,
+        'points': np.round(np.column_stack((lats, lons)), 6).tolist(),
+        'heat': heat,
+        'clusters': clusters,
+    }
+
+
+class DayLayers:
+    """Gzipped per-day layers: memory first, then disk for closed days, built on a miss."""
+
+    def __init__(self, directory=DAY_LAYER_DIR, maxsize=LAYER_CACHE_SIZE):
+        self.directory = directory
+        self.cache = MapRenderCache(maxsize)
+
+    @staticmethod
+    def days(state):
+        """(date, interactions, earnings) of every day with data, oldest first."""
+        with state.lock:
+            return sorted((day, bucket.count, bucket.earnings)
+                          for day, bucket in state.rollups.days.items() if bucket.count)
+
+    def get(self, state, day):
+        """(etag, gzipped JSON) of one day's layer, or None for a day without data."""
+        with state.lock:
+            count = state.rollups.day(day).count
+        if not count:
+            # Nothing to draw, and arbitrary dates must not create cache entries or files
+            return None
+        key = ('day-layer', day, count)
+        return self.cache.get_or_render(key, lambda: self._load_or_build(state, day, count))
+
+    def _path(self, day, count):
+        return os.path.join(self.directory, f"{day.isoformat()}.{count}{LAYER_SUFFIX}")
+
+    def _load_or_build(self, state, day, count):
+        closed = day < date.today()
+        path = self._path(day, count)
+        if closed:
+            try:
+                with span('load'), open(path, 'rb') as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        with span('aggregate'):
+            layer = build_layer(state, day)
+        with span('render'):
+            body = gzip.compress(json.dumps(layer, separators=(',', ':')).encode('utf-8'), 6)
+        if closed and layer['count']:
+            with span('write'):
+                self._save(day, layer['count'], body)
+        return body
+
+    def _save(self, day, count, body):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(day, count)
+        tmp_path = f"{path}.{os.getpid()}.tmp"  # workers sharing the directory never clash
+        with open(tmp_path, 'wb') as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+        # Layers of the same day built before late events arrived
+        prefix = day.isoformat() + '.'
+        for name in os.listdir(self.directory):
+            if name.startswith(prefix) and name.endswith(LAYER_SUFFIX) and name != os.path.basename(path):
+                try:
+                    os.unlink(os.path.join(self.directory, name))
+                except FileNotFoundError:
+                    pass
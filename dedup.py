@@ -0,0 +1,102 @@
+import hashlib
+import math
+import threading
+import time
+from collections import deque
+
+DEDUP_TTL = 24 * 3600            # seconds a redemption blocks repeats of the same key
+DEDUP_EXPECTED_KEYS = 1_000_000  # keys per TTL window the prefilter is sized for
+DEDUP_FALSE_POSITIVE = 0.01      # prefilter false positive rate at that load
+DEDUP_MAX_KEYS = 4_000_000       # hard cap on remembered keys; the oldest go first
+
+
+def key_digest(key):
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=16).digest()
+
+
+class BloomFilter:
+    """Fixed-size bit array answering "definitely new" or "maybe seen"."""
+
+    def __init__(self, expected, false_positive):
+        self.size = max(8, int(-expected * math.log(false_positive) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / expected * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, digest):
+        # Double hashing: two 64-bit halves of the digest give every position
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, positions):
+        for position in positions:
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, positions):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in positions)
+
+
+class DedupIndex:
+    """Keys seen in the last `ttl` seconds, checked in O(1).
+
+    Exact entries live in a dict with their expiry, evicted from the front
+    of an insertion-ordered queue (the TTL is fixed, so that is also expiry
+    order). In front of it sit two Bloom filters, one per TTL window, rotated
+    as windows pass: a key in neither has not been seen within the TTL, so
+    the common case of a first scan is answered from a compact bit array
+    (about 1.2 MB per million keys at 1%) without probing the large dict.
+    """
+
+    def __init__(self, ttl=DEDUP_TTL, expected=DEDUP_EXPECTED_KEYS, false_positive=DEDUP_FALSE_POSITIVE,
+                 max_keys=DEDUP_MAX_KEYS):
+        self.ttl = ttl
+        self.expected = expected
+        self.false_positive = false_positive
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        self._expiry = {}      # digest -> expiry time
+        self._queue = deque()  # (expiry time, digest), oldest first
+        self._current = BloomFilter(expected, false_positive)
+        self._previous = BloomFilter(expected, false_positive)
+        self._window_start = time.monotonic()
+        self.prefilter_hits = 0  # lookups the Bloom filters could not rule out
+
+    def __len__(self):
+        return len(self._expiry)
+
+    def seen_or_add(self, key, now=None):
+        """Returns True if `key` was added within the TTL; otherwise records it and returns False."""
+        digest = key_digest(key)
+        with self._lock:
+            now = time.monotonic() if now is None else now
+            self._expire(now)
+            positions = self._current.positions(digest)
+            if positions in self._current or positions in self._previous:
+                self.prefilter_hits += 1
+                expiry = self._expiry.get(digest)
+                if expiry is not None and expiry > now:
+                    return True
+            expiry = now + self.ttl
+            self._expiry[digest] = expiry
+            self._queue.append((expiry, digest))
+            self._current.add(positions)
+            return False
+
+    def forget(self, key):
+        """Drops a key again, e.g. when the redemption it stood for could not be stored."""
+        with self._lock:
+            self._expiry.pop(key_digest(key), None)
+
+    def _expire(self, now):
+        if now - self._window_start >= self.ttl:
+            # Keys only in the outgoing previous filter were added before the
+            # last rotation, at least a TTL ago; the current one may hold keys
+            # added just now, so it always moves to previous
+            self._previous = self._current
+            self._current = BloomFilter(self.expected, self.false_positive)
+            self._window_start = now
+        queue = self._queue
+        while queue and (queue[0][0] <= now or len(queue) > self.max_keys):
+            expiry, digest = queue.popleft()
+            if self._expiry.get(digest) == expiry:
+                del self._expiry[digest]
@@ -0,0 +1,185 @@
+from datetime import datetime
+
+import numpy as np
+
+from columnar import NO_CATEGORY, NO_DAY, NO_TIMESTAMP, timestamp_micros
+from geo import haversine_m
+
+INITIAL_POSTINGS = 16
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 10000
+
+
+class PostingList:
+    """Growable, ascending array of row numbers that share one key."""
+
+    __slots__ = ('rows', 'size')
+
+    def __init__(self):
+        self.rows = np.empty(INITIAL_POSTINGS, dtype=np.int64)
+        self.size = 0
+
+    def extend(self, rows):
+        needed = self.size + len(rows)
+        if needed > len(self.rows):
+            capacity = len(self.rows)
+            while capacity < needed:
+                capacity *= 2
+            grown = np.empty(capacity, dtype=np.int64)
+            grown[:self.size] = self.rows[:self.size]
+            self.rows = grown
+        self.rows[self.size:needed] = rows
+        self.size = needed
+
+    def view(self):
+        return self.rows[:self.size]
+
+
+def micros_timestamp(micros):
+    if micros == NO_TIMESTAMP:
+        return None
+    seconds, remainder = divmod(micros, 1_000_000)
+    return datetime.fromtimestamp(seconds).replace(microsecond=remainder)
+
+
+class EventIndex:
+    """Secondary indexes over a ColumnarEvents store: row postings per ad_id, interaction_type and day.
+
+    Row numbers are the order events were stored in, so every posting list is
+    already sorted and doubles as the pagination order. A query starts from
+    the smallest matching posting list (or the spatial index's rows for a
+    bbox or radius) and checks the remaining filters with vectorized
+    comparisons on just those rows.
+    """
+
+    def __init__(self, columns, spatial=None):
+        self.columns = columns
+        self.spatial = spatial  # optional GridIndex over the same columns
+        self.by_ad = {}    # ad code -> PostingList
+        self.by_type = {}  # interaction_type code -> PostingList
+        self.by_day = {}   # day ordinal -> PostingList
+        self.size = 0
+
+    def add_rows(self, start=None):
+        """Indexes rows [start:] of the columnar store (by default, everything not yet indexed)."""
+        start = self.size if start is None else start
+        rows = np.arange(start, len(self.columns), dtype=np.int64)
+        for postings, name, missing in ((self.by_ad, 'ad', NO_CATEGORY),
+                                        (self.by_type, 'type', NO_CATEGORY),
+                                        (self.by_day, 'day', NO_DAY)):
+            keys = self.columns.column(name)[start:]
+            order = np.argsort(keys, kind='stable')
+            unique_keys, first_rows = np.unique(keys[order], return_index=True)
+            bounds = list(first_rows) + [len(order)]
+            for i, key in enumerate(unique_keys.tolist()):
+                if key == missing:
+                    continue
+                posting = postings.get(key)
+                if posting is None:
+                    posting = postings[key] = PostingList()
+                posting.extend(rows[order[bounds[i]:bounds[i + 1]]])
+        self.size = len(self.columns)
+
+    def candidates(self, start=None, end=None, ad_id=None, interaction_type=None, bbox=None, near=None):
+        """Row numbers that may match, taken from the most selective index; None means every row."""
+        options = []
+        if ad_id is not None:
+            code = self.columns.ad_ids.codes.get(ad_id)
+            posting = self.by_ad.get(code)
+            options.append(posting.view() if posting else np.empty(0, dtype=np.int64))
+        if interaction_type is not None:
+            code = self.columns.interaction_types.codes.get(interaction_type)
+            posting = self.by_type.get(code)
+            options.append(posting.view() if posting else np.empty(0, dtype=np.int64))
+        if start is not None or end is not None:
+            first = start.toordinal() if start else None
+            last = end.toordinal() if end else None
+            days = [posting.view() for day, posting in self.by_day.items()
+                    if (first is None or day >= first) and (last is None or day <= last)]
+            options.append(np.sort(np.concatenate(days)) if days else np.empty(0, dtype=np.int64))
+        if self.spatial is not None:
+            if bbox is not None:
+                options.append(self.spatial.rows_in_bbox(bbox))
+            if near is not None:
+                options.append(self.spatial.rows_within(*near))
+        if not options:
+            return None
+        return min(options, key=len)
+
+    def query(self, start=None, end=None, ad_id=None, interaction_type=None, bbox=None,
+              after=-1, limit=DEFAULT_PAGE_SIZE, near=None):
+        """Returns up to `limit` matching row numbers after row `after`, and whether more remain.
+
+        Times are naive local datetimes, the range is [start, end); bbox is
+        [[south, west], [north, east]] and near is (lat, lon, radius in meters).
+        """
+        columns = self.columns
+        after = max(after, -1)  # a negative row would index from the end
+        rows = self.candidates(start, end, ad_id, interaction_type, bbox, near)
+        if rows is None:
+            rows = np.arange(after + 1, len(columns), dtype=np.int64)
+        else:
+            rows = rows[np.searchsorted(rows, after, side='right'):]
+
+        matched = []
+        found = 0
+        # Check candidates a block at a time so a small page never scans the whole list
+        block = max(limit * 4, 1024)
+        for offset in range(0, len(rows), block):
+            chunk = rows[offset:offset + block]
+            keep = np.ones(len(chunk), dtype=bool)
+            if ad_id is not None:
+                keep &= columns.column('ad')[chunk] == columns.ad_ids.codes.get(ad_id, NO_CATEGORY - 1)
+            if interaction_type is not None:
+                code = columns.interaction_types.codes.get(interaction_type, NO_CATEGORY - 1)
+                keep &= columns.column('type')[chunk] == code
+            if start is not None or end is not None:
+                ts = columns.column('ts')[chunk]
+                keep &= ts != NO_TIMESTAMP
+                if start is not None:
+                    keep &= ts >= timestamp_micros(start)
+                if end is not None:
+                    keep &= ts < timestamp_micros(end)
+            if bbox is not None:
+                (south, west), (north, east) = bbox
+                lat, lon = columns.column('lat')[chunk], columns.column('lon')[chunk]
+                keep &= (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+            if near is not None:
+                lat, lon, radius_m = near
+                keep &= haversine_m(lat, lon, columns.column('lat')[chunk], columns.column('lon')[chunk]) <= radius_m
+            chunk = chunk[keep]
+            matched.append(chunk)
+            found += len(chunk)
+            if found > limit:
+                break
+        rows = np.concatenate(matched) if matched else np.empty(0, dtype=np.int64)
+        return rows[:limit], len(rows) > limit
+
+    def events(self, rows):
+        """Returns an iterator over the given rows as dicts in the normalized schema.
+
+        The column values are copied out before this returns, so the iterator
+        can be consumed without holding the aggregate lock.
+        """
+        columns = self.columns
+        ts, lat, lon = columns.column('ts')[rows], columns.column('lat')[rows], columns.column('lon')[rows]
+        ads, types = columns.column('ad')[rows], columns.column('type')[rows]
+        earnings = columns.column('earnings')[rows]
+        # Categories only ever grow, so the lists stay valid for these codes
+        ad_values, type_values = columns.ad_ids.values, columns.interaction_types.values
+        return _iter_events(rows, ts, lat, lon, ads, types, earnings, ad_values, type_values)
+
+
+def _iter_events(rows, ts, lat, lon, ads, types, earnings, ad_values, type_values):
+    for i, row in enumerate(rows.tolist()):
+        timestamp = micros_timestamp(int(ts[i]))
+        has_coords = not (np.isnan(lat[i]) or np.isnan(lon[i]))
+        yield {
+            'id': row,
+            'timestamp': timestamp.isoformat() if timestamp else None,
+            'lat': float(lat[i]) if has_coords else None,
+            'lon': float(lon[i]) if has_coords else None,
+            'ad_id': ad_values[ads[i]] if ads[i] != NO_CATEGORY else None,
+            'interaction_type': type_values[types[i]] if types[i] != NO_CATEGORY else None,
+            'earnings': float(earnings[i]),
+        }
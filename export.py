@@ -0,0 +1,87 @@
+import csv
+import io
+import json
+import zlib
+
+from schema import SchemaError, event_lat_lon, parse_timestamp
+
+# Streaming export pipeline: stored events -> filter -> export rows -> text
+# chunks -> (optionally) gzip. Every stage is a generator, so an export of
+# any size holds one chunk in memory at a time.
+
+EXPORT_FORMATS = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+EXPORT_FIELDS = ('timestamp', 'ad_id', 'interaction_type', 'lat', 'lon', 'earnings', 'stored_earnings')
+EXPORT_CHUNK_SIZE = 64 * 1024  # characters buffered before a chunk is sent
+
+
+def filter_events(events, start=None, end=None, ad_id=None, interaction_type=None):
+    """Events matching every given filter; the time range is [start, end) in local time."""
+    for event in events:
+        if ad_id is not None and event.get('ad_id') != ad_id:
+            continue
+        if interaction_type is not None and event.get('interaction_type') != interaction_type:
+            continue
+        if start is not None or end is not None:
+            try:
+                timestamp = parse_timestamp(event.get('timestamp'))
+            except SchemaError:
+                continue
+            if timestamp is None or (start and timestamp < start) or (end and timestamp >= end):
+                continue
+        yield event
+
+
+def export_rows(events, price):
+    """One flat row per event. earnings are recomputed with price(interaction_type);
+    stored_earnings is what was recorded at ingest, for reconciliation."""
+    for event in events:
+        coords = event_lat_lon(event)
+        yield {
+            'timestamp': event.get('timestamp'),
+            'ad_id': event.get('ad_id'),
+            'interaction_type': event.get('interaction_type'),
+            'lat': coords[0] if coords else None,
+            'lon': coords[1] if coords else None,
+            'earnings': price(event.get('interaction_type')),
+            'stored_earnings': event.get('earnings'),
+        }
+
+
+def csv_chunks(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, EXPORT_FIELDS)
+    writer.writeheader()
+    for row in rows:
+        writer.writerow(row)
+        if buffer.tell() >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def ndjson_chunks(rows):
+    lines, size = [], 0
+    for row in rows:
+        line = json.dumps(row) + '\n'
+        lines.append(line)
+        size += len(line)
+        if size >= EXPORT_CHUNK_SIZE:
+            yield ''.join(lines)
+            lines, size = [], 0
+    yield ''.join(lines)
+
+
+def encode_chunks(chunks, compress=False):
+    """UTF-8 encodes text chunks, gzip-compressing them as one stream if asked."""
+    if not compress:
+        for chunk in chunks:
+            if chunk:
+                yield chunk.encode('utf-8')
+        return
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,74 @@
+import math
+
+import numpy as np
+
+# Helpers shared by everything that places events on a map.
+
+TILE_SIZE = 256  # Web Mercator tile size in pixels
+MAX_LATITUDE = 85.05112878  # Web Mercator cuts off at this latitude
+
+def lat_lon_to_pixel(lat, lon, zoom):
+    """Projects a coordinate to global Web Mercator pixel space at a zoom level."""
+    lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+    scale = TILE_SIZE * (1 << zoom)
+    x = (lon + 180.0) / 360.0 * scale
+    sin_lat = math.sin(math.radians(lat))
+    y = (0.5 - math.log((1 + sin_lat) / (1 - sin_lat)) / (4 * math.pi)) * scale
+    return x, y
+
+def pixel_to_lat_lon(x, y, zoom):
+    """Inverse of lat_lon_to_pixel."""
+    scale = TILE_SIZE * (1 << zoom)
+    lon = x / scale * 360.0 - 180.0
+    lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * y / scale))))
+    return lat, lon
+
+def lat_lon_to_pixel_array(lats, lons, zoom):
+    """Vectorized lat_lon_to_pixel over NumPy arrays."""
+    lats = np.clip(lats, -MAX_LATITUDE, MAX_LATITUDE)
+    scale = TILE_SIZE * (1 << zoom)
+    x = (lons + 180.0) / 360.0 * scale
+    sin_lat = np.sin(np.radians(lats))
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+def zoom_for_bounds(bounds, width=600, height=400, max_zoom=18):
+    """Highest zoom at which bounds [[s, w], [n, e]] fit a width x height pixel viewport."""
+    (south, west), (north, east) = bounds
+    for zoom in range(max_zoom, -1, -1):
+        x1, y1 = lat_lon_to_pixel(north, west, zoom)
+        x2, y2 = lat_lon_to_pixel(south, east, zoom)
+        if x2 - x1 <= width and y2 - y1 <= height:
+            return zoom
+    return 0
+
+EARTH_RADIUS_M = 6371008.8  # mean Earth radius
+
+def haversine_m(lat, lon, lats, lons):
+    """Great-circle distance in meters from one point to NumPy arrays of points."""
+    lat1, lon1 = np.radians(lat), np.radians(lon)
+    lat2, lon2 = np.radians(lats), np.radians(lons)
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+def bounds_around(lat, lon, radius_m):
+    """Smallest [[s, w], [n, e]] box containing a circle of radius_m meters."""
+    dlat = math.degrees(radius_m / EARTH_RADIUS_M)
+    cos_lat = math.cos(math.radians(lat))
+    dlon = 180.0 if cos_lat < 1e-9 else min(180.0, dlat / cos_lat)
+    return [[max(-90.0, lat - dlat), max(-180.0, lon - dlon)], [min(90.0, lat + dlat), min(180.0, lon + dlon)]]
+
+def union_bounds(*bounds):
+    """Bounding box of several [[s, w], [n, e]] boxes; None entries are ignored."""
+    bounds = [b for b in bounds if b is not None]
+    if not bounds:
+        return None
+    return [[min(b[0][0] for b in bounds), min(b[0][1] for b in bounds)],
+            [max(b[1][0] for b in bounds), max(b[1][1] for b in bounds)]]
+
+def expand_bounds(bounds, fraction):
+    """Grows [[s, w], [n, e]] by `fraction` of its height and width on every side."""
+    (south, west), (north, east) = bounds
+    dlat = (north - south) * fraction
+    dlon = (east - west) * fraction
+    return [[max(-90.0, south - dlat), max(-180.0, west - dlon)], [min(90.0, north + dlat), min(180.0, east + dlon)]]
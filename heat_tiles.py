@@ -0,0 +1,143 @@
+import struct
+import threading
+import zlib
+from datetime import date, datetime
+
+import numpy as np
+
+from geo import TILE_SIZE, lat_lon_to_pixel_array, pixel_to_lat_lon
+from map_cache import MapRenderCache
+
+HEAT_MIN_ZOOM = 0
+HEAT_MAX_ZOOM = 18
+HEAT_TILE_CACHE_SIZE = 512   # rendered PNG tiles kept in memory
+HEAT_SIGMA_PX = 8.0          # Gaussian blur in screen pixels, the same at every zoom
+HEAT_PAD_PX = 24             # 3 sigma: points this far outside a tile still tint its edge
+HEAT_MIN_OPACITY = 0.3
+# Leaflet.heat's default gradient, as (intensity, (r, g, b)) stops
+HEAT_GRADIENT = ((0.0, (0, 0, 255)), (0.4, (0, 0, 255)), (0.6, (0, 255, 255)), (0.7, (0, 255, 0)),
+                 (0.8, (255, 255, 0)), (1.0, (255, 0, 0)))
+SCOPES = ('all', 'today')
+
+
+def encode_png(rgba):
+    """Encodes an (height, width, 4) uint8 array as an RGBA PNG."""
+    height, width, _ = rgba.shape
+    raw = np.zeros((height, width * 4 + 1), dtype=np.uint8)  # filter byte 0 (None) on each row
+    raw[:, 1:] = rgba.reshape(height, width * 4)
+
+    def chunk(tag, data):
+        return struct.pack('>I', len(data)) + tag + data + struct.pack('>I', zlib.crc32(tag + data) & 0xffffffff)
+
+    return (b'\x89PNG\r\n\x1a\n'
+            + chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 6, 0, 0, 0))
+            + chunk(b'IDAT', zlib.compress(raw.tobytes(), 6))
+            + chunk(b'IEND', b''))
+
+
+EMPTY_TILE = encode_png(np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8))
+
+
+def blur_matrix(sigma=HEAT_SIGMA_PX, pad=HEAT_PAD_PX, size=TILE_SIZE):
+    """(size, size + 2 * pad) Gaussian weights: padded histogram columns -> tile columns.
+
+    Weights peak at 1, so an isolated point reaches full intensity at its centre.
+    """
+    offsets = np.arange(size)[:, None] + pad - np.arange(size + 2 * pad)[None, :]
+    weights = np.exp(-offsets ** 2 / (2 * sigma ** 2))
+    weights[np.abs(offsets) > pad] = 0.0
+    return weights
+
+
+def colorize(density):
+    """Maps blurred point density to RGBA through the heat gradient."""
+    intensity = np.clip(density, 0.0, 1.0)
+    stops = [stop for stop, _ in HEAT_GRADIENT]
+    rgba = np.empty(intensity.shape + (4,), dtype=np.uint8)
+    for channel in range(3):
+        rgba[..., channel] = np.interp(intensity, stops, [color[channel] for _, color in HEAT_GRADIENT])
+    # Faint edges fade in from transparent; everything else is at least HEAT_MIN_OPACITY
+    alpha = np.clip(intensity / HEAT_MIN_OPACITY, 0.0, 1.0) * np.maximum(HEAT_MIN_OPACITY, intensity)
+    rgba[..., 3] = np.round(alpha * 255)
+    return rgba
+
+
+class HeatTiles:
+    """Server-rendered heat layer, served as z/x/y PNG tiles.
+
+    Each tile is a 2D histogram of the points around it, blurred with a
+    separable Gaussian and colored like Leaflet.heat. Tiles are cached under
+    a per-tile generation: new events only bump the generation of the tiles
+    they fall on, at every zoom level, so an update re-renders just those
+    tiles on their next request instead of the whole layer.
+    """
+
+    def __init__(self, seed_points, maxsize=HEAT_TILE_CACHE_SIZE):
+        self.seed_points = seed_points
+        self.cache = MapRenderCache(maxsize)
+        self._lock = threading.Lock()
+        self._generations = {}  # (scope key, z, x, y) -> generation, for tiles rendered so far
+        self._seen_rows = None  # rows of the columnar store already reflected in _generations
+        self._kernel = blur_matrix()
+
+    @staticmethod
+    def valid(z, x, y):
+        return HEAT_MIN_ZOOM <= z <= HEAT_MAX_ZOOM and 0 <= x < (1 << z) and 0 <= y < (1 << z)
+
+    def tile(self, state, scope, z, x, y):
+        """(etag, PNG bytes) for one tile; rendered only when its points changed since the cached copy."""
+        # 'today' tiles are keyed by the date, so they start over at midnight
+        scope_key = 'all' if scope == 'all' else datetime.now().date().toordinal()
+        self._catch_up(state)
+        with self._lock:
+            generation = self._generations.setdefault((scope_key, z, x, y), 0)
+        seeds = self.seed_points.refresh().signature if scope == 'all' else None
+        # Generations restart with the process; the epoch keeps etags from an earlier run from matching
+        key = ('heat', state.epoch, scope_key, z, x, y, generation, seeds)
+        return self.cache.get_or_render(key, lambda: self.render(state, scope_key, z, x, y))
+
+    def _catch_up(self, state):
+        """Bumps the generation of every rendered tile that events added since the last call fall on."""
+        with state.lock:
+            total = len(state.columns)
+            with self._lock:
+                start, self._seen_rows = self._seen_rows, total
+            if start is None or start >= total:
+                return
+            lats = state.columns.column('lat')[start:total].copy()
+            lons = state.columns.column('lon')[start:total].copy()
+            days = state.columns.column('day')[start:total].astype(np.int64)
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        lats, lons, days = lats[valid], lons[valid], days[valid]
+        if not len(lats):
+            return
+        with self._lock:
+            for z in range(HEAT_MIN_ZOOM, HEAT_MAX_ZOOM + 1):
+                x, y = lat_lon_to_pixel_array(lats, lons, z)
+                # A point tints every tile within HEAT_PAD_PX of it: at most a 2x2 block
+                corners = [np.column_stack((days, ((x + dx) // TILE_SIZE).astype(np.int64),
+                                            ((y + dy) // TILE_SIZE).astype(np.int64)))
+                           for dx in (-HEAT_PAD_PX, HEAT_PAD_PX) for dy in (-HEAT_PAD_PX, HEAT_PAD_PX)]
+                for day, tx, ty in np.unique(np.concatenate(corners), axis=0).tolist():
+                    for scope_key in ('all', day):
+                        tile_key = (scope_key, z, tx, ty)
+                        if tile_key in self._generations:
+                            self._generations[tile_key] += 1
+
+    def render(self, state, scope_key, z, x, y):
+        pad = HEAT_PAD_PX
+        left, top = x * TILE_SIZE - pad, y * TILE_SIZE - pad
+        size = TILE_SIZE + 2 * pad
+        north, west = pixel_to_lat_lon(left, top, z)
+        south, east = pixel_to_lat_lon(left + size, top + size, z)
+        bbox = [[south, west], [north, east]]
+        if scope_key == 'all':
+            points = np.concatenate((self.seed_points.refresh().array_in(bbox), state.point_array(bbox=bbox)))
+        else:
+            points = state.point_array(date.fromordinal(scope_key), bbox)
+        if not len(points):
+            return EMPTY_TILE
+        px, py = lat_lon_to_pixel_array(points[:, 0], points[:, 1], z)
+        histogram, _, _ = np.histogram2d(py - top, px - left, bins=size, range=[[0, size], [0, size]])
+        density = self._kernel @ histogram @ self._kernel.T
+        return encode_png(colorize(density))
@@ -0,0 +1,112 @@
+import queue
+import threading
+
+INGEST_QUEUE_SIZE = 1024     # pending submissions before writers are pushed back
+GROUP_COMMIT_SIZE = 4096     # events folded into one append + fsync
+ENQUEUE_TIMEOUT = 2.0        # seconds a request waits for queue space before giving up
+DURABLE_TIMEOUT = 30.0       # seconds a durable request waits for its flush
+
+ACK_ENQUEUED = 'enqueued'    # acknowledge once the writer has accepted the events
+ACK_DURABLE = 'durable'      # acknowledge once the events are fsynced and visible to readers
+ACK_MODES = (ACK_ENQUEUED, ACK_DURABLE)
+
+
+class IngestBusy(Exception):
+    """The ingest queue stayed full for the whole enqueue timeout."""
+
+
+class IngestFailed(Exception):
+    """The writer could not store a submission, or did not finish in time."""
+
+
+class Submission:
+    """Events from one request, and the signal that they have been written."""
+
+    def __init__(self, entries, ack):
+        self.entries = entries
+        self.ack = ack
+        self.error = None
+        self.done = threading.Event()
+
+
+class IngestQueue:
+    """Single writer thread that owns every write to the store.
+
+    Requests only put their events on a bounded queue. The writer drains
+    whatever has queued up (up to GROUP_COMMIT_SIZE events), appends it in
+    one call and fsyncs once if any submission asked for a durable ack, then
+    folds it into the aggregates. Both happen under the aggregate lock, so
+    readers see a group either completely or not at all.
+    """
+
+    def __init__(self, state, store, maxsize=INGEST_QUEUE_SIZE, group_size=GROUP_COMMIT_SIZE):
+        self.state = state
+        self.store = store
+        self.group_size = group_size
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='ingest-writer', daemon=True)
+                self._thread.start()
+
+    def submit(self, entries, ack=ACK_DURABLE, timeout=ENQUEUE_TIMEOUT):
+        """Queues entries for the writer and waits as the ack mode requires.
+
+        Raises IngestBusy when the queue is still full after `timeout`
+        seconds, and IngestFailed when a durable write fails.
+        """
+        submission = Submission(entries, ack)
+        self.start()
+        try:
+            self._queue.put(submission, timeout=timeout)
+        except queue.Full:
+            raise IngestBusy(f"ingest queue is full ({self._queue.maxsize} pending submissions)")
+        if ack == ACK_DURABLE:
+            if not submission.done.wait(DURABLE_TIMEOUT):
+                raise IngestFailed("timed out waiting for the write to be flushed")
+            if submission.error:
+                raise IngestFailed(submission.error)
+        return submission
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def drain(self, timeout=None):
+        """Waits until everything queued so far has been written."""
+        marker = Submission([], ACK_DURABLE)
+        self.start()
+        self._queue.put(marker)
+        return marker.done.wait(timeout)
+
+    def _next_group(self):
+        group = [self._queue.get()]
+        count = len(group[0].entries)
+        while count < self.group_size:
+            try:
+                submission = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            group.append(submission)
+            count += len(submission.entries)
+        return group
+
+    def _run(self):
+        while True:
+            group = self._next_group()
+            entries = [entry for submission in group for entry in submission.entries]
+            error = None
+            try:
+                if entries:
+                    self.state.commit(self.store, entries)
+                if any(submission.ack == ACK_DURABLE for submission in group):
+                    self.store.sync()
+            except Exception as e:
+                error = f"{type(e).__name__}: {e}"
+                print(f"Error writing {len(entries)} events: {error}")
+            for submission in group:
+                submission.error = error
+                submission.done.set()
@@ -1,37 +1,41 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, make_response
+import gzip
 import json
-import os
-import pandas as pd
-from folium import Map, Element
+import secrets
+from folium import Map, MacroElement, Element
+from folium.plugins import HeatMap
+from jinja2 import Template
 import folium
-from folium.plugins import HeatMap, MarkerCluster
 from datetime import datetime
-from collections import Counter
-from api import init_api_routes, DATA_FILE, get_data_as_table, get_total_earnings, get_earnings_today
-import ast
-import tempfile
-import shutil
+from api import init_api_routes, connected_clients, DATA_FILE, REDEEM_CLIENT_COOKIE, seed_points, get_clusters, get_data_as_table, get_total_earnings, get_earnings_today, get_total_interactions, get_interactions_today, parse_bbox, ingest_queue_depth
+from aggregates import get_aggregates
+from map_cache import MapRenderCache
+from heat_tiles import HEAT_PAD_PX, SCOPES, HeatTiles
+from day_layers import DayLayers
+from metrics import init_metrics, timed_render
+from profiling import init_profiling, span
+from clustering import CLUSTER_CELL_PX, MAX_ZOOM, MIN_ZOOM
+from geo import TILE_SIZE, expand_bounds, union_bounds, zoom_for_bounds
 
 app = Flask(__name__)
 
+BERKELEY_BOUNDS = [[37.8651, -122.2689], [37.8766, -122.2489]]  # UC Berkeley campus, SW and NE corners
+DEFAULT_BOUNDS = [[37.8, -122.4], [37.9, -122.3]]
+VIEWPORT_MARGIN = 0.5  # also draw points this fraction of the viewport beyond each edge, for panning
+CLUSTER_REFRESH_DELAY_MS = 250  # refetch clusters once the map has stopped moving this long
+REDEEM_COOKIE_MAX_AGE = 365 * 24 * 3600
+
 @app.route('/')
 def show_data():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
-            try:
-                data = json.load(f)
-            except json.JSONDecodeError:
-                data = []
-    else:
-        data = []
-
-    ad_counts = Counter(entry.get('ad_id', '') for entry in data)
-    return render_template('index.html',
-                           data=data,
-                           ad_counts=ad_counts,
-                           earnings_table=get_data_as_table(),
-                           total_earnings=get_total_earnings(),
-                           earnings_today=get_earnings_today())
+    # Only the figures the page shows; raw events are paged from /api/events/query
+    with span('aggregate'):
+        figures = dict(earnings_table=get_data_as_table(),
+                       total_earnings=get_total_earnings(),
+                       earnings_today=get_earnings_today(),
+                       total_interactions=get_total_interactions(),
+                       interactions_today=get_interactions_today())
+    with span('render'):
+        return render_template('index.html', **figures)
 
 @app.route('/land')
 def land_page():
@@ -54,51 +58,250 @@ def testhome_page():
 
 @app.route('/qr-redeem')
 def qr_redeem():
-    return render_template('qr_redeem.html')
+    response = make_response(render_template('qr_redeem.html'))
+    if REDEEM_CLIENT_COOKIE not in request.cookies:
+        # Lets repeat scans from the same phone be told apart from new ones
+        response.set_cookie(REDEEM_CLIENT_COOKIE, secrets.token_urlsafe(16), max_age=REDEEM_COOKIE_MAX_AGE,
+                            httponly=True, samesite='Lax')
+    return response
+
+map_cache = MapRenderCache()
+heat_tiles = HeatTiles(seed_points)
+day_layers = DayLayers()
+
+# Shared by the live and the historical maps
+CLUSTER_ICON_JS = '''function clusterIcon(earnings, color) {
+            var displayValue = '$' + earnings.toFixed(2);
+            var style = `
+                background: linear-gradient(135deg, #ffffff 60%, #e3f0ff 100%);
+                height: 28px; padding: 0 10px; border-radius: 14%; display: flex;
+                justify-content: center; align-items: center; font-size: 1.3em;
+                font-weight: 900; color: ${color}; box-shadow: 0 2px 10px rgba(30,60,120,0.18);
+                text-shadow: 0 2px 8px #fff, 0 0 2px #1976d2, 0 0 8px #fff; user-select: none; opacity: 0.75;
+            `;
+            return new L.DivIcon({
+                html: '<div style="' + style + '">' + displayValue + '</div>',
+                className: 'my-custom-cluster-icon-with-bg',
+                iconSize: [48, 48]
+            });
+        }'''
+
+def add_map_script(m, script):
+    """Adds JavaScript that runs once the map and the layers added before it exist."""
+    # As a child of the map it is rendered after the map's own L.map(...) call
+    element = MacroElement()
+    element._template = Template('{% macro script(this, kwargs) %}{% raw %}' + script + '{% endraw %}{% endmacro %}')
+    m.add_child(element)
+
+def add_cluster_layer(m, clusters, zoom, scope, font_color, flash_color=None, bounds=None):
+    """Draws pre-aggregated clusters and refetches them from /api/clusters as the view changes.
+
+    `clusters` cover `bounds` ([[south, west], [north, east]], None for
+    everywhere). After a zoom, or a pan beyond the area fetched, the clusters
+    around the new view (padded by VIEWPORT_MARGIN) are requested.
+
+    Exposes window.adwalkClusters.addPoints, which folds live points into
+    their grid cells and redraws only those markers (briefly in flash_color).
+    """
+    script = f'''
+    (function() {{
+        var map = {m.get_name()};
+        var layer = L.layerGroup().addTo(map);
+        var renderedZoom = {zoom};
+        var fetchedBounds = {json.dumps(bounds)};  // null: every cluster is drawn
+        fetchedBounds = fetchedBounds && L.latLngBounds(fetchedBounds);
+        var latestRequest = 0, refreshTimer = null;
+        var cells = {{}};  // 'cx:cy' -> {{count, earnings, latSum, lonSum, marker}}
+        {CLUSTER_ICON_JS}
+        function show(key, color) {{
+            var cell = cells[key];
+            var lat = cell.latSum / cell.count, lon = cell.lonSum / cell.count;
+            if (cell.marker) layer.removeLayer(cell.marker);
+            if (cell.count === 1) {{
+                cell.marker = L.marker([lat, lon])
+                    .bindPopup('Lat: ' + lat.toFixed(4) + ', Lon: ' + lon.toFixed(4));
+            }} else {{
+                cell.marker = L.marker([lat, lon], {{icon: clusterIcon(cell.earnings, color || {json.dumps(font_color)})}});
+            }}
+            cell.marker.addTo(layer);
+        }}
+        function draw(clusters) {{
+            layer.clearLayers();
+            cells = {{}};
+            clusters.forEach(function(c) {{
+                var key = c.cell.join(':');
+                cells[key] = {{count: c.count, earnings: c.earnings, latSum: c.lat * c.count, lonSum: c.lon * c.count}};
+                show(key);
+            }});
+        }}
+        function addPoints(points) {{
+            var touched = {{}};
+            points.forEach(function(p) {{
+                // Same grid as clustering.ClusterIndex: {CLUSTER_CELL_PX}px cells in world pixels
+                var px = map.project([p.lat, p.lon], renderedZoom);
+                var key = Math.floor(px.x / {CLUSTER_CELL_PX}) + ':' + Math.floor(px.y / {CLUSTER_CELL_PX});
+                var cell = cells[key] || (cells[key] = {{count: 0, earnings: 0, latSum: 0, lonSum: 0}});
+                cell.count += 1;
+                cell.earnings += p.earnings;
+                cell.latSum += p.lat;
+                cell.lonSum += p.lon;
+                touched[key] = true;
+            }});
+            Object.keys(touched).forEach(function(key) {{
+                show(key, {json.dumps(flash_color)});
+                if ({json.dumps(flash_color)}) setTimeout(function() {{ if (cells[key]) show(key); }}, 1000);
+            }});
+        }}
+        function refresh() {{
+            var zoom = map.getZoom(), view = map.getBounds();
+            if (zoom === renderedZoom && (!fetchedBounds || fetchedBounds.contains(view))) return;
+            var bounds = view.pad({VIEWPORT_MARGIN});
+            var bbox = [bounds.getSouth(), bounds.getWest(), bounds.getNorth(), bounds.getEast()]
+                .map(function(v) {{ return v.toFixed(6); }}).join(',');
+            var request = ++latestRequest;
+            fetch('/api/clusters?scope={scope}&zoom=' + zoom + '&bbox=' + bbox)
+                .then(function(r) {{ return r.json(); }})
+                .then(function(data) {{
+                    if (request !== latestRequest) return;  // a newer view was requested meanwhile
+                    renderedZoom = zoom;
+                    fetchedBounds = bounds;
+                    draw(data.clusters);
+                }});
+        }}
+        draw({json.dumps(clusters)});
+        // moveend also follows every zoom; waiting for the view to settle saves a fetch per step
+        map.on('moveend', function() {{
+            clearTimeout(refreshTimer);
+            refreshTimer = setTimeout(refresh, {CLUSTER_REFRESH_DELAY_MS});
+        }});
+        // The server guessed the zoom from the bounds; the iframe's real size decides it
+        refresh();
+        window.adwalkClusters = {{addPoints: addPoints}};
+    }})();
+    '''
+    add_map_script(m, script)
+
+def add_heat_layer(m, scope):
+    """References the server-rendered heat tiles, so the page carries no point data."""
+    layer = folium.TileLayer(
+        tiles=f'/tiles/heat/{scope}/{{z}}/{{x}}/{{y}}.png',
+        attr='AdWalk',
+        name='heat',
+        overlay=True,
+        control=False,
+        max_zoom=18,
+        max_native_zoom=18,
+    )
+    layer.add_to(m)
+    return layer
+
+def add_live_updates(m, heat_layer, epoch, version, day=None):
+    """Applies the point deltas pushed on /api/events to a rendered map in place.
+
+    version is the state version the page was rendered from; a delta that
+    does not follow on from the last one applied means something was missed,
+    and the page reloads instead. So does an event from another epoch: the
+    server restarted and its versions started over. With `day` set (the
+    today map), only that day's points are drawn and the page reloads once
+    the day is over.
+    Inside the dashboard the parent page forwards its stream with
+    postMessage; opened on its own, the map subscribes itself.
+    """
+    script = f'''
+    (function() {{
+        var map = {m.get_name()};
+        var heat = {heat_layer.get_name()};
+        var epoch = {json.dumps(epoch)};
+        var version = {version};
+        var day = {json.dumps(day)};
+        function refreshHeat(points) {{
+            // Reload just the tiles within the blur radius of a new point
+            var zoom = map.getZoom();
+            var stale = {{}};
+            points.forEach(function(p) {{
+                var px = map.project([p.lat, p.lon], zoom);
+                [-{HEAT_PAD_PX}, {HEAT_PAD_PX}].forEach(function(dx) {{
+                    [-{HEAT_PAD_PX}, {HEAT_PAD_PX}].forEach(function(dy) {{
+                        stale[Math.floor((px.x + dx) / {TILE_SIZE}) + ':' + Math.floor((px.y + dy) / {TILE_SIZE}) + ':' + zoom] = true;
+                    }});
+                }});
+            }});
+            Object.keys(stale).forEach(function(key) {{
+                var tile = heat._tiles[key];
+                if (tile) tile.el.src = heat.getTileUrl(tile.coords) + '?v=' + version;
+            }});
+        }}
+        function apply(id, data) {{
+            // Event ids are "<epoch>-<version>"
+            var sep = String(id).lastIndexOf('-');
+            if (String(id).slice(0, sep) !== epoch) {{ location.reload(); return; }}
+            if (day && data.timestamp.slice(0, 10) !== day) {{ location.reload(); return; }}
+            var next = Number(String(id).slice(sep + 1));
+            if (next <= version) return;
+            if (data.since !== version || !data.points) {{ location.reload(); return; }}
+            version = next;
+            var points = data.points.filter(function(p) {{
+                return p.lat !== null && p.lon !== null && (!day || (p.timestamp || '').slice(0, 10) === day);
+            }});
+            if (!points.length) return;
+            window.adwalkClusters.addPoints(points);
+            refreshHeat(points);
+        }}
+        if (window.parent !== window) {{
+            window.addEventListener('message', function(e) {{
+                if (e.origin === location.origin && e.data && e.data.adwalk) apply(e.data.id, e.data.payload);
+            }});
+        }} else {{
+            new EventSource('/api/events').onmessage = function(e) {{
+                apply(e.lastEventId, JSON.parse(e.data));
+            }};
+        }}
+    }})();
+    '''
+    add_map_script(m, script)
+
+def cached_map_response(key, render):
+    """Serves a rendered map from the in-memory cache, answering 304 when the browser copy is current."""
+    etag, html = map_cache.get_or_render(key, render)
+    return conditional_response(etag, html, 'text/html')
+
+def conditional_response(etag, body, mimetype):
+    if etag in request.headers.get('If-None-Match', ''):
+        response = Response(status=304)
+    else:
+        response = Response(body, mimetype=mimetype)
+    response.headers['ETag'] = etag
+    # Let the browser keep the page but revalidate it on every iframe reload
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
 
 @app.route('/map')
 def map_view():
     font_color = request.args.get('font_color', '#1a237e')  # Default color
-    combined_coords = []
-    valid_coords_exist = False
-
-    # 1. Read from coords.csv (Assuming this should still be included based on previous state)
-    coords_file = 'coords.csv'
-    if os.path.exists(coords_file):
-        try:
-            df_coords = pd.read_csv(coords_file)
-            coords_csv_list = df_coords[['lat', 'lon']].dropna().values.tolist()
-            combined_coords.extend(coords_csv_list)
-            if coords_csv_list:
-                 valid_coords_exist = True
-        except Exception as e:
-            print(f"Error processing {coords_file} for /map: {e}")
-
-    # 2. Read from data.json
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                all_data_json = json.load(f)
-            if isinstance(all_data_json, list):
-                for entry in all_data_json:
-                    coords = parse_coordinate_string(entry.get('coordinates'))
-                    if coords:
-                        combined_coords.append(coords)
-                        valid_coords_exist = True
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading or parsing {DATA_FILE} for /map: {e}")
-
-    if valid_coords_exist:
-        min_lat = min(c[0] for c in combined_coords)
-        max_lat = max(c[0] for c in combined_coords)
-        min_lon = min(c[1] for c in combined_coords)
-        max_lon = max(c[1] for c in combined_coords)
-        padding = 0.001 
-        if min_lat == max_lat: min_lat -= padding; max_lat += padding
-        if min_lon == max_lon: min_lon -= padding; max_lon += padding
-        fit_bounds_coords = [[min_lat, min_lon], [max_lat, max_lon]]
+    # Optional viewport (bbox=south,west,north,east): only the clusters around it are drawn
+    viewport = parse_bbox(request.args.get('bbox'))
+    state = get_aggregates(DATA_FILE)
+    key = ('map', state.epoch, state.version, seed_points.refresh().signature, font_color, str(viewport))
+    return cached_map_response(key, timed_render('map', lambda: render_all_time_map(font_color, viewport)))
+
+def render_all_time_map(font_color, viewport=None):
+    seeds = seed_points.refresh()
+    state = get_aggregates(DATA_FILE)
+    query_bounds = None
+    if viewport:
+        fit_bounds_coords = viewport
+        query_bounds = expand_bounds(viewport, VIEWPORT_MARGIN)
     else:
-        fit_bounds_coords = [[37.8, -122.4], [37.9, -122.3]] # Default view
+        # Extents are kept up to date on ingest, so fitting the map costs nothing per point
+        extent = union_bounds(seeds.extent, state.extent())
+        if extent:
+            (min_lat, min_lon), (max_lat, max_lon) = extent
+            padding = 0.001
+            if min_lat == max_lat: min_lat -= padding; max_lat += padding
+            if min_lon == max_lon: min_lon -= padding; max_lon += padding
+            fit_bounds_coords = [[min_lat, min_lon], [max_lat, max_lon]]
+        else:
+            fit_bounds_coords = DEFAULT_BOUNDS
 
     m = Map(
             tiles="CartoDB positron",
@@ -112,88 +315,33 @@ def map_view():
     
     m.fit_bounds(fit_bounds_coords)
 
-    if combined_coords:
-        HeatMap(combined_coords, radius=13, blur=12, min_opacity=0.3).add_to(m) # Adjusted radius from user prompt
+    # Layers are added even when empty, so live points have somewhere to go
+    heat_layer = add_heat_layer(m, 'all')
+    zoom = zoom_for_bounds(fit_bounds_coords)
+    with state.lock:  # the clusters and the version they reflect, read together
+        version = state.version
+        clusters = get_clusters(zoom, 'all', query_bounds)
+    add_cluster_layer(m, clusters, zoom, 'all', font_color, bounds=query_bounds)
+    add_live_updates(m, heat_layer, state.epoch, version)
 
-        icon_create_function = f'''
-        function(cluster) {{
-            var markers = cluster.getAllChildMarkers();
-            var totalValue = markers.length * 0.20;
-            var displayValue = '$' + totalValue.toFixed(2);
-            var style = `
-                background: linear-gradient(135deg, #ffffff 60%, #e3f0ff 100%);
-                height: 28px; padding: 0 10px; border-radius: 14%; display: flex;
-                justify-content: center; align-items: center; font-size: 1.3em;
-                font-weight: 900; color: {font_color}; box-shadow: 0 2px 10px rgba(30,60,120,0.18);
-                text-shadow: 0 2px 8px #fff, 0 0 2px #1976d2, 0 0 8px #fff; user-select: none; opacity: 0.75;
-            `;
-            return new L.DivIcon({{
-                html: '<div style=\"' + style + '\">' + displayValue + '</div>',
-                className: 'my-custom-cluster-icon-with-bg',
-                iconSize: [48, 48]
-            }});
-        }}
-        '''
-        marker_cluster = MarkerCluster(icon_create_function=icon_create_function).add_to(m)
-
-        for lat, lon in combined_coords:
-            folium.Marker(
-                location=[lat, lon],
-                popup=f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-            ).add_to(marker_cluster)
-
-    # Atomic write to a static file
-    map_filename = "templates/map_render.html"
-    # Use try-finally to ensure temporary file is cleaned up on error during move
-    tmp_file = None
-    try:
-        with tempfile.NamedTemporaryFile("w", dir="templates", delete=False, suffix=".html") as tmp_f:
-            tmp_file = tmp_f.name # Store the temp file name
-            m.save(tmp_file)
-        # If save succeeds, move the file
-        shutil.move(tmp_file, map_filename)
-        tmp_file = None # Indicate move was successful
-    finally:
-        # Clean up the temp file only if the move failed and tmp_file exists
-        if tmp_file and os.path.exists(tmp_file):
-            try:
-                os.remove(tmp_file)
-            except OSError as e:
-                print(f"Error removing temporary file {tmp_file}: {e}")
-
-    return render_template("map_render.html")
+    # Rendered straight to a string; no temp file or template round-trip
+    return m.get_root().render()
 
 @app.route('/map_today')
 def map_today_view():
     font_color = request.args.get('font_color', '#1a237e')  # Default to your original color
-    today_combined_coords = []
-    valid_today_coords_exist = False
+    viewport = parse_bbox(request.args.get('bbox')) or BERKELEY_BOUNDS
     today_date = datetime.now().date()
-    
-    # Load data from data.json and filter for today
-    if os.path.exists(DATA_FILE):
-        try:
-            with open(DATA_FILE, 'r') as f:
-                all_data_json = json.load(f)
-            if isinstance(all_data_json, list):
-                for entry in all_data_json:
-                    try:
-                        entry_ts = datetime.fromisoformat(entry.get('timestamp', '')).date()
-                        if entry_ts == today_date:
-                            coords = parse_coordinate_string(entry.get('coordinates'))
-                            if coords:
-                                today_combined_coords.append(coords)
-                                valid_today_coords_exist = True
-                    except (ValueError, TypeError):
-                        continue  # Ignore invalid timestamps
-        except (json.JSONDecodeError, IOError) as e:
-            print(f"Error reading or parsing {DATA_FILE} for /map_today: {e}")
-
-    # --- Force UC Berkeley campus bounding box ---
-    fit_bounds_coords = [
-        [37.8651, -122.2689],  # South-West corner
-        [37.8766, -122.2489]   # North-East corner
-    ]
+    state = get_aggregates(DATA_FILE)
+    key = ('map_today', state.epoch, state.version, today_date, font_color, str(viewport))
+    return cached_map_response(key, timed_render('map_today', lambda: render_today_map(font_color, today_date, viewport)))
+
+def render_today_map(font_color, today_date, viewport=BERKELEY_BOUNDS):
+    # Clusters around the viewport (the campus box unless one is passed)
+    query_bounds = expand_bounds(viewport, VIEWPORT_MARGIN)
+    state = get_aggregates(DATA_FILE)
+
+    fit_bounds_coords = viewport
     m = Map(
         tiles="CartoDB positron",
         # Enable interactive features
@@ -206,90 +354,166 @@ def map_today_view():
     )
 
     m.fit_bounds(fit_bounds_coords)
-    
-    # Add a timestamp to the HTML to prevent browser caching
-    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-    map_filename = f"templates/map_today_render_{timestamp}.html"
-
-    if today_combined_coords:
-        HeatMap(today_combined_coords, radius=12, blur=12, min_opacity=0.3).add_to(m)
-
-        icon_create_function = f'''
-        function(cluster) {{
-            var markers = cluster.getAllChildMarkers();
-            var totalValue = markers.length * 0.20;
-            var displayValue = '$' + totalValue.toFixed(2);
-            var style = `
-                background: linear-gradient(135deg, #ffffff 60%, #e3f0ff 100%);
-                height: 28px; padding: 0 10px; border-radius: 14%; display: flex;
-                justify-content: center; align-items: center; font-size: 1.3em;
-                font-weight: 900; color: {font_color}; box-shadow: 0 2px 10px rgba(30,60,120,0.18);
-                text-shadow: 0 2px 8px #fff, 0 0 2px #1976d2, 0 0 8px #fff; user-select: none; opacity: 0.75;
-            `;
-            return new L.DivIcon({{
-                html: '<div style=\"' + style + '\">' + displayValue + '</div>',
-                className: 'my-custom-cluster-icon-with-bg',
-                iconSize: [48, 48]
+
+    heat_layer = add_heat_layer(m, 'today')
+    zoom = zoom_for_bounds(fit_bounds_coords)
+    with state.lock:
+        version = state.version
+        clusters = get_clusters(zoom, 'today', query_bounds)
+    # New points flash red for a second, as the old full-page reload did
+    add_cluster_layer(m, clusters, zoom, 'today', font_color, flash_color='#ff0000', bounds=query_bounds)
+    add_live_updates(m, heat_layer, state.epoch, version, today_date.isoformat())
+
+    return m.get_root().render()
+
+@app.route('/tiles/heat/<scope>/<int:z>/<int:x>/<int:y>.png')
+def heat_tile(scope, z, x, y):
+    if scope not in SCOPES or not heat_tiles.valid(z, x, y):
+        return Response(status=404)
+    with span('render'):
+        etag, png = heat_tiles.tile(get_aggregates(DATA_FILE), scope, z, x, y)
+    return conditional_response(etag, png, 'image/png')
+
+HISTORY_PLAY_INTERVAL_MS = 700  # one day per frame when playing back
+HISTORY_PREFETCH_DAYS = 3       # layers fetched ahead of the slider
+HISTORY_HEAT_MAX = 5            # heat grid weight that reaches full intensity, the same on every day
+
+@app.route('/map_history')
+def map_history_view():
+    """Historical map: a slider over the days with data, drawing each day from its precomputed layer."""
+    font_color = request.args.get('font_color', '#1a237e')
+    start_day = request.args.get('day')
+    viewport = parse_bbox(request.args.get('bbox'))
+    return timed_render('map_history', lambda: render_history_map(font_color, start_day, viewport))()
+
+def render_history_map(font_color, start_day=None, viewport=None):
+    extent = get_aggregates(DATA_FILE).extent()
+    fit_bounds_coords = viewport or extent or BERKELEY_BOUNDS
+    m = Map(tiles="CartoDB positron", prefer_canvas=True)
+    m.fit_bounds(fit_bounds_coords)
+    # Empty at first; each day's heat grid is swapped in with setLatLngs
+    heat = HeatMap([], radius=13, blur=12, min_opacity=0.3, max=HISTORY_HEAT_MAX, control=False)
+    heat.add_to(m)
+    m.get_root().html.add_child(Element('''
+    <div id="history-controls" style="position: fixed; left: 50%; bottom: 24px; transform: translateX(-50%);
+         z-index: 1000; background: rgba(255,255,255,0.92); padding: 8px 14px; border-radius: 10px;
+         box-shadow: 0 2px 10px rgba(30,60,120,0.18); font-family: sans-serif; display: flex;
+         align-items: center; gap: 10px; width: min(640px, 90vw);">
+        <button id="history-play" type="button">Play</button>
+        <input id="history-slider" type="range" min="0" max="0" value="0" style="flex: 1;">
+        <span id="history-label" style="min-width: 220px;">Loading days...</span>
+    </div>
+    '''))
+    script = f'''
+    (function() {{
+        var map = {m.get_name()};
+        var heat = {heat.get_name()};
+        var dots = L.layerGroup().addTo(map);
+        var clusterLayer = L.layerGroup().addTo(map);
+        var slider = document.getElementById('history-slider');
+        var label = document.getElementById('history-label');
+        var button = document.getElementById('history-play');
+        var days = [], layers = {{}}, current = null, timer = null;
+        {CLUSTER_ICON_JS}
+        function fetchLayer(day) {{
+            // Each day is fetched once; scrubbing back and forth only redraws
+            if (!layers[day]) {{
+                layers[day] = fetch('/api/days/' + day + '/layer').then(function(r) {{ return r.json(); }});
+            }}
+            return layers[day];
+        }}
+        function drawClusters() {{
+            clusterLayer.clearLayers();
+            var zoom = Math.max({MIN_ZOOM}, Math.min({MAX_ZOOM}, map.getZoom()));
+            (current.clusters[zoom] || []).forEach(function(c) {{
+                if (c[2] === 1) return;  // single events are shown by the dots
+                L.marker([c[0], c[1]], {{icon: clusterIcon(c[3], {json.dumps(font_color)})}}).addTo(clusterLayer);
             }});
         }}
-        '''
-        marker_cluster = MarkerCluster(icon_create_function=icon_create_function).add_to(m)
-
-        for lat, lon in today_combined_coords:
-            folium.Marker(
-                location=[lat, lon],
-                popup=f"Lat: {lat:.4f}, Lon: {lon:.4f}"
-            ).add_to(marker_cluster)
+        function draw(layer) {{
+            current = layer;
+            heat.setLatLngs(layer.heat);
+            dots.clearLayers();
+            layer.points.forEach(function(p) {{
+                L.circleMarker(p, {{radius: 3, weight: 1, color: {json.dumps(font_color)}, fillOpacity: 0.6}}).addTo(dots);
+            }});
+            drawClusters();
+            label.textContent = layer.day + ': ' + layer.count + ' interactions, $' + layer.earnings.toFixed(2)
+                + (layer.summary_only ? ' (summary only)' : '');
+        }}
+        function show(index) {{
+            var day = days[index].day;
+            label.textContent = day + ': loading...';
+            fetchLayer(day).then(function(layer) {{
+                // A later scrub may have moved on while this one loaded
+                if (days[slider.value].day === layer.day) draw(layer);
+            }});
+            for (var k = 1; k <= {HISTORY_PREFETCH_DAYS}; k++) {{
+                if (index + k < days.length) fetchLayer(days[index + k].day);
+            }}
+        }}
+        function stop() {{
+            clearInterval(timer);
+            timer = null;
+            button.textContent = 'Play';
+        }}
+        slider.addEventListener('input', function() {{ show(Number(slider.value)); }});
+        button.addEventListener('click', function() {{
+            if (timer) {{ stop(); return; }}
+            if (Number(slider.value) >= days.length - 1) slider.value = 0;
+            button.textContent = 'Pause';
+            show(Number(slider.value));
+            timer = setInterval(function() {{
+                var next = Number(slider.value) + 1;
+                if (next >= days.length) {{ stop(); return; }}
+                slider.value = next;
+                show(next);
+            }}, {HISTORY_PLAY_INTERVAL_MS});
+        }});
+        map.on('zoomend', function() {{ if (current) drawClusters(); }});
+        fetch('/api/days').then(function(r) {{ return r.json(); }}).then(function(data) {{
+            days = data.days;
+            if (!days.length) {{ label.textContent = 'No data yet'; return; }}
+            slider.max = days.length - 1;
+            var start = days.findIndex(function(d) {{ return d.day === {json.dumps(start_day)}; }});
+            slider.value = start >= 0 ? start : days.length - 1;
+            show(Number(slider.value));
+        }});
+    }})();
+    '''
+    add_map_script(m, script)
+    return m.get_root().render()
 
-    # Map remains static - no click/reset logic needed
+@app.route('/api/days')
+def list_days():
+    """Every local date with data, for the history slider."""
+    return jsonify({'days': [{'day': day.isoformat(), 'count': count, 'earnings': round(earnings, 2)}
+                             for day, count, earnings in day_layers.days(get_aggregates(DATA_FILE))]})
 
-    # Atomic write for today map
-    map_filename_today = "templates/map_today_render.html"
-    tmp_file_today = None
+@app.route('/api/days/<day>/layer')
+def day_layer(day):
     try:
-        with tempfile.NamedTemporaryFile("w", dir="templates", delete=False, suffix=".html") as tmp_f:
-            tmp_file_today = tmp_f.name
-            m.save(tmp_file_today)
-        shutil.move(tmp_file_today, map_filename_today)
-        tmp_file_today = None # Indicate move was successful
-    finally:
-        # Clean up the temp file only if the move failed
-        if tmp_file_today and os.path.exists(tmp_file_today):
-            try:
-                os.remove(tmp_file_today)
-            except OSError as e:
-                print(f"Error removing temporary file {tmp_file_today}: {e}")
-
-    return render_template("map_today_render.html")
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    except ValueError:
+        return Response(status=404)
+    layer = day_layers.get(get_aggregates(DATA_FILE), day)
+    if layer is None:
+        return Response(status=404)
+    etag, body = layer
+    response = conditional_response(etag, body, 'application/json')
+    if response.status_code == 200:
+        # Stored gzipped; only clients that cannot take that get it inflated
+        if 'gzip' in request.headers.get('Accept-Encoding', ''):
+            response.headers['Content-Encoding'] = 'gzip'
+        else:
+            response.set_data(gzip.decompress(body))
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
 
 # Initialize API routes
 init_api_routes(app)
-
-# Restore Helper function to parse coordinate string safely
-def parse_coordinate_string(coord_str):
-    try:
-        # Handle format: "(37.875994, -122.3412217)"
-        if isinstance(coord_str, str) and coord_str.startswith('(') and coord_str.endswith(')'):
-            coords = ast.literal_eval(coord_str)
-            if isinstance(coords, tuple) and len(coords) == 2 and all(isinstance(c, (int, float)) for c in coords):
-                return list(coords)
-                
-        # Handle format: "37.875994,-122.3412217"
-        elif isinstance(coord_str, str) and ',' in coord_str and not coord_str.startswith('('):
-            parts = coord_str.split(',')
-            if len(parts) == 2:
-                try:
-                    lat = float(parts[0].strip())
-                    lon = float(parts[1].strip())
-                    return [lat, lon]
-                except ValueError:
-                    pass
-                    
-        print(f"Warning: Could not parse coordinate string: {coord_str}")
-        return None
-    except (ValueError, SyntaxError, TypeError) as e:
-        print(f"Error parsing coordinate string '{coord_str}': {e}")
-        return None
+init_metrics(app, connected_clients, ingest_queue_depth)
+init_profiling(app)
 
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=3000)
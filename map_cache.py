@@ -0,0 +1,55 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAP_CACHE_SIZE = 32  # rendered map pages kept in memory
+
+
+class MapRenderCache:
+    """LRU cache of rendered map HTML keyed by data version and query parameters.
+
+    A render for a key that is already being built waits for that render
+    instead of starting a second one, so a burst of iframe reloads after an
+    update costs one folium build per distinct page.
+    """
+
+    def __init__(self, maxsize=MAP_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()  # key -> (etag, html)
+        self._lock = threading.Lock()
+        self._render_locks = {}
+
+    @staticmethod
+    def etag_for(key):
+        return '"' + hashlib.md5(repr(key).encode('utf-8')).hexdigest() + '"'
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def get_or_render(self, key, render):
+        """Returns (etag, html) for key, calling render() only on a miss."""
+        entry = self.get(key)
+        if entry is not None:
+            return entry
+        with self._lock:
+            render_lock = self._render_locks.setdefault(key, threading.Lock())
+        with render_lock:
+            entry = self.get(key)
+            if entry is None:
+                entry = (self.etag_for(key), render())
+                with self._lock:
+                    self._entries[key] = entry
+                    self._entries.move_to_end(key)
+                    while len(self._entries) > self.maxsize:
+                        self._entries.popitem(last=False)
+        with self._lock:
+            self._render_locks.pop(key, None)
+        return entry
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
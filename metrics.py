@@ -0,0 +1,191 @@
+import bisect
+import threading
+import time
+
+from profiling import add_span, span
+
+# Minimal in-process metrics in the Prometheus text exposition format.
+# Each update is one small lock and a dict lookup, cheap enough to leave on.
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        REGISTRY.append(self)
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, *labels):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, help_text, labelnames=(), callback=None):
+        super().__init__(name, help_text, labelnames)
+        self.callback = callback
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = value
+
+    def render(self):
+        lines = self.header()
+        if self.callback is not None:
+            items = [((), self.callback())]
+        else:
+            with self._lock:
+                items = sorted(self._values.items())
+        for labels, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                # per-bucket counts (not cumulative) + [sum, count]
+                series = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+            series[index] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = self.header()
+        with self._lock:
+            items = sorted((labels, list(series)) for labels, series in self._values.items())
+        for labels, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = ('le', _format_value(float(bound)))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(series[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, labels)} {series[-1]}")
+        return lines
+
+
+def render_all():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+# --- application metrics ---
+
+HTTP_REQUESTS = Counter('adwalk_http_requests_total', 'HTTP requests by route, method and status.',
+                        ('route', 'method', 'status'))
+HTTP_LATENCY = Histogram('adwalk_http_request_duration_seconds',
+                         'Time to produce a response (streams: until the first byte).', ('route',))
+STORAGE_BYTES = Counter('adwalk_storage_bytes_total', 'Bytes read from and written to event storage.',
+                        ('operation',))
+STORAGE_SECONDS = Counter('adwalk_storage_seconds_total', 'Seconds spent reading and writing event storage.',
+                          ('operation',))
+MAP_RENDER_SECONDS = Histogram('adwalk_map_render_seconds', 'Folium map build and HTML render time.', ('map',))
+MAP_RENDER_BYTES = Gauge('adwalk_map_render_bytes', 'Size of the most recently rendered map page.', ('map',))
+EVENTS_INGESTED = Counter('adwalk_events_ingested_total', 'Events committed to storage.')
+PARSE_FAILURES = Counter('adwalk_parse_failures_total',
+                         'Events rejected by the schema at ingest or migration, by field.', ('field',))
+QR_REDEMPTIONS = Counter('adwalk_qr_redemptions_total', 'QR code scans by outcome.', ('result',))
+
+STORAGE_PHASES = {'read': 'load', 'write': 'write', 'fsync': 'write'}  # profiling phase of each operation
+
+
+def record_storage(operation, nbytes, seconds):
+    STORAGE_BYTES.inc(nbytes, operation)
+    STORAGE_SECONDS.inc(seconds, operation)
+    add_span(STORAGE_PHASES.get(operation, operation), seconds)
+
+
+def timed_render(map_name, render):
+    """Wraps a map render callable so its duration and output size are recorded."""
+    def wrapper():
+        start = time.perf_counter()
+        with span('render'):
+            html = render()
+        MAP_RENDER_SECONDS.observe(time.perf_counter() - start, map_name)
+        MAP_RENDER_BYTES.set(len(html), map_name)
+        return html
+    return wrapper
+
+
+def init_metrics(app, connected_clients, ingest_queue_depth):
+    """Registers per-request timing hooks and the /metrics endpoint."""
+    from flask import Response, g, request
+
+    Gauge('adwalk_sse_subscribers', 'Live /api/events subscribers.', callback=lambda: len(connected_clients))
+    Gauge('adwalk_ingest_queue_depth', 'Submissions waiting for the ingest writer.', callback=ingest_queue_depth)
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def record_request(response):
+        start = g.pop('metrics_start', None)
+        if start is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            HTTP_LATENCY.observe(time.perf_counter() - start, route)
+            HTTP_REQUESTS.inc(1, route, request.method, str(response.status_code))
+        return response
+
+    @app.route('/metrics')
+    def metrics():
+        return Response(render_all(), content_type=CONTENT_TYPE)
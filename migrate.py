@@ -0,0 +1,187 @@
+"""Rewrites stored events and coords.csv into the normalized schema (see schema.py).
+
+Run it with the server stopped:
+
+    python migrate.py [--dry-run]
+
+Events are read and written one at a time, so memory use does not depend on
+history size. Rows that cannot be normalized are left out of the new data
+and written, with the reason, to the quarantine directory.
+"""
+import argparse
+import csv
+import json
+import os
+import shutil
+import time
+
+from metrics import PARSE_FAILURES
+from readers import iter_event_file
+from schema import SchemaError, normalize_event, validate_lat_lon
+from storage import (ARCHIVE_DIR, DAY_PREFIX, EVENT_LOG_DIR, SQLITE_PATH, STORAGE_BACKEND, SUMMARY_SUFFIX,
+                     EventLogStore, MIGRATION_MARKER, SEGMENT_PREFIX, SEGMENT_SUFFIX, SqliteStore, get_store)
+
+DATA_FILE = 'data.json'
+COORDS_FILE = 'coords.csv'
+COORDS_NORMALIZED_FILE = 'coords.jsonl'
+QUARANTINE_DIR = 'quarantine'
+
+
+class Quarantine:
+    """Appends rejected rows, with the reason, to quarantine/<name>.jsonl."""
+
+    def __init__(self, name, dry_run):
+        self.path = os.path.join(QUARANTINE_DIR, f"{name}.jsonl")
+        self.dry_run = dry_run
+        self.count = 0
+        self._file = None
+
+    def add(self, position, reason, raw, field=None):
+        self.count += 1
+        if field:
+            PARSE_FAILURES.inc(1, field)
+        if self.dry_run:
+            return
+        if self._file is None:
+            os.makedirs(QUARANTINE_DIR, exist_ok=True)
+            self._file = open(self.path, 'a', encoding='utf-8')
+        self._file.write(json.dumps({'position': position, 'reason': reason, 'raw': raw}) + '\n')
+
+    def close(self):
+        if self._file:
+            self._file.close()
+
+
+def normalize_stream(events, quarantine):
+    """Yields normalized events; rejected ones go to the quarantine."""
+    for position, raw in enumerate(events):
+        try:
+            yield normalize_event(raw)
+        except SchemaError as e:
+            quarantine.add(position, str(e), raw, e.field)
+
+
+def iter_log_events():
+    """What the event log holds once data.json is imported, read without importing it (for --dry-run)."""
+    if os.path.exists(DATA_FILE) and not os.path.exists(os.path.join(EVENT_LOG_DIR, MIGRATION_MARKER)):
+        yield from iter_event_file(DATA_FILE)  # the import becomes the first segment
+    if os.path.isdir(EVENT_LOG_DIR):
+        store = EventLogStore(EVENT_LOG_DIR)
+        try:
+            yield from store.iter_events()
+        finally:
+            store.close()
+
+
+def migrate_events(dry_run):
+    quarantine = Quarantine('events', dry_run)
+    written = 0
+    if STORAGE_BACKEND == 'json':
+        source = iter_event_file(DATA_FILE) if os.path.exists(DATA_FILE) else iter(())
+        tmp_path = DATA_FILE + '.migrating'
+        out = None if dry_run else open(tmp_path, 'w', encoding='utf-8')
+        if out:
+            out.write('[')
+        for event in normalize_stream(source, quarantine):
+            if out:
+                out.write((',\n  ' if written else '\n  ') + json.dumps(event))
+            written += 1
+        if out:
+            out.write('\n]\n')
+            out.close()
+            if os.path.exists(DATA_FILE):
+                shutil.copy2(DATA_FILE, DATA_FILE + '.bak')
+            os.replace(tmp_path, DATA_FILE)
+    elif STORAGE_BACKEND == 'sqlite' and dry_run and not os.path.exists(SQLITE_PATH):
+        # Check what the first open would import, without creating the database
+        if os.path.isdir(EVENT_LOG_DIR):
+            source = iter_log_events()
+        else:
+            source = iter_event_file(DATA_FILE) if os.path.exists(DATA_FILE) else iter(())
+        for _ in normalize_stream(source, quarantine):
+            written += 1
+    elif STORAGE_BACKEND == 'sqlite':
+        # The first open imports the event log or data.json
+        store = SqliteStore(SQLITE_PATH) if dry_run else get_store(DATA_FILE)
+
+        def normalize(seq, raw):
+            try:
+                return normalize_event(raw)
+            except SchemaError as e:
+                quarantine.add(seq, str(e), raw, e.field)
+                return None
+        # In place, in one transaction; events keep their seq
+        written = store.rewrite(normalize, dry_run)
+        store.close()
+    elif dry_run:
+        for _ in normalize_stream(iter_log_events(), quarantine):
+            written += 1
+    else:
+        store = EventLogStore(EVENT_LOG_DIR)
+        store.migrate_from_json(DATA_FILE)  # raw one-time import, if it has not happened yet
+        target_dir = EVENT_LOG_DIR + '.migrating'
+        shutil.rmtree(target_dir, ignore_errors=True)
+        os.makedirs(target_dir)
+        out = open(os.path.join(target_dir, f"{SEGMENT_PREFIX}{1:06d}{SEGMENT_SUFFIX}"), 'w', encoding='utf-8')
+        for event in normalize_stream(store.iter_events(), quarantine):
+            out.write(json.dumps(event, separators=(',', ':')) + '\n')
+            written += 1
+        store.close()
+        out.flush()
+        os.fsync(out.fileno())
+        out.close()
+        # Days cut down to a summary by retention have no events to carry over
+        archive_dir = os.path.join(EVENT_LOG_DIR, ARCHIVE_DIR)
+        if os.path.isdir(archive_dir):
+            os.makedirs(os.path.join(target_dir, ARCHIVE_DIR), exist_ok=True)
+            for name in os.listdir(archive_dir):
+                if name.startswith(DAY_PREFIX) and name.endswith(SUMMARY_SUFFIX):
+                    shutil.copy2(os.path.join(archive_dir, name), os.path.join(target_dir, ARCHIVE_DIR, name))
+        with open(os.path.join(target_dir, MIGRATION_MARKER), 'w') as f:
+            f.write(f"normalized by migrate.py\n{written}\n")
+        backup_dir = f"{EVENT_LOG_DIR}.bak-{time.strftime('%Y%m%d%H%M%S')}"
+        os.replace(EVENT_LOG_DIR, backup_dir)
+        os.replace(target_dir, EVENT_LOG_DIR)
+        print(f"Previous event log kept in {backup_dir}")
+    quarantine.close()
+    return written, quarantine
+
+
+def migrate_coords(dry_run):
+    quarantine = Quarantine('coords', dry_run)
+    written = 0
+    if not os.path.exists(COORDS_FILE):
+        return written, quarantine
+    tmp_path = COORDS_NORMALIZED_FILE + '.tmp'
+    out = None if dry_run else open(tmp_path, 'w', encoding='utf-8')
+    with open(COORDS_FILE, newline='') as f:
+        # Data rows start on line 2, after the header
+        for line_number, row in enumerate(csv.DictReader(f), 2):
+            try:
+                lat, lon = validate_lat_lon(float(row['lat']), float(row['lon']))
+            except (KeyError, TypeError, ValueError) as e:
+                quarantine.add(line_number, str(e) or 'missing lat/lon', row)
+                continue
+            if out:
+                out.write(json.dumps({'date': row.get('date'), 'lat': lat, 'lon': lon}) + '\n')
+            written += 1
+    if out:
+        out.close()
+        os.replace(tmp_path, COORDS_NORMALIZED_FILE)
+    quarantine.close()
+    return written, quarantine
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--dry-run', action='store_true', help="validate and report without writing anything")
+    args = parser.parse_args()
+
+    for name, migrate in (('events', migrate_events), ('coords', migrate_coords)):
+        written, quarantine = migrate(args.dry_run)
+        print(f"{name}: {written} rows normalized, {quarantine.count} quarantined"
+              + (f" (see {quarantine.path})" if quarantine.count and not args.dry_run else ''))
+
+
+if __name__ == '__main__':
+    main()
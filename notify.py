@@ -0,0 +1,106 @@
+import atexit
+import os
+import socket
+import threading
+import time
+
+# Cross-process change notification for workers sharing one store on one
+# machine. Every process binds a Unix datagram socket, named after its pid,
+# in a shared directory; after a commit the writer sends one byte to each of
+# the others. A waiting process wakes on that byte instead of polling.
+# Messages only say "something changed": what changed is read from the store.
+
+NOTIFY_SUFFIX = '.sock'
+
+
+class ChangeNotifier:
+    """Wakes the other processes on this machine that watch the same directory.
+
+    Without Unix sockets (Windows), wait() just sleeps out its timeout, so
+    followers fall back to polling at that interval.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._pid = None
+        self._sock = None
+        self._sender = None
+        self._path = None
+        self._lock = threading.Lock()
+
+    @property
+    def supported(self):
+        return hasattr(socket, 'AF_UNIX')
+
+    def listen(self):
+        """Starts receiving notifications; waiting or notifying does this too."""
+        # Rebinding after a fork gives each worker process its own socket
+        if self._pid == os.getpid() or not self.supported:
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{os.getpid()}{NOTIFY_SUFFIX}")
+            try:
+                os.unlink(path)  # left behind by an earlier process with the same pid
+            except FileNotFoundError:
+                pass
+            self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sock.bind(path)
+            self._sender = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            self._sender.setblocking(False)
+            self._path = path
+            self._pid = os.getpid()
+            atexit.register(self.close)
+
+    def notify(self):
+        """Tells every other watching process that the shared state changed."""
+        if not self.supported:
+            return
+        self.listen()
+        own = os.path.basename(self._path)
+        for name in os.listdir(self.directory):
+            if name == own or not name.endswith(NOTIFY_SUFFIX):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                self._sender.sendto(b'1', path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Nobody is bound to it any more: the process has exited
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                pass  # its queue is full, so it has a wake-up pending already
+
+    def wait(self, timeout):
+        """Blocks until another process notifies or `timeout` seconds pass; returns whether it was woken."""
+        if not self.supported:
+            time.sleep(timeout)
+            return False
+        self.listen()
+        self._sock.settimeout(timeout)
+        try:
+            self._sock.recv(16)
+        except socket.timeout:
+            return False
+        # Several commits may have notified while we were busy; one wake-up covers them all
+        self._sock.setblocking(False)
+        try:
+            while True:
+                self._sock.recv(16)
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self._sock is not None and self._pid == os.getpid():
+            self._sock.close()
+            self._sender.close()
+            try:
+                os.unlink(self._path)
+            except FileNotFoundError:
+                pass
+        self._sock = self._sender = self._pid = None
@@ -0,0 +1,287 @@
+import contextvars
+import cProfile
+import io
+import itertools
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+from collections import deque
+from contextlib import nullcontext
+from datetime import datetime
+
+# Opt-in request profiling, switched on and off at runtime from /admin/profiling.
+# Off, span() is one context variable lookup returning a shared no-op and
+# the request hooks return after checking one flag.
+#
+# On, each request gets a trace adding up the time spent in named phases
+# (load, parse, aggregate, render, write). Requests at least slow_seconds
+# long are kept with that breakdown in a ring buffer. A sampled fraction of
+# requests also runs under cProfile; their profiles can be downloaded in the
+# pstats format (`python -m pstats`, snakeviz) or read as text.
+# State is per process: with several workers, each one is toggled and read
+# on its own (responses carry the pid).
+
+PROFILING_ENV = 'ADWALK_PROFILING'      # "1" turns profiling on at startup
+ADMIN_TOKEN_ENV = 'ADWALK_ADMIN_TOKEN'  # bearer token for /admin/*; unset, only loopback clients get in
+DEFAULT_SAMPLE_RATE = 0.05   # fraction of traced requests also run under cProfile
+DEFAULT_SLOW_SECONDS = 0.25  # traced requests at least this long go into the slow request buffer
+SLOW_REQUEST_BUFFER = 100    # slow requests kept, the newest replacing the oldest
+PROFILE_BUFFER = 20          # sampled profiles kept for download
+PROFILE_TEXT_LINES = 40      # functions listed by the text form of a profile
+
+_current = contextvars.ContextVar('adwalk_trace', default=None)
+_NO_SPAN = nullcontext()
+
+
+class Trace:
+    """Phase timings of one request; time in a nested span counts towards the innermost one only."""
+
+    __slots__ = ('start', 'phases', '_stack')
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.phases = {}  # name -> [seconds, count]
+        self._stack = []  # open spans: [name, start, seconds taken by spans inside it]
+
+    def enter(self, name):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def exit(self):
+        name, start, nested = self._stack.pop()
+        elapsed = time.perf_counter() - start
+        self._add(name, elapsed - nested)
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    def add(self, name, seconds):
+        """Counts time measured by the caller, e.g. storage I/O, as a span inside the open one."""
+        self._add(name, seconds)
+        if self._stack:
+            self._stack[-1][2] += seconds
+
+    def _add(self, name, seconds):
+        phase = self.phases.get(name)
+        if phase is None:
+            phase = self.phases[name] = [0.0, 0]
+        phase[0] += seconds
+        phase[1] += 1
+
+
+class _Span:
+    __slots__ = ('trace', 'name')
+
+    def __init__(self, trace, name):
+        self.trace = trace
+        self.name = name
+
+    def __enter__(self):
+        self.trace.enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.trace.exit()
+
+
+def span(name):
+    """Context manager timing one phase of the current request; a no-op unless it is being traced."""
+    trace = _current.get()
+    return _NO_SPAN if trace is None else _Span(trace, name)
+
+
+def add_span(name, seconds):
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+
+class Profiler:
+    def __init__(self, enabled=False, sample_rate=DEFAULT_SAMPLE_RATE, slow_seconds=DEFAULT_SLOW_SECONDS):
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.slow_seconds = slow_seconds
+        self.slow_requests = deque(maxlen=SLOW_REQUEST_BUFFER)  # request records
+        self.profiles = deque(maxlen=PROFILE_BUFFER)            # (request record, cProfile.Profile)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        # cProfile runs for one request at a time: it keeps the overhead
+        # bounded, and from 3.12 only one profiler may be active at all
+        self._sampling = threading.Lock()
+
+    def start(self):
+        """Starts tracing the calling request; returns what finish() needs."""
+        trace = Trace()
+        token = _current.set(trace)
+        profile = None
+        if self.sample_rate and random.random() < self.sample_rate and self._sampling.acquire(blocking=False):
+            profile = cProfile.Profile()
+            try:
+                profile.enable()
+            except ValueError:  # another profiler, such as a debugger, is active
+                self._sampling.release()
+                profile = None
+        return trace, token, profile
+
+    def finish(self, started, method, route, path, status):
+        trace, token, profile = started
+        if profile is not None:
+            profile.disable()
+            self._sampling.release()
+        duration = time.perf_counter() - trace.start
+        _current.reset(token)
+        slow = duration >= self.slow_seconds
+        if not slow and profile is None:
+            return None
+        record = {
+            'id': next(self._ids),
+            'time': datetime.now().isoformat(timespec='milliseconds'),
+            'method': method,
+            'route': route,
+            'path': path,
+            'status': status,
+            'duration_ms': round(duration * 1000, 2),
+            'phases': {name: {'ms': round(seconds * 1000, 2), 'count': count}
+                       for name, (seconds, count) in sorted(trace.phases.items(), key=lambda item: -item[1][0])},
+            # Time outside every span: routing, serialization, waiting on locks...
+            'other_ms': round((duration - sum(seconds for seconds, _ in trace.phases.values())) * 1000, 2),
+            'profile': None,
+        }
+        with self._lock:
+            if profile is not None:
+                record['profile'] = record['id']
+                self.profiles.append((record, profile))
+            if slow:
+                self.slow_requests.append(record)
+        return record
+
+    def configure(self, enabled=None, sample_rate=None, slow_seconds=None, clear=False):
+        with self._lock:
+            if sample_rate is not None:
+                self.sample_rate = sample_rate
+            if slow_seconds is not None:
+                self.slow_seconds = slow_seconds
+            if enabled is not None:
+                self.enabled = enabled
+            if clear:
+                self.slow_requests.clear()
+                self.profiles.clear()
+
+    def status(self):
+        with self._lock:
+            slow_requests = sorted(self.slow_requests, key=lambda record: -record['duration_ms'])
+            profiles = [record for record, _ in self.profiles]
+        return {
+            'enabled': self.enabled,
+            'pid': os.getpid(),
+            'sample_rate': self.sample_rate,
+            'slow_ms': round(self.slow_seconds * 1000, 2),
+            'slow_requests': slow_requests,
+            'profiles': profiles,
+        }
+
+    def stats(self, profile_id=None):
+        """pstats.Stats of one kept profile, or of all of them merged; None if there is none."""
+        with self._lock:
+            profiles = [profile for record, profile in self.profiles
+                        if profile_id is None or record['id'] == profile_id]
+        if not profiles:
+            return None
+        stats = pstats.Stats(profiles[0], stream=io.StringIO())
+        for profile in profiles[1:]:
+            stats.add(profile)
+        return stats
+
+
+def dump_stats(stats):
+    """The bytes pstats.Stats.dump_stats() would write to a .prof file."""
+    return marshal.dumps(stats.stats)
+
+
+def format_stats(stats, lines=PROFILE_TEXT_LINES):
+    stats.stream = io.StringIO()
+    stats.sort_stats('cumulative').print_stats(lines)
+    return stats.stream.getvalue()
+
+
+profiler = Profiler(enabled=os.environ.get(PROFILING_ENV) == '1')
+
+
+def init_profiling(app):
+    """Registers the request tracing hooks and the /admin/profiling endpoints."""
+    import hmac
+
+    from flask import Response, abort, g, jsonify, request
+
+    @app.before_request
+    def start_trace():
+        if profiler.enabled:
+            g.profiling = profiler.start()
+
+    @app.after_request
+    def note_status(response):
+        if 'profiling' in g:
+            g.profiling_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_trace(error):
+        # Teardown also runs after an unhandled exception, so the trace and a running cProfile always end here
+        started = g.pop('profiling', None)
+        if started is not None:
+            route = request.url_rule.rule if request.url_rule else 'unmatched'
+            profiler.finish(started, request.method, route, request.path, g.pop('profiling_status', 500))
+
+    def require_admin():
+        token = os.environ.get(ADMIN_TOKEN_ENV)
+        if token:
+            supplied = request.headers.get('Authorization', '').removeprefix('Bearer ')
+            if not hmac.compare_digest(supplied.encode('utf-8'), token.encode('utf-8')):
+                abort(403, description="admin token required")
+        elif request.remote_addr not in ('127.0.0.1', '::1'):
+            abort(403, description=f"set {ADMIN_TOKEN_ENV} to use admin endpoints from other hosts")
+
+    @app.route('/admin/profiling', methods=['GET', 'POST'])
+    def profiling_settings():
+        """GET: settings, slow requests (slowest first) and kept profiles. POST: changes settings.
+
+        POST takes a JSON object with any of enabled (bool), sample_rate
+        (0 to 1), slow_ms (>= 0) and clear (bool, empties both buffers).
+        """
+        require_admin()
+        if request.method == 'POST':
+            data = request.get_json(silent=True)
+            if not isinstance(data, dict):
+                abort(400, description="Invalid JSON")
+            enabled, sample_rate, slow_ms = data.get('enabled'), data.get('sample_rate'), data.get('slow_ms')
+            if enabled is not None and not isinstance(enabled, bool):
+                abort(400, description="enabled must be true or false")
+            if sample_rate is not None and not (isinstance(sample_rate, (int, float)) and 0 <= sample_rate <= 1):
+                abort(400, description="sample_rate must be a number from 0 to 1")
+            if slow_ms is not None and not (isinstance(slow_ms, (int, float)) and slow_ms >= 0):
+                abort(400, description="slow_ms must be a non-negative number")
+            profiler.configure(enabled, sample_rate, None if slow_ms is None else slow_ms / 1000,
+                               clear=bool(data.get('clear')))
+        return jsonify(profiler.status())
+
+    def profile_response(profile_id):
+        stats = profiler.stats(profile_id)
+        if stats is None:
+            abort(404, description="no such profile; it may have been replaced by newer ones")
+        if request.args.get('format') == 'text':
+            return Response(format_stats(stats), mimetype='text/plain')
+        name = f"adwalk-{os.getpid()}-{profile_id or 'combined'}.prof"
+        return Response(dump_stats(stats), mimetype='application/octet-stream',
+                        headers={'Content-Disposition': f'attachment; filename="{name}"'})
+
+    @app.route('/admin/profiling/profiles/<int:profile_id>')
+    def download_profile(profile_id):
+        """One sampled request's profile as a .prof file, or as text with ?format=text."""
+        require_admin()
+        return profile_response(profile_id)
+
+    @app.route('/admin/profiling/profiles/combined')
+    def download_combined_profile():
+        """Every kept profile merged into one."""
+        require_admin()
+        return profile_response(None)
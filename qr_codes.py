@@ -0,0 +1,80 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from collections import namedtuple
+
+# Signed redemption codes: one per ad_id and placement (a poster, a table
+# tent...), with an optional serial for several codes at one placement.
+#
+#   <base64url(ad_id \x1f placement \x1f serial)>.<base64url(HMAC-SHA256[:12])>
+#
+# The server only needs the secret to check a code, so codes can be printed
+# in bulk ahead of time and nothing is looked up per scan.
+
+QR_SECRET_ENV = 'ADWALK_QR_SECRET'
+QR_SECRET_FILE = os.environ.get('ADWALK_QR_SECRET_FILE', 'qr_secret.key')
+SIGNATURE_BYTES = 12  # 96-bit MAC: short enough to keep the QR code small
+FIELD_SEPARATOR = '\x1f'
+LEGACY_AD_ID = 'qr_default'  # what the unsigned /qr-redeem code has always been booked as
+LEGACY_PLACEMENT = 'legacy'
+
+RedemptionCode = namedtuple('RedemptionCode', ['ad_id', 'placement', 'serial'])
+
+
+class InvalidCode(ValueError):
+    pass
+
+
+def load_secret(path=QR_SECRET_FILE):
+    """The signing key: $ADWALK_QR_SECRET, else a key file created on first use and shared by every process."""
+    secret = os.environ.get(QR_SECRET_ENV)
+    if secret:
+        return secret.encode('utf-8')
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, 'rb') as f:
+            return f.read().strip()
+    key = secrets.token_hex(32).encode('ascii')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(key)
+    return key
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+
+def _signature(secret, payload):
+    return hmac.new(secret, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def sign_code(secret, ad_id, placement, serial=1):
+    for value in (ad_id, placement):
+        if not value or FIELD_SEPARATOR in value:
+            raise ValueError(f"invalid ad_id or placement: {value!r}")
+    payload = FIELD_SEPARATOR.join((ad_id, placement, str(int(serial)))).encode('utf-8')
+    return f"{_b64encode(payload)}.{_b64encode(_signature(secret, payload))}"
+
+
+def verify_code(secret, token):
+    """Returns the RedemptionCode a token stands for; raises InvalidCode if it was not signed with `secret`."""
+    try:
+        encoded_payload, encoded_signature = token.split('.')
+        payload = _b64decode(encoded_payload)
+        signature = _b64decode(encoded_signature)
+    except (AttributeError, ValueError):
+        raise InvalidCode("malformed redemption code")
+    if not hmac.compare_digest(signature, _signature(secret, payload)):
+        raise InvalidCode("redemption code signature does not match")
+    try:
+        ad_id, placement, serial = payload.decode('utf-8').split(FIELD_SEPARATOR)
+        return RedemptionCode(ad_id, placement, int(serial))
+    except ValueError:
+        raise InvalidCode("malformed redemption code")
@@ -1,12 +1,107 @@
+"""Generates QR codes for the /qr-redeem page.
+
+Without --ad it writes the original single, unsigned code to qr_redeem.png.
+With --ad it writes one signed code per placement (and serial) in bulk:
+
+    python qr_gen.py --ad ozempic --placements library,gym,dining-hall --per-placement 5
+
+Images are rendered in parallel, one process per core, into
+qr_codes/<ad_id>/<placement>-<serial>.png, and listed in
+qr_codes/manifest.csv. A code whose image already exists with the same URL
+is not rendered again, so re-running after adding placements only renders
+the new ones. Codes are signed with the same key the server checks them
+with (see qr_codes.py).
+"""
+import argparse
+import csv
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
 import qrcode
 
+from qr_codes import load_secret, sign_code
+
 # Your server's URL for the QR redeem page
-url = "http://10.41.147.22:3000/qr-redeem"
+DEFAULT_BASE_URL = "http://10.41.147.22:3000"
+LEGACY_OUTPUT = "qr_redeem.png"
+OUTPUT_DIR = "qr_codes"
+MANIFEST_NAME = "manifest.csv"
+MANIFEST_FIELDS = ('ad_id', 'placement', 'serial', 'url', 'file')
+NAME_PATTERN = re.compile(r'^[A-Za-z0-9_.-]+$')  # ad_id and placements are used in file names
+
+
+def render(job):
+    url, path = job
+    qrcode.make(url).save(path)
+    return path
+
+
+def read_manifest(path):
+    """file -> url of the codes rendered by earlier runs."""
+    if not os.path.exists(path):
+        return {}
+    with open(path, newline='') as f:
+        return {row['file']: row['url'] for row in csv.DictReader(f)}
+
+
+def generate(base_url, ad_id, placements, per_placement, output_dir, workers=None):
+    secret = load_secret()
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    rendered = read_manifest(manifest_path)
+    os.makedirs(os.path.join(output_dir, ad_id), exist_ok=True)
+
+    rows, jobs = [], []
+    for placement in placements:
+        for serial in range(1, per_placement + 1):
+            url = f"{base_url.rstrip('/')}/qr-redeem?c={sign_code(secret, ad_id, placement, serial)}"
+            path = os.path.join(output_dir, ad_id, f"{placement}-{serial}.png")
+            rows.append({'ad_id': ad_id, 'placement': placement, 'serial': serial, 'url': url, 'file': path})
+            if rendered.get(path) != url or not os.path.exists(path):
+                jobs.append((url, path))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for _ in pool.map(render, jobs, chunksize=16):
+            pass
+
+    # Keep the other ads' rows; this ad's rows are replaced by this run's
+    kept = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, newline='') as f:
+            kept = {row['file']: row for row in csv.DictReader(f) if row['ad_id'] != ad_id}
+    kept.update((row['file'], row) for row in rows)
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, MANIFEST_FIELDS)
+        writer.writeheader()
+        writer.writerows(kept.values())
+    os.replace(tmp_path, manifest_path)
+    return len(rows), len(jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--base-url', default=DEFAULT_BASE_URL, help="server the codes point at")
+    parser.add_argument('--ad', help="ad_id the codes are booked to; omit for the single legacy code")
+    parser.add_argument('--placements', default='default', help="comma-separated placement names")
+    parser.add_argument('--per-placement', type=int, default=1, help="codes (serials) per placement")
+    parser.add_argument('--out', default=OUTPUT_DIR, help="output directory")
+    parser.add_argument('--workers', type=int, help="render processes (default: one per core)")
+    args = parser.parse_args()
+
+    if not args.ad:
+        # Generate the QR code and save it as an image file
+        qrcode.make(f"{args.base_url.rstrip('/')}/qr-redeem").save(LEGACY_OUTPUT)
+        print(f"QR code saved as {LEGACY_OUTPUT}")
+        return
 
-# Generate the QR code
-img = qrcode.make(url)
+    placements = [name.strip() for name in args.placements.split(',') if name.strip()]
+    for name in [args.ad] + placements:
+        if not NAME_PATTERN.match(name):
+            parser.error(f"{name!r}: use letters, digits, '.', '_' and '-' only")
+    total, new = generate(args.base_url, args.ad, placements, args.per_placement, args.out, args.workers)
+    print(f"{total} codes for {args.ad} in {args.out} ({new} rendered, {total - new} already up to date)")
 
-# Save the QR code as an image file
-img.save("qr_redeem.png")
 
-print("QR code saved as qr_redeem.png")
\ No newline at end of file
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import json
+import re
+
+# Streaming readers for stored event files. Both formats are read a chunk or
+# a line at a time, so memory use is bounded by the largest single record,
+# not by the size of the file:
+#
+#   - a JSON array of objects (the original data.json)
+#   - line-delimited JSON, one object per line (the event log)
+#
+# Malformed records are reported through on_error(position, message) and
+# skipped; the rest of the file is still read.
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_RECORD_SIZE = 1024 * 1024  # a "record" longer than this is treated as malformed
+_NEXT_RECORD = re.compile(r',\s*(?=\{)')
+_SEPARATORS = re.compile(r'[\s,]*')
+
+
+def print_error(position, message):
+    print(f"Skipping malformed event at {position}: {message}")
+
+
+def iter_json_array(f, name='<array>', on_error=print_error):
+    """Yields the elements of a top-level JSON array from an open text file.
+
+    After a malformed element, reading resumes at the next ',{' boundary.
+    """
+    decoder = json.JSONDecoder()
+    buffer, pos, consumed, eof = '', 0, 0, False  # consumed: characters dropped from the buffer's front
+
+    def refill():
+        nonlocal buffer, pos, consumed, eof
+        chunk = f.read(READ_CHUNK_SIZE)
+        eof = not chunk
+        consumed += pos
+        buffer, pos = buffer[pos:] + chunk, 0
+
+    refill()
+    pos = _SEPARATORS.match(buffer).end()
+    if pos == len(buffer) and eof:
+        return
+    if buffer[pos:pos + 1] != '[':
+        raise ValueError(f"{name} does not contain a JSON array")
+    pos += 1
+    while True:
+        pos = _SEPARATORS.match(buffer, pos).end()
+        if pos == len(buffer):
+            if eof:
+                on_error(f"{name}@{consumed + pos}", "array is not terminated")
+                return
+            refill()
+            continue
+        if buffer[pos] == ']':
+            return
+        try:
+            value, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError as e:
+            if not eof and len(buffer) - pos < MAX_RECORD_SIZE:
+                refill()  # most likely just cut off at the end of the buffer
+                continue
+            on_error(f"{name}@{consumed + pos}", e.msg)
+            match = _NEXT_RECORD.search(buffer, pos + 1)
+            if match is None:
+                if eof:
+                    return
+                # Keep a short tail in case the boundary spans two chunks
+                pos = max(len(buffer) - 16, pos + 1)
+                refill()
+                continue
+            pos = match.end()
+            continue
+        yield value
+        pos = end
+        if not eof and len(buffer) - pos < READ_CHUNK_SIZE:
+            refill()
+
+
+def iter_ndjson(f, name='<ndjson>', on_error=print_error, torn_tail=False):
+    """Yields one object per non-blank line of an open text (or binary) file.
+
+    With torn_tail, a last line without a newline is taken to be a write
+    that was never acknowledged (as in the event log) and dropped silently.
+    """
+    for line_number, line in enumerate(f, 1):
+        if torn_tail and not line.endswith('\n'):
+            break
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:  # JSONDecodeError, or bad UTF-8 in a binary stream
+            on_error(f"{name}:{line_number}", getattr(e, 'msg', str(e)))
+
+
+def iter_event_file(path, on_error=print_error):
+    """Yields the events of a file in either format, telling them apart by the first character."""
+    with open(path, 'r', encoding='utf-8') as f:
+        first = ''
+        while True:
+            char = f.read(1)
+            if not char or not char.isspace():
+                first = char
+                break
+        f.seek(0)
+        if first == '[':
+            yield from iter_json_array(f, path, on_error)
+        elif first:
+            yield from iter_ndjson(f, path, on_error)
+
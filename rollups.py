@@ -0,0 +1,194 @@
+from datetime import datetime, time, timedelta
+
+import numpy as np
+
+from columnar import NO_DAY
+
+
+class Bucket:
+    """Counts and earnings for one time bucket, with per-ad_id and per-interaction_type breakdowns."""
+
+    __slots__ = ('count', 'earnings', 'by_ad', 'by_type')
+
+    def __init__(self):
+        self.count = 0
+        self.earnings = 0.0
+        self.by_ad = {}     # ad_id -> [interactions, earnings]
+        self.by_type = {}   # interaction_type -> [interactions, earnings]
+
+    def add(self, ad_id, interaction_type, earnings, count=1):
+        self.count += count
+        self.earnings += earnings
+        if ad_id is not None:
+            totals = self.by_ad.setdefault(ad_id, [0, 0.0])
+            totals[0] += count
+            totals[1] += earnings
+        if interaction_type is not None:
+            totals = self.by_type.setdefault(interaction_type, [0, 0.0])
+            totals[0] += count
+            totals[1] += earnings
+
+    def merge(self, other):
+        self.count += other.count
+        self.earnings += other.earnings
+        for mine, theirs in ((self.by_ad, other.by_ad), (self.by_type, other.by_type)):
+            for key, (count, earnings) in theirs.items():
+                totals = mine.setdefault(key, [0, 0.0])
+                totals[0] += count
+                totals[1] += earnings
+
+    def to_dict(self):
+        return {
+            'interactions': self.count,
+            'earnings': round(self.earnings, 2),
+            'by_ad': {key: {'interactions': c, 'earnings': round(e, 2)} for key, (c, e) in self.by_ad.items()},
+            'by_type': {key: {'interactions': c, 'earnings': round(e, 2)} for key, (c, e) in self.by_type.items()},
+        }
+
+
+class RollupIndex:
+    """Per-hour and per-day buckets keyed by local time, maintained on ingest.
+
+    Buckets are keyed by the event's own local date and hour, so "today" is
+    just the bucket for datetime.now().date(): at local midnight reads move
+    to a fresh bucket without any reset. Range queries combine whole days
+    with the hour buckets at the two partial edges, so they never touch raw
+    events, and are clamped to the days that have buckets, so a span of
+    years costs no more than the data inside it.
+    """
+
+    def __init__(self):
+        self.hours = {}  # datetime truncated to the hour -> Bucket
+        self.days = {}   # date -> Bucket
+        self.first_day = None  # earliest and latest dates with a bucket; queries are clamped to them
+        self.last_day = None
+
+    def add(self, timestamp, ad_id, interaction_type, earnings, count=1):
+        hour = timestamp.replace(minute=0, second=0, microsecond=0)
+        bucket = self.hours.get(hour)
+        if bucket is None:
+            bucket = self.hours[hour] = Bucket()
+        bucket.add(ad_id, interaction_type, earnings, count)
+        day = self.days.get(hour.date())
+        if day is None:
+            day = self.days[hour.date()] = Bucket()
+            self._note_day(hour.date())
+        day.add(ad_id, interaction_type, earnings, count)
+
+    def add_columns(self, columns, start=0):
+        """Vectorized bulk add of rows [start:] of a ColumnarEvents store.
+
+        Rows are grouped by (day, hour, ad_id, interaction_type) with one
+        np.unique, so the Python work is per distinct group, not per event.
+        """
+        days = columns.column('day')[start:]
+        valid = days != NO_DAY
+        days = days[valid].astype(np.int64)
+        hours = columns.column('hour')[start:][valid].astype(np.int64)
+        ads = columns.column('ad')[start:][valid].astype(np.int64) + 1  # shift NO_CATEGORY to 0
+        types = columns.column('type')[start:][valid].astype(np.int64) + 1
+        earnings = columns.column('earnings')[start:][valid]
+        if not len(days):
+            return
+        n_ads, n_types = len(columns.ad_ids) + 1, len(columns.interaction_types) + 1
+        keys = ((days * 24 + hours) * n_ads + ads) * n_types + types
+        unique_keys, inverse = np.unique(keys, return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.bincount(inverse)
+        sums = np.bincount(inverse, weights=earnings)
+        for key, count, total in zip(unique_keys.tolist(), counts.tolist(), sums.tolist()):
+            key, type_code = divmod(key, n_types)
+            key, ad_code = divmod(key, n_ads)
+            day, hour = divmod(key, 24)
+            timestamp = datetime.fromordinal(day).replace(hour=hour)
+            ad_id = columns.ad_ids.values[ad_code - 1] if ad_code else None
+            interaction_type = columns.interaction_types.values[type_code - 1] if type_code else None
+            self.add(timestamp, ad_id, interaction_type, total, count)
+
+    def add_summary(self, day, summary):
+        """Folds in a day known only from its archive summary (see segments.py).
+
+        The per-ad_id and per-interaction_type split is kept for the day;
+        its hour buckets only get counts and earnings.
+        """
+        bucket = self.days.setdefault(day, Bucket())
+        self._note_day(day)
+        bucket.count += summary['count']
+        bucket.earnings += summary['earnings']
+        for mine, theirs in ((bucket.by_ad, summary['by_ad']), (bucket.by_type, summary['by_type'])):
+            for key, (count, earnings) in theirs.items():
+                totals = mine.setdefault(key, [0, 0.0])
+                totals[0] += count
+                totals[1] += earnings
+        for hour, (count, earnings) in summary['by_hour'].items():
+            hour_start = datetime.combine(day, time(int(hour)))
+            self.hours.setdefault(hour_start, Bucket()).add(None, None, earnings, count)
+
+    def day(self, day):
+        return self.days.get(day) or Bucket()
+
+    def _note_day(self, day):
+        if self.first_day is None or day < self.first_day:
+            self.first_day = day
+        if self.last_day is None or day > self.last_day:
+            self.last_day = day
+
+    def _clamp(self, start, end):
+        """[start, end) narrowed to the days with buckets; None if that leaves nothing."""
+        if self.first_day is None:
+            return None
+        start = max(start, datetime.combine(self.first_day, time()))
+        end = min(end, datetime.combine(self.last_day + timedelta(days=1), time()))
+        return (start, end) if start < end else None
+
+    def range(self, start, end):
+        """Totals for [start, end) at hour resolution: start rounds down and end rounds up to the hour."""
+        total = Bucket()
+        clamped = self._clamp(start, end)
+        if clamped is None:
+            return total
+        for _, bucket in self._walk(*clamped):
+            total.merge(bucket)
+        return total
+
+    def series(self, start, end, granularity='hour'):
+        """Non-empty (bucket_start, Bucket) pairs for [start, end) at 'hour' or 'day' granularity."""
+        clamped = self._clamp(start, end)
+        if clamped is None:
+            return []
+        start, end = clamped
+        if granularity == 'day':
+            series = []
+            day_start = datetime.combine(start.date(), time())
+            while day_start < end:
+                next_day = day_start + timedelta(days=1)
+                bucket = self.range(max(start, day_start), min(end, next_day))
+                if bucket.count:
+                    series.append((day_start, bucket))
+                day_start = next_day
+            return series
+        return [(hour, bucket) for hour, bucket in self._walk(start, end, whole_days=False)]
+
+    def _walk(self, start, end, whole_days=True):
+        """Yields the non-empty buckets covering [start, end).
+
+        Whole days inside the range come from the day buckets (unless
+        whole_days is False); the partial days at either edge come from the
+        hour buckets.
+        """
+        hour = start.replace(minute=0, second=0, microsecond=0)
+        end_hour = end.replace(minute=0, second=0, microsecond=0)
+        if end_hour < end:
+            end_hour += timedelta(hours=1)
+        end = end_hour
+        while hour < end:
+            if whole_days and hour.hour == 0 and hour + timedelta(days=1) <= end:
+                bucket = self.days.get(hour.date())
+                if bucket is not None:
+                    yield hour, bucket
+                hour += timedelta(days=1)
+                continue
+            bucket = self.hours.get(hour)
+            if bucket is not None:
+                yield hour, bucket
+            hour += timedelta(hours=1)
@@ -0,0 +1,132 @@
+from datetime import datetime
+
+# Normalized event schema. Coordinates are stored as numeric lat/lon fields
+# and checked once, at ingest or migration time:
+#
+#   {"timestamp": "2025-05-05T10:00:00" | null, "lat": 37.876 | null,
+#    "lon": -122.2588 | null, "ad_id": str, "interaction_type": str,
+#    "earnings": float}
+#
+# Legacy entries carry a "(lat, lon)" string in "coordinates" instead; they
+# are still read, but `python migrate.py` rewrites the store so they stop
+# needing to be parsed.
+
+EVENT_FIELDS = ('timestamp', 'lat', 'lon', 'ad_id', 'interaction_type', 'earnings')
+INVALID_EARNINGS = 0.20  # used when an entry's earnings are missing or not numeric
+
+
+class SchemaError(ValueError):
+    def __init__(self, message, field='event'):
+        super().__init__(message)
+        self.field = field  # the part of the event at fault, the label of the parse failure metric
+
+
+def parse_coordinates(value):
+    """Parses '(lat, lon)' or 'lat,lon' into a validated (lat, lon) tuple.
+
+    Returns None for a missing or empty value and raises SchemaError for
+    anything else that is not a coordinate pair.
+    """
+    if value is None or value == '':
+        return None
+    if not isinstance(value, str):
+        raise SchemaError(f"coordinates must be a string, got {type(value).__name__}", 'coordinates')
+    text = value.strip()
+    if text.startswith('(') and text.endswith(')'):
+        text = text[1:-1]
+    parts = text.split(',')
+    if len(parts) != 2:
+        raise SchemaError(f"coordinates must have two parts: {value!r}", 'coordinates')
+    try:
+        lat, lon = float(parts[0]), float(parts[1])
+    except ValueError:
+        raise SchemaError(f"coordinates are not numeric: {value!r}", 'coordinates')
+    return validate_lat_lon(lat, lon)
+
+
+def validate_lat_lon(lat, lon):
+    if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+        raise SchemaError(f"coordinates out of range: ({lat}, {lon})", 'coordinates')
+    return lat, lon
+
+
+def parse_timestamp(value):
+    """Parses an ISO 8601 local timestamp; None/'' mean the event has no time."""
+    if value is None or value == '':
+        return None
+    try:
+        timestamp = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise SchemaError(f"timestamp is not ISO 8601: {value!r}", 'timestamp')
+    if timestamp.tzinfo is not None:
+        raise SchemaError(f"timestamp must be local time without a UTC offset: {value!r}", 'timestamp')
+    return timestamp
+
+
+def parse_earnings(value):
+    try:
+        earnings = float(value)
+    except (TypeError, ValueError):
+        raise SchemaError(f"earnings are not numeric: {value!r}", 'earnings')
+    if earnings != earnings or earnings < 0:
+        raise SchemaError(f"earnings must be a non-negative number: {value!r}", 'earnings')
+    return earnings
+
+
+def coerce_earnings(value):
+    """Returns an entry's earnings as a float, falling back to INVALID_EARNINGS."""
+    try:
+        earnings = float(value)
+    except (TypeError, ValueError):
+        return INVALID_EARNINGS
+    if earnings != earnings:  # NaN
+        return INVALID_EARNINGS
+    return earnings
+
+
+def normalize_event(raw):
+    """Converts a stored or legacy entry to the normalized schema.
+
+    Raises SchemaError naming the first problem found.
+    """
+    if not isinstance(raw, dict):
+        raise SchemaError("event must be a JSON object")
+    if 'lat' in raw or 'lon' in raw:
+        if raw.get('lat') is None or raw.get('lon') is None:
+            lat_lon = None
+        else:
+            try:
+                lat_lon = validate_lat_lon(float(raw['lat']), float(raw['lon']))
+            except (TypeError, ValueError):
+                raise SchemaError(f"lat/lon are not numeric: {raw.get('lat')!r}, {raw.get('lon')!r}",
+                                  'coordinates')
+    else:
+        lat_lon = parse_coordinates(raw.get('coordinates'))
+    timestamp = parse_timestamp(raw.get('timestamp'))
+    ad_id = raw.get('ad_id', '')
+    interaction_type = raw.get('interaction_type', '')
+    if not isinstance(ad_id, str) or not isinstance(interaction_type, str):
+        raise SchemaError("ad_id and interaction_type must be strings")
+    event = {
+        'timestamp': timestamp.isoformat() if timestamp else None,
+        'lat': lat_lon[0] if lat_lon else None,
+        'lon': lat_lon[1] if lat_lon else None,
+        'ad_id': ad_id,
+        'interaction_type': interaction_type,
+        'earnings': parse_earnings(raw.get('earnings', 0.20)),
+    }
+    # Optional: where a redeemed QR code was posted
+    if isinstance(raw.get('placement'), str):
+        event['placement'] = raw['placement']
+    return event
+
+
+def event_lat_lon(event):
+    """(lat, lon) of a stored event, or None. Only legacy entries need parsing."""
+    if 'lat' in event:
+        lat, lon = event.get('lat'), event.get('lon')
+        return (lat, lon) if lat is not None and lon is not None else None
+    try:
+        return parse_coordinates(event.get('coordinates'))
+    except SchemaError:
+        return None
@@ -0,0 +1,162 @@
+import json
+import lzma
+import os
+import struct
+import zlib
+
+from schema import SchemaError, coerce_earnings, event_lat_lon, parse_timestamp
+
+# Closed days are archived as one compressed file each:
+#
+#   <compressed NDJSON events><summary JSON><trailer>
+#
+# The trailer is the summary's length and a magic string, so a day's
+# counts, earnings and extent can be read with two small reads at the end of
+# the file, without decompressing anything. `zcat`/`xzcat` still print the
+# events (and warn about the trailing bytes).
+
+ARCHIVE_SUFFIXES = {'gzip': '.jsonl.gz', 'lzma': '.jsonl.xz'}
+TRAILER_MAGIC = b'ADWSUM1\n'
+TRAILER = struct.Struct('>Q8s')
+READ_CHUNK_SIZE = 64 * 1024
+
+
+def codec_for(path):
+    for codec, suffix in ARCHIVE_SUFFIXES.items():
+        if path.endswith(suffix):
+            return codec
+    raise ValueError(f"not a day archive: {path}")
+
+
+def _compressor(codec):
+    if codec == 'lzma':
+        return lzma.LZMACompressor()
+    return zlib.compressobj(6, zlib.DEFLATED, 31)  # wbits 31: gzip container
+
+
+def _decompressor(codec):
+    if codec == 'lzma':
+        return lzma.LZMADecompressor()
+    return zlib.decompressobj(31)
+
+
+def event_day(event):
+    """Local date of a stored event, or None when it has no valid timestamp."""
+    try:
+        timestamp = parse_timestamp(event.get('timestamp'))
+    except SchemaError:
+        return None
+    return timestamp.date() if timestamp else None
+
+
+def new_summary(day):
+    return {'day': day.isoformat(), 'count': 0, 'earnings': 0.0, 'extent': None,
+            'first': None, 'last': None, 'by_ad': {}, 'by_type': {}, 'by_hour': {}}
+
+
+def add_to_summary(summary, event):
+    earnings = coerce_earnings(event.get('earnings'))
+    summary['count'] += 1
+    summary['earnings'] += earnings
+    timestamp = event.get('timestamp')
+    if timestamp:
+        if summary['first'] is None or timestamp < summary['first']:
+            summary['first'] = timestamp
+        if summary['last'] is None or timestamp > summary['last']:
+            summary['last'] = timestamp
+        hour = str(parse_timestamp(timestamp).hour)
+        _add_totals(summary['by_hour'], hour, 1, earnings)
+    for field, key in (('by_ad', event.get('ad_id')), ('by_type', event.get('interaction_type'))):
+        if key is not None:
+            _add_totals(summary[field], key, 1, earnings)
+    coords = event_lat_lon(event)
+    if coords:
+        summary['extent'] = _union_extent(summary['extent'], [[coords[0], coords[1]], [coords[0], coords[1]]])
+
+
+def merge_summaries(a, b):
+    """Combines two summaries of the same day into a new one."""
+    merged = dict(a)
+    merged['count'] = a['count'] + b['count']
+    merged['earnings'] = a['earnings'] + b['earnings']
+    merged['extent'] = _union_extent(a['extent'], b['extent'])
+    for bound, pick in (('first', min), ('last', max)):
+        values = [v for v in (a[bound], b[bound]) if v is not None]
+        merged[bound] = pick(values) if values else None
+    for field in ('by_ad', 'by_type', 'by_hour'):
+        merged[field] = {key: list(totals) for key, totals in a[field].items()}
+        for key, (count, earnings) in b[field].items():
+            _add_totals(merged[field], key, count, earnings)
+    return merged
+
+
+def _add_totals(totals_by_key, key, count, earnings):
+    totals = totals_by_key.setdefault(key, [0, 0.0])
+    totals[0] += count
+    totals[1] += earnings
+
+
+def _union_extent(a, b):
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return [[min(a[0][0], b[0][0]), min(a[0][1], b[0][1])], [max(a[1][0], b[1][0]), max(a[1][1], b[1][1])]]
+
+
+def write_day_archive(path, day, events, codec):
+    """Writes one day's events, compressed, followed by their summary; returns the summary."""
+    summary = new_summary(day)
+    compressor = _compressor(codec)
+    with open(path, 'wb') as out:
+        for event in events:
+            out.write(compressor.compress((json.dumps(event, separators=(',', ':')) + '\n').encode('utf-8')))
+            add_to_summary(summary, event)
+        out.write(compressor.flush())
+        footer = json.dumps(summary, separators=(',', ':')).encode('utf-8')
+        out.write(footer)
+        out.write(TRAILER.pack(len(footer), TRAILER_MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+    return summary
+
+
+def _read_trailer(f):
+    """Returns (body length, summary) of an open day archive."""
+    f.seek(0, 2)
+    size = f.tell()
+    if size < TRAILER.size:
+        raise ValueError("day archive is truncated")
+    f.seek(size - TRAILER.size)
+    footer_length, magic = TRAILER.unpack(f.read(TRAILER.size))
+    if magic != TRAILER_MAGIC or footer_length > size - TRAILER.size:
+        raise ValueError("day archive has no summary footer")
+    body_length = size - TRAILER.size - footer_length
+    f.seek(body_length)
+    summary = json.loads(f.read(footer_length).decode('utf-8'))
+    return body_length, summary
+
+
+def read_summary(path):
+    with open(path, 'rb') as f:
+        return _read_trailer(f)[1]
+
+
+def iter_day_archive(f, codec):
+    """Yields the events of an open day archive, decompressing it a chunk at a time."""
+    body_length, _ = _read_trailer(f)
+    f.seek(0)
+    decompressor = _decompressor(codec)
+    remaining = body_length
+    pending = b''
+    while remaining:
+        chunk = f.read(min(READ_CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        remaining -= len(chunk)
+        pending += decompressor.decompress(chunk)
+        lines = pending.split(b'\n')
+        pending = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+
+from event_index import PostingList
+from geo import bounds_around, haversine_m
+
+GRID_CELL_DEGREES = 0.01  # ~1.1 km north-south; a campus-sized viewport touches a handful of cells
+
+
+class GridIndex:
+    """Uniform lat/lon grid over the rows of a ColumnarEvents store.
+
+    Each occupied cell holds the sorted row numbers of the events inside it,
+    and the overall extent is kept as running min/max values, so fitting a
+    map to the data is O(1) and a viewport query only reads the cells it
+    overlaps.
+    """
+
+    def __init__(self, columns, cell_degrees=GRID_CELL_DEGREES):
+        self.columns = columns
+        self.cell_degrees = cell_degrees
+        self.cells = {}  # (lon cell, lat cell) -> PostingList
+        self.size = 0
+        self.south = self.west = math.inf
+        self.north = self.east = -math.inf
+
+    def add_rows(self, start=None):
+        """Indexes rows [start:] of the columnar store (by default, everything not yet indexed)."""
+        start = self.size if start is None else start
+        lats, lons = self.columns.column('lat')[start:], self.columns.column('lon')[start:]
+        valid = ~(np.isnan(lats) | np.isnan(lons))
+        rows = np.arange(start, len(self.columns), dtype=np.int64)[valid]
+        lats, lons = lats[valid], lons[valid]
+        self.size = len(self.columns)
+        if not len(rows):
+            return
+        self.south, self.north = min(self.south, float(lats.min())), max(self.north, float(lats.max()))
+        self.west, self.east = min(self.west, float(lons.min())), max(self.east, float(lons.max()))
+
+        cell_keys = np.column_stack((np.floor(lons / self.cell_degrees).astype(np.int64),
+                                     np.floor(lats / self.cell_degrees).astype(np.int64)))
+        unique_keys, inverse = np.unique(cell_keys, axis=0, return_inverse=True)
+        inverse = inverse.ravel()
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique_keys) + 1))
+        for i, (cx, cy) in enumerate(unique_keys.tolist()):
+            posting = self.cells.get((cx, cy))
+            if posting is None:
+                posting = self.cells[(cx, cy)] = PostingList()
+            posting.extend(rows[order[bounds[i]:bounds[i + 1]]])
+
+    def extent(self):
+        """[[south, west], [north, east]] of every indexed point, or None when there are none."""
+        if self.south > self.north:
+            return None
+        return [[self.south, self.west], [self.north, self.east]]
+
+    def _cell(self, degrees):
+        return math.floor(degrees / self.cell_degrees)
+
+    def rows_in_bbox(self, bbox):
+        """Sorted row numbers of the points inside [[south, west], [north, east]]."""
+        (south, west), (north, east) = bbox
+        x0, x1 = self._cell(west), self._cell(east)
+        y0, y1 = self._cell(south), self._cell(north)
+        if (x1 - x0 + 1) * (y1 - y0 + 1) <= len(self.cells):
+            postings = [self.cells[(x, y)].view() for x in range(x0, x1 + 1) for y in range(y0, y1 + 1)
+                        if (x, y) in self.cells]
+        else:
+            # A box wider than the data: walking the occupied cells is cheaper
+            postings = [posting.view() for (x, y), posting in self.cells.items()
+                        if x0 <= x <= x1 and y0 <= y <= y1]
+        if not postings:
+            return np.empty(0, dtype=np.int64)
+        rows = np.sort(np.concatenate(postings))
+        lats, lons = self.columns.column('lat')[rows], self.columns.column('lon')[rows]
+        return rows[(lats >= south) & (lats <= north) & (lons >= west) & (lons <= east)]
+
+    def rows_within(self, lat, lon, radius_m):
+        """Sorted row numbers of the points within radius_m meters of (lat, lon)."""
+        rows = self.rows_in_bbox(bounds_around(lat, lon, radius_m))
+        distances = haversine_m(lat, lon, self.columns.column('lat')[rows], self.columns.column('lon')[rows])
+        return rows[distances <= radius_m]
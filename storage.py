@@ -0,0 +1,735 @@
+import itertools
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+
+from metrics import record_storage
+from notify import ChangeNotifier
+from readers import iter_json_array
+from segments import (ARCHIVE_SUFFIXES, codec_for, event_day, iter_day_archive, merge_summaries,
+                      read_summary, write_day_archive)
+
+# Storage layer behind DATA_FILE.
+# 'log' (default) keeps an append-only, line-delimited event log with batched
+# fsync and periodic compaction into snapshot segments. 'json' keeps the
+# original single-array data.json behaviour. 'sqlite' keeps events in one
+# SQLite database in WAL mode that several worker processes share.
+STORAGE_BACKEND = os.environ.get('ADWALK_STORAGE', 'log')
+EVENT_LOG_DIR = os.environ.get('ADWALK_EVENT_LOG_DIR', 'data_log')
+SQLITE_PATH = os.environ.get('ADWALK_SQLITE_PATH', 'adwalk.db')
+
+FSYNC_BATCH_SIZE = 64        # fsync after this many un-synced events...
+FSYNC_INTERVAL = 0.5         # ...or after this many seconds, whichever is first
+COMPACT_EVERY = 10000        # roll the live log into a snapshot segment at this size
+MAX_SNAPSHOT_SEGMENTS = 8    # merge snapshot segments once there are more than this
+SQLITE_BUSY_TIMEOUT = 30.0   # seconds a writer waits for another process's transaction
+SQLITE_READ_BATCH = 1000     # rows fetched per round trip when streaming or following
+
+# Day archival: once a local day is ARCHIVE_AFTER_DAYS old (1: from the next
+# midnight) its events move out of the snapshot segments into one compressed
+# file per day, with a summary footer (see segments.py). 0 turns archival off.
+# With RETENTION_DAYS set, archives older than that are cut down to their
+# summary, which still feeds the all-time totals. 0 keeps raw events forever.
+ARCHIVE_CODEC = os.environ.get('ADWALK_ARCHIVE_CODEC', 'gzip')  # 'gzip' or 'lzma'
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ADWALK_ARCHIVE_AFTER_DAYS', '1'))
+RETENTION_DAYS = int(os.environ.get('ADWALK_RETENTION_DAYS', '0'))
+
+LOG_NAME = 'events.log'
+SEGMENT_PREFIX = 'snapshot-'
+SEGMENT_SUFFIX = '.jsonl'
+MIGRATION_MARKER = 'MIGRATED'
+ARCHIVE_DIR = 'archive'
+DAY_PREFIX = 'day-'
+SUMMARY_SUFFIX = '.summary.json'
+NOTIFY_DIR_SUFFIX = '-notify'
+IMPORTED_KEY = 'imported_from'
+EPOCH_KEY = 'epoch'
+
+
+class JsonArrayStore:
+    """The original storage: one JSON array, rewritten in full on every append.
+
+    Reads and rewrites stream the array an element at a time (see
+    readers.py), so memory use does not grow with the file.
+    """
+
+    shared = False  # only this process writes it
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        with self._lock:
+            start = time.perf_counter()
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                # Same layout json.dump(data, f, indent=2) produced
+                f.write('[')
+                separator = '\n  '
+                for entry in itertools.chain(self._iter(), entries):
+                    f.write(separator + json.dumps(entry, indent=2).replace('\n', '\n  '))
+                    separator = ',\n  '
+                f.write('\n]' if separator != '\n  ' else ']')
+                nbytes = f.tell()
+            os.replace(tmp_path, self.path)
+            record_storage('write', nbytes, time.perf_counter() - start)
+
+    def iter_events(self, first_day=None, last_day=None):
+        # A single file: the day range cannot narrow what is read
+        return self._iter()
+
+    def expired_summaries(self):
+        return iter(())
+
+    def sync(self):
+        pass
+
+    def close(self):
+        pass
+
+    def _iter(self):
+        if not os.path.exists(self.path):
+            return
+        start = time.perf_counter()
+        nbytes = 0
+        try:
+            with open(self.path, 'r') as f:
+                for entry in iter_json_array(f, self.path):
+                    if isinstance(entry, dict):
+                        yield entry
+                    else:
+                        print(f"Skipping non-object entry in {self.path}: {entry!r}")
+                nbytes = f.tell()
+        except (IOError, ValueError) as e:
+            print(f"Error reading/parsing {self.path}: {e}")
+        finally:
+            record_storage('read', nbytes, time.perf_counter() - start)
+
+
+class EventLogStore:
+    """Append-only event log: one JSON object per line.
+
+    Appends only ever write the new lines, so ingest cost does not depend on
+    history size. Un-synced writes are fsynced in batches (by count or by age),
+    and once the live log reaches COMPACT_EVERY events, or the local date
+    changes, it is rolled into an immutable snapshot segment. Compaction runs
+    in the background: it moves closed days out into compressed per-day
+    archives and merges what is left into one segment, so the segments and
+    the live log only ever hold the last day or so.
+    """
+
+    shared = False
+
+    def __init__(self, directory, fsync_batch=FSYNC_BATCH_SIZE, fsync_interval=FSYNC_INTERVAL,
+                 compact_every=COMPACT_EVERY, max_segments=MAX_SNAPSHOT_SEGMENTS,
+                 archive_after_days=ARCHIVE_AFTER_DAYS, retention_days=RETENTION_DAYS,
+                 archive_codec=ARCHIVE_CODEC):
+        if archive_codec not in ARCHIVE_SUFFIXES:
+            raise ValueError(f"archive codec must be one of {', '.join(ARCHIVE_SUFFIXES)}")
+        self.directory = directory
+        self.fsync_batch = fsync_batch
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+        self.max_segments = max_segments
+        self.archive_after_days = archive_after_days
+        self.retention_days = retention_days
+        self.archive_codec = archive_codec
+        self.log_path = os.path.join(directory, LOG_NAME)
+        self.archive_dir = os.path.join(directory, ARCHIVE_DIR)
+
+        os.makedirs(self.archive_dir, exist_ok=True)
+        self._lock = threading.RLock()
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log_count = sum(1 for _ in self._iter_file(self.log_path))
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+        self._closed = False
+        self._compact_lock = threading.Lock()
+        self._hot_day = date.today()
+
+        self._flusher = threading.Thread(target=self._flush_loop, name='event-log-fsync', daemon=True)
+        self._flusher.start()
+
+        # A log left over from an earlier day is rolled and archived right away
+        if self._log_count and date.fromtimestamp(os.path.getmtime(self.log_path)) < self._hot_day:
+            with self._lock:
+                self._roll_locked(force_compact=True)
+
+    # --- writes ---
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        payload = ''.join(json.dumps(entry, separators=(',', ':')) + '\n' for entry in entries)
+        with self._lock:
+            today = date.today()
+            if today != self._hot_day:
+                # First write of a new day: yesterday's log becomes a segment and gets archived
+                self._hot_day = today
+                if self._log_count:
+                    self._roll_locked(force_compact=True)
+            start = time.perf_counter()
+            self._log.write(payload)
+            self._log.flush()
+            self._log_count += len(entries)
+            self._unsynced += len(entries)
+            if self._unsynced >= self.fsync_batch:
+                self._sync_locked()
+            record_storage('write', len(payload), time.perf_counter() - start)
+            if self._log_count >= self.compact_every:
+                self._roll_locked()
+
+    def sync(self):
+        """Force every appended event to stable storage."""
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._sync_locked()
+            self._log.close()
+            self._closed = True
+
+    def _sync_locked(self):
+        if self._unsynced:
+            start = time.perf_counter()
+            os.fsync(self._log.fileno())
+            record_storage('fsync', 0, time.perf_counter() - start)
+            self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def _flush_loop(self):
+        while not self._closed:
+            time.sleep(self.fsync_interval)
+            with self._lock:
+                if self._closed:
+                    return
+                if self._unsynced and time.monotonic() - self._last_sync >= self.fsync_interval:
+                    self._sync_locked()
+
+    # --- compaction ---
+
+    def _segment_paths(self):
+        names = sorted(
+            name for name in os.listdir(self.directory)
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+        )
+        return [os.path.join(self.directory, name) for name in names]
+
+    def _next_segment_path(self):
+        segments = self._segment_paths()
+        if segments:
+            last = os.path.basename(segments[-1])[len(SEGMENT_PREFIX):-len(SEGMENT_SUFFIX)]
+            number = int(last) + 1
+        else:
+            number = 1
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{number:06d}{SEGMENT_SUFFIX}")
+
+    def _roll_locked(self, force_compact=False):
+        """Turn the live log into a snapshot segment and start a fresh log."""
+        self._sync_locked()
+        self._log.close()
+        os.replace(self.log_path, self._next_segment_path())
+        self._log = open(self.log_path, 'a', encoding='utf-8')
+        self._log_count = 0
+        if force_compact or len(self._segment_paths()) > self.max_segments:
+            threading.Thread(target=self.compact, name='event-log-compact', daemon=True).start()
+
+    def compact(self):
+        """Archive closed days and merge the remaining snapshot segments into one.
+
+        Segments are immutable once written, so the work runs without holding
+        the append lock; only the final swap is done under it.
+        """
+        if not self._compact_lock.acquire(blocking=False):
+            return  # a compaction is already running
+        try:
+            if self.archive_after_days:
+                self._archive_segments()
+            else:
+                self._merge_segments()
+            if self.retention_days:
+                self._apply_retention()
+        finally:
+            self._compact_lock.release()
+
+    def _merge_segments(self):
+        segments = self._segment_paths()
+        if len(segments) < 2:
+            return
+        merged_path = segments[-1] + '.merge'
+        with open(merged_path, 'w', encoding='utf-8') as out:
+            for path in segments:
+                with open(path, 'r', encoding='utf-8') as f:
+                    for line in f:
+                        if line.endswith('\n'):
+                            out.write(line)
+            out.flush()
+            os.fsync(out.fileno())
+        with self._lock:
+            # The merged file takes the name of the newest segment, which keeps
+            # ordering intact for segments rolled while the merge was running.
+            os.replace(merged_path, segments[-1])
+            for path in segments[:-1]:
+                os.remove(path)
+
+    # --- day archives ---
+
+    def _archive_paths(self):
+        """{date: path} of every compressed day archive."""
+        archives = {}
+        for name in os.listdir(self.archive_dir):
+            if name.startswith(DAY_PREFIX) and name.endswith(tuple(ARCHIVE_SUFFIXES.values())):
+                day = date.fromisoformat(name[len(DAY_PREFIX):len(DAY_PREFIX) + 10])
+                archives[day] = os.path.join(self.archive_dir, name)
+        return archives
+
+    def _summary_paths(self):
+        """{date: path} of the days whose raw events were dropped by retention."""
+        return {
+            date.fromisoformat(name[len(DAY_PREFIX):-len(SUMMARY_SUFFIX)]): os.path.join(self.archive_dir, name)
+            for name in os.listdir(self.archive_dir)
+            if name.startswith(DAY_PREFIX) and name.endswith(SUMMARY_SUFFIX)
+        }
+
+    def _day_archive_path(self, day):
+        return os.path.join(self.archive_dir, f"{DAY_PREFIX}{day.isoformat()}{ARCHIVE_SUFFIXES[self.archive_codec]}")
+
+    def _archive_segments(self):
+        segments = self._segment_paths()
+        if not segments:
+            return
+        first_open_day = date.today() - timedelta(days=self.archive_after_days - 1)
+        closed = {}  # date -> events
+        kept = []
+        for path in segments:
+            for event in self._iter_file(path):
+                day = event_day(event)
+                if day is not None and day < first_open_day:
+                    closed.setdefault(day, []).append(event)
+                else:
+                    kept.append(event)
+        if not closed and len(segments) < 2:
+            return
+
+        # Write everything under temporary names first; readers only ever see the swap
+        archives = self._archive_paths()
+        replacements = []
+        for day, events in sorted(closed.items()):
+            existing = archives.get(day)
+            if existing:  # late events for a day that is already archived
+                with open(existing, 'rb') as f:
+                    events = list(iter_day_archive(f, codec_for(existing))) + events
+            target = self._day_archive_path(day)
+            write_day_archive(target + '.tmp', day, events, self.archive_codec)
+            replacements.append((target, existing))
+        merged_path = segments[-1] + '.merge'
+        if kept:
+            with open(merged_path, 'w', encoding='utf-8') as out:
+                for event in kept:
+                    out.write(json.dumps(event, separators=(',', ':')) + '\n')
+                out.flush()
+                os.fsync(out.fileno())
+
+        with self._lock:
+            for target, existing in replacements:
+                os.replace(target + '.tmp', target)
+                if existing and existing != target:
+                    os.remove(existing)
+            if kept:
+                os.replace(merged_path, segments[-1])
+            else:
+                os.remove(segments[-1])
+            for path in segments[:-1]:
+                os.remove(path)
+        print(f"Archived {sum(len(events) for events in closed.values())} events from "
+              f"{len(closed)} closed days; {len(kept)} events stay in the hot segments")
+
+    def _apply_retention(self):
+        """Replaces archives older than retention_days with their summaries."""
+        cutoff = date.today() - timedelta(days=self.retention_days)
+        summaries = self._summary_paths()
+        for day, path in sorted(self._archive_paths().items()):
+            if day >= cutoff:
+                continue
+            summary = read_summary(path)
+            target = os.path.join(self.archive_dir, f"{DAY_PREFIX}{day.isoformat()}{SUMMARY_SUFFIX}")
+            if day in summaries:
+                with open(summaries[day]) as f:
+                    summary = merge_summaries(json.load(f), summary)
+            with open(target + '.tmp', 'w') as out:
+                json.dump(summary, out)
+                out.flush()
+                os.fsync(out.fileno())
+            with self._lock:
+                os.replace(target + '.tmp', target)
+                os.remove(path)
+
+    def expired_summaries(self):
+        """(date, summary) for the days whose raw events retention has removed."""
+        for day, path in sorted(self._summary_paths().items()):
+            with open(path) as f:
+                yield day, json.load(f)
+
+    # --- reads ---
+
+    def iter_events(self, first_day=None, last_day=None):
+        """Every stored event, oldest archive first.
+
+        first_day/last_day skip day archives outside that range; the hot
+        files are always read, so callers still filter events themselves.
+        """
+        # Open every file up front so a concurrent roll, merge or archival
+        # cannot make the reader skip or double-count a segment.
+        with self._lock:
+            self._log.flush()
+            archives = [(path, open(path, 'rb')) for day, path in sorted(self._archive_paths().items())
+                        if (first_day is None or day >= first_day) and (last_day is None or day <= last_day)]
+            files = [(path, open(path, 'r', encoding='utf-8'))
+                     for path in self._segment_paths() + [self.log_path]]
+        try:
+            for path, f in archives:
+                yield from self._iter_archive(path, f)
+            for path, f in files:
+                yield from self._iter_lines(path, f)
+        finally:
+            for _, f in archives + files:
+                f.close()
+
+    def _iter_archive(self, path, f):
+        # Like _iter_lines, time spent by the consumer between events is not counted
+        events = iter_day_archive(f, codec_for(path))
+        seconds = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    event = next(events)
+                except StopIteration:
+                    return
+                finally:
+                    seconds += time.perf_counter() - start
+                yield event
+        finally:
+            record_storage('read', f.tell(), seconds)
+
+
+    def _iter_file(self, path):
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            yield from self._iter_lines(path, f)
+
+    def _iter_lines(self, path, f):
+        # Read time excludes whatever the consumer does between events
+        seconds, nbytes = 0.0, 0
+        try:
+            line_number = 0
+            while True:
+                start = time.perf_counter()
+                line = f.readline()
+                seconds += time.perf_counter() - start
+                line_number += 1
+                if not line.endswith('\n'):
+                    # End of file, or a torn write at the tail of the log that was never acknowledged.
+                    break
+                nbytes += len(line)
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    event = json.loads(line)
+                except json.JSONDecodeError as e:
+                    print(f"Skipping malformed event at {path}:{line_number}: {e}")
+                    continue
+                yield event
+        finally:
+            record_storage('read', nbytes, seconds)
+
+    # --- migration ---
+
+    def migrate_from_json(self, json_path):
+        """One-time import of the legacy data.json array into a snapshot segment."""
+        marker = os.path.join(self.directory, MIGRATION_MARKER)
+        if os.path.exists(marker) or not os.path.exists(json_path):
+            return 0
+        entries = JsonArrayStore(json_path).iter_events()
+        count = 0
+        with self._lock:
+            target = os.path.join(self.directory, f"{SEGMENT_PREFIX}{0:06d}{SEGMENT_SUFFIX}")
+            tmp_path = target + '.tmp'
+            with open(tmp_path, 'w', encoding='utf-8') as out:
+                for entry in entries:
+                    out.write(json.dumps(entry, separators=(',', ':')) + '\n')
+                    count += 1
+                out.flush()
+                os.fsync(out.fileno())
+            os.replace(tmp_path, target)
+            with open(marker, 'w') as f:
+                f.write(f"{os.path.abspath(json_path)}\n{count}\n")
+        print(f"Migrated {count} events from {json_path} into {self.directory}")
+        return count
+
+
+def day_key(event):
+    day = event_day(event)
+    return day.isoformat() if day else None
+
+
+class SqliteStore:
+    """Events in one SQLite database in WAL mode, shared by every worker process on the machine.
+
+    Each committed event gets the next seq, and seq is the change sequence
+    that workers follow: read_since() returns what other processes added,
+    and a ChangeNotifier wakes followers after every commit. WAL lets any
+    number of readers run alongside the single writer, and with
+    synchronous=FULL a commit is on disk once it returns, so group commits
+    from the ingest queue cost one fsync each. Day archives and retention
+    are log-backend features; summaries already cut down by retention are
+    carried over when the database is first filled from an event log.
+    """
+
+    shared = True
+
+    def __init__(self, path, busy_timeout=SQLITE_BUSY_TIMEOUT):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self.notifier = ChangeNotifier(path + NOTIFY_DIR_SUFFIX)
+        self._local = threading.local()
+        db = self._db()
+        db.execute('PRAGMA journal_mode=WAL')
+        db.executescript('''
+            CREATE TABLE IF NOT EXISTS events (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                day TEXT,
+                body TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_by_day ON events (day, seq);
+            CREATE TABLE IF NOT EXISTS summaries (day TEXT PRIMARY KEY, body TEXT NOT NULL);
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+        ''')
+        # Tells this database's seqs from those of one deleted and recreated at the same path
+        db.execute('INSERT OR IGNORE INTO meta (key, value) VALUES (?, ?)',
+                   (EPOCH_KEY, format(time.time_ns() // 1000, 'x')))
+        self.epoch = db.execute('SELECT value FROM meta WHERE key = ?', (EPOCH_KEY,)).fetchone()[0]
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                             check_same_thread=False)
+        db.execute('PRAGMA synchronous=FULL')
+        return db
+
+    def _db(self):
+        """This thread's connection; connections are never shared across threads or a fork."""
+        db = getattr(self._local, 'db', None)
+        if db is None or self._local.pid != os.getpid():
+            db = self._local.db = self._connect()
+            self._local.pid = os.getpid()
+        return db
+
+    # --- writes ---
+
+    def append(self, entry):
+        self.append_many([entry])
+
+    def append_many(self, entries):
+        if not entries:
+            return
+        rows = [(day_key(entry), json.dumps(entry, separators=(',', ':'))) for entry in entries]
+        db = self._db()
+        start = time.perf_counter()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            db.executemany('INSERT INTO events (day, body) VALUES (?, ?)', rows)
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        record_storage('write', sum(len(body) for _, body in rows), time.perf_counter() - start)
+        self.notifier.notify()
+
+    def sync(self):
+        pass  # synchronous=FULL: every commit is already durable
+
+    def close(self):
+        db = getattr(self._local, 'db', None)
+        if db is not None and self._local.pid == os.getpid():
+            db.close()
+            self._local.db = None
+        self.notifier.close()
+
+    # --- following ---
+
+    def watch(self):
+        """Starts receiving change notifications from other processes."""
+        self.notifier.listen()
+
+    def wait_for_change(self, timeout):
+        """Blocks until another process commits or `timeout` seconds pass."""
+        return self.notifier.wait(timeout)
+
+    def read_since(self, seq, limit=SQLITE_READ_BATCH):
+        """Up to `limit` events committed after `seq`, in commit order, and the seq of the last one."""
+        start = time.perf_counter()
+        rows = self._db().execute('SELECT seq, body FROM events WHERE seq > ? ORDER BY seq LIMIT ?',
+                                  (seq, limit)).fetchall()
+        if not rows:
+            return [], seq
+        record_storage('read', sum(len(body) for _, body in rows), time.perf_counter() - start)
+        return [json.loads(body) for _, body in rows], rows[-1][0]
+
+    # --- reads ---
+
+    def iter_events(self, first_day=None, last_day=None):
+        """Every stored event in commit order; first_day/last_day narrow it by the day index."""
+        clauses, params = [], []
+        if first_day is not None:
+            clauses.append('day >= ?')
+            params.append(first_day.isoformat())
+        if last_day is not None:
+            clauses.append('day <= ?')
+            params.append(last_day.isoformat())
+        where = f" WHERE {' AND '.join(clauses)}" if clauses else ''
+        return self._iter_query(f'SELECT body FROM events{where} ORDER BY seq', params)
+
+    def _iter_query(self, sql, params):
+        # A connection of its own: the read snapshot lasts as long as the iterator,
+        # which may be consumed on another thread than the one that created it
+        db = self._connect()
+        seconds, nbytes = 0.0, 0
+        try:
+            cursor = db.execute(sql, params)
+            while True:
+                start = time.perf_counter()
+                rows = cursor.fetchmany(SQLITE_READ_BATCH)
+                seconds += time.perf_counter() - start
+                if not rows:
+                    return
+                for (body,) in rows:
+                    nbytes += len(body)
+                    yield json.loads(body)
+        finally:
+            db.close()
+            record_storage('read', nbytes, seconds)
+
+    def expired_summaries(self):
+        for day, body in self._db().execute('SELECT day, body FROM summaries ORDER BY day').fetchall():
+            yield date.fromisoformat(day), json.loads(body)
+
+    # --- import and rewrite ---
+
+    def import_once(self, source, load):
+        """Fills the database from another store the first time any process opens it.
+
+        load() returns (events, summaries) iterators of the source store and
+        is only called by the process that does the import; the others wait
+        for its transaction and then find it done.
+        """
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            if db.execute('SELECT 1 FROM meta WHERE key = ?', (IMPORTED_KEY,)).fetchone():
+                db.execute('ROLLBACK')
+                return 0
+            events, summaries = load()
+            count = 0
+            for batch in iter(lambda: list(itertools.islice(events, SQLITE_READ_BATCH)), []):
+                db.executemany('INSERT INTO events (day, body) VALUES (?, ?)',
+                               [(day_key(event), json.dumps(event, separators=(',', ':'))) for event in batch])
+                count += len(batch)
+            db.executemany('INSERT OR REPLACE INTO summaries (day, body) VALUES (?, ?)',
+                           [(day.isoformat(), json.dumps(summary)) for day, summary in summaries])
+            db.execute('INSERT INTO meta (key, value) VALUES (?, ?)', (IMPORTED_KEY, source))
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+        db.execute('COMMIT')
+        if count:
+            print(f"Imported {count} events from {source} into {self.path}")
+        return count
+
+    def rewrite(self, transform, dry_run=False):
+        """Passes every event through transform(seq, event): a dict replaces it, None deletes it.
+
+        Runs as one transaction, so other processes see all of it or none of
+        it, and surviving events keep their seq. Returns how many were kept.
+        """
+        db = self._db()
+        reader = self._connect()
+        kept = 0
+        if not dry_run:
+            db.execute('BEGIN IMMEDIATE')
+        try:
+            for seq, body in reader.execute('SELECT seq, body FROM events ORDER BY seq'):
+                event = transform(seq, json.loads(body))
+                if event is not None:
+                    kept += 1
+                if dry_run:
+                    continue
+                if event is None:
+                    db.execute('DELETE FROM events WHERE seq = ?', (seq,))
+                else:
+                    db.execute('UPDATE events SET day = ?, body = ? WHERE seq = ?',
+                               (day_key(event), json.dumps(event, separators=(',', ':')), seq))
+        except BaseException:
+            if not dry_run:
+                db.execute('ROLLBACK')
+            raise
+        finally:
+            reader.close()
+        if not dry_run:
+            db.execute('COMMIT')
+            self.notifier.notify()
+        return kept
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store(data_file='data.json'):
+    """Returns the process-wide event store, creating it on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if STORAGE_BACKEND == 'json':
+                    _store = JsonArrayStore(data_file)
+                elif STORAGE_BACKEND == 'sqlite':
+                    store = SqliteStore(SQLITE_PATH)
+                    store.import_once(*_import_source(data_file))
+                    _store = store
+                else:
+                    store = EventLogStore(EVENT_LOG_DIR)
+                    store.migrate_from_json(data_file)
+                    _store = store
+    return _store
+
+
+def _import_source(data_file):
+    """(name, load) of the store a new SQLite database is filled from: the event log if there is one, else data.json."""
+    if os.path.isdir(EVENT_LOG_DIR):
+        def load():
+            log_store = EventLogStore(EVENT_LOG_DIR)
+            log_store.migrate_from_json(data_file)
+
+            def events():
+                try:
+                    yield from log_store.iter_events()
+                finally:
+                    log_store.close()
+            return events(), list(log_store.expired_summaries())
+        return EVENT_LOG_DIR, load
+    return data_file, lambda: (JsonArrayStore(data_file).iter_events(), [])